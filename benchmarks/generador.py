@@ -0,0 +1,217 @@
+import sys
+import os
+import argparse
+import random
+import sqlite3
+import uuid
+from datetime import date, timedelta
+# Raíz del proyecto al principio de la ruta: así 'streamlit' es nuestra carpeta (db_utils) y no la librería
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.db_connection import MIGRACIONES as MIGRACIONES_VETERINARIA, abrir_conexion
+from src.migraciones import aplicar_migraciones
+from src.agenda import HORA_APERTURA, DURACION_CITA, a_hora, a_minutos, horas_del_dia
+from src.tipos import a_dia
+from streamlit.db_utils import MIGRACIONES as MIGRACIONES_CLINICA
+
+# Generador determinista de datos sintéticos para los benchmarks.
+# Con la misma semilla y los mismos tamaños siempre se obtiene exactamente la misma BBDD,
+# para los dos esquemas: veterinaria.db (paquete src) y clinica_vet.db (app de Streamlit).
+#
+# Uso: python benchmarks/generador.py --clientes 10000 --mascotas 30000 --citas 500000 --historial 1000000
+
+LOTE = 5000 # Filas por executemany
+
+NOMBRES = ["Ana", "Luis", "Eva", "Juan", "Marta", "Pablo", "Lucía", "Tomás", "Sara", "Diego", "Elena", "Jorge"]
+APELLIDOS = ["García", "López", "Martín", "Sánchez", "Pérez", "Gómez", "Ruiz", "Díaz", "Moreno", "Álvarez"]
+MASCOTAS = ["Toby", "Luna", "Rex", "Kira", "Simba", "Coco", "Max", "Nala", "Bruno", "Lola", "Thor", "Mia"]
+ESPECIES = {
+    "Perro": ["Mestizo", "Labrador", "Pastor Alemán", "Beagle", "Bulldog"],
+    "Gato": ["Común Europeo", "Siamés", "Persa", "Maine Coon"],
+    "Conejo": ["Enano", "Belier"],
+    "Ave": ["Periquito", "Canario"],
+}
+VACUNAS = ["Rabia", "Moquillo", "Parvovirus", "Leptospirosis", "Trivalente felina"]
+MOTIVOS = ["Revisión", "Vacunación", "Cojera", "Dermatitis", "Control de peso", "Cirugía"]
+INICIO_CITAS = date(2024, 1, 1)
+CITAS_POR_DIA_Y_VET = len(horas_del_dia())
+
+
+class Tamanos:
+    """
+    Tamaño de la BBDD a generar. Por defecto, el de una cadena de clínicas.
+    """
+    def __init__(self, clientes=10000, mascotas=30000, citas=500000, historial=1000000, semilla=42):
+        self.clientes = clientes
+        self.mascotas = mascotas
+        self.citas = citas
+        self.historial = historial
+        self.semilla = semilla
+
+    def veterinarios(self):
+        # Los suficientes para que las citas quepan en un año sin solaparse
+        return max(3, -(-self.citas // (CITAS_POR_DIA_Y_VET * 365)))
+
+    def como_dict(self):
+        return {"clientes": self.clientes, "mascotas": self.mascotas, "citas": self.citas,
+                "historial": self.historial, "semilla": self.semilla}
+
+
+def _borrar(ruta):
+    # Empezamos de cero (también sin restos del WAL ni la instantánea de una ejecución anterior)
+    for fichero in (ruta, ruta + "-wal", ruta + "-shm", ruta + "-instantanea"):
+        if os.path.exists(fichero):
+            os.remove(fichero)
+
+def _uuid(rng):
+    # UUID "aleatorio" pero reproducible (sale del generador con semilla)
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _en_lotes(filas, sql, conn):
+    lote = []
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) >= LOTE:
+            conn.executemany(sql, lote)
+            lote.clear()
+    if lote:
+        conn.executemany(sql, lote)
+
+def _personas(rng, n):
+    # (nombre, teléfono, email) de n dueños distintos
+    for i in range(n):
+        nombre = f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}"
+        yield nombre, f"6{rng.randrange(10**8):08d}", f"cliente{i}@clinica.test"
+
+def _mascota(rng):
+    especie = rng.choice(list(ESPECIES))
+    nacimiento = date(2008, 1, 1) + timedelta(days=rng.randrange(16 * 365))
+    return rng.choice(MASCOTAS), especie, rng.choice(ESPECIES[especie]), str(nacimiento)
+
+def _huecos_citas(rng, tamanos):
+    # Reparte las citas en huecos distintos (día, veterinario, hora): nunca se solapan
+    veterinarios = [f"Dr. Vet {i:03d}" for i in range(tamanos.veterinarios())]
+    por_dia = CITAS_POR_DIA_Y_VET * len(veterinarios)
+    for i in range(tamanos.citas):
+        dia = INICIO_CITAS + timedelta(days=i // por_dia)
+        vet = veterinarios[(i // CITAS_POR_DIA_Y_VET) % len(veterinarios)]
+        hora = a_hora(HORA_APERTURA + (i % CITAS_POR_DIA_Y_VET) * DURACION_CITA)
+        yield str(dia), hora, rng.choice(MOTIVOS), vet
+
+
+def generar_veterinaria(ruta, tamanos):
+    #Crea (desde cero) una veterinaria.db con los tamaños indicados.
+    rng = random.Random(tamanos.semilla)
+    _borrar(ruta)
+    conn = abrir_conexion(ruta)
+    aplicar_migraciones(conn, MIGRACIONES_VETERINARIA)
+    # Identificador de la BBDD reproducible, sin tocar la secuencia de 'rng' (los datos no cambian)
+    id_bd = random.Random(str(tamanos.como_dict())).getrandbits(64)
+    conn.execute("UPDATE secuencia_cambios SET bd = ?", (f"{id_bd:016x}",))
+    conn.execute("PRAGMA foreign_keys = OFF") # Los datos ya son coherentes; así carga más rápido
+
+    ids_clientes = [_uuid(rng) for _ in range(tamanos.clientes)]
+    _en_lotes(((id_c, nombre, email, telefono)
+               for id_c, (nombre, telefono, email) in zip(ids_clientes, _personas(rng, tamanos.clientes))),
+              "INSERT INTO clientes (id_cliente, nombre, email, telefono) VALUES (?, ?, ?, ?)", conn)
+
+    ids_mascotas = [_uuid(rng) for _ in range(tamanos.mascotas)]
+    def mascotas():
+        # veterinaria.db guarda la fecha de nacimiento como número de día (columna DIA)
+        for i, id_m in enumerate(ids_mascotas):
+            nombre, especie, raza, nacimiento = _mascota(rng)
+            yield id_m, nombre, especie, raza, a_dia(nacimiento), ids_clientes[i % len(ids_clientes)]
+    _en_lotes(mascotas(),
+              "INSERT INTO mascotas (id_mascota, nombre, especie, raza, fecha_nacimiento, cliente_id) "
+              "VALUES (?, ?, ?, ?, ?, ?)", conn)
+
+    def citas():
+        usados = set() # El id de la cita es fecha_hora_mascota: una mascota no puede tener dos a la vez
+        for fecha, hora, motivo, vet in _huecos_citas(rng, tamanos):
+            id_cita = None
+            while id_cita is None or id_cita in usados:
+                id_mascota = rng.choice(ids_mascotas)
+                id_cita = f"{fecha}_{hora}_{id_mascota}"
+            usados.add(id_cita)
+            yield id_cita, a_dia(fecha), a_minutos(hora), motivo, vet, id_mascota
+    _en_lotes(citas(), "INSERT INTO citas (id_cita, fecha, hora, motivo, veterinario, id_mascota) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", conn)
+
+    # El historial se reparte entre las cuatro tablas
+    sql = {
+        "vacunas": "INSERT INTO vacunas (id_mascota, nombre, fecha) VALUES (?, ?, ?)",
+        "pesos": "INSERT INTO pesos (id_mascota, peso, fecha) VALUES (?, ?, ?)",
+        "observaciones": "INSERT INTO observaciones (id_mascota, texto, fecha) VALUES (?, ?, ?)",
+        "tratamientos": "INSERT INTO tratamientos (id_mascota, texto, fecha) VALUES (?, ?, ?)",
+    }
+    valores = {
+        "vacunas": lambda: rng.choice(VACUNAS),
+        "pesos": lambda: round(rng.uniform(0.5, 45), 1),
+        "observaciones": lambda: f"Observación: {rng.choice(MOTIVOS).lower()}",
+        "tratamientos": lambda: f"Tratamiento de {rng.randrange(3, 15)} días",
+    }
+    for n, tabla in enumerate(sql):
+        cuantos = tamanos.historial // 4 + (1 if n < tamanos.historial % 4 else 0)
+        _en_lotes(((rng.choice(ids_mascotas), valores[tabla](),
+                    str(INICIO_CITAS + timedelta(days=rng.randrange(365)))) for _ in range(cuantos)),
+                  sql[tabla], conn)
+
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)") # Todo en el fichero principal, listo para copiar
+    conn.close()
+
+def generar_clinica(ruta, tamanos):
+    #Crea (desde cero) una clinica_vet.db con los mismos tamaños (esquema plano de Streamlit).
+    rng = random.Random(tamanos.semilla)
+    _borrar(ruta)
+    conn = sqlite3.connect(ruta)
+    conn.execute("PRAGMA journal_mode = WAL")
+    aplicar_migraciones(conn, MIGRACIONES_CLINICA)
+
+    duenos = list(_personas(rng, tamanos.clientes))
+    _en_lotes(((*_mascota(rng), *duenos[i % len(duenos)]) for i in range(tamanos.mascotas)),
+              "INSERT INTO pacientes (nombre, especie, raza, fecha_nacimiento, propietario, telefono, email) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?)", conn)
+
+    _en_lotes(((rng.randrange(1, tamanos.mascotas + 1), fecha, hora, motivo, vet)
+               for fecha, hora, motivo, vet in _huecos_citas(rng, tamanos)),
+              "INSERT INTO citas (paciente_id, fecha, hora, motivo, veterinario) VALUES (?, ?, ?, ?, ?)", conn)
+
+    _en_lotes(((rng.randrange(1, tamanos.mascotas + 1), str(INICIO_CITAS + timedelta(days=rng.randrange(365))),
+                rng.choice(MOTIVOS), f"Tratamiento de {rng.randrange(3, 15)} días")
+               for _ in range(tamanos.historial)),
+              "INSERT INTO historial (paciente_id, fecha, descripcion, tratamiento) VALUES (?, ?, ?, ?)", conn)
+
+    conn.commit()
+    conn.execute("ANALYZE") # Estadísticas con los datos ya cargados
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def generar(destino, tamanos):
+    #Genera las dos BBDD en la carpeta 'destino'. Devuelve (ruta veterinaria, ruta clínica).
+    os.makedirs(destino, exist_ok=True)
+    ruta_veterinaria = os.path.join(destino, "veterinaria.db")
+    ruta_clinica = os.path.join(destino, "clinica_vet.db")
+    generar_veterinaria(ruta_veterinaria, tamanos)
+    generar_clinica(ruta_clinica, tamanos)
+    return ruta_veterinaria, ruta_clinica
+
+def argumentos_tamanos(parser):
+    # Opciones de tamaño comunes al generador y a la suite
+    por_defecto = Tamanos()
+    for nombre in ("clientes", "mascotas", "citas", "historial", "semilla"):
+        parser.add_argument(f"--{nombre}", type=int, default=getattr(por_defecto, nombre))
+
+def tamanos_de(args):
+    return Tamanos(args.clientes, args.mascotas, args.citas, args.historial, args.semilla)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Genera BBDD sintéticas para los benchmarks.")
+    argumentos_tamanos(parser)
+    parser.add_argument("--destino", default=os.path.join(os.path.dirname(__file__), "datos"))
+    args = parser.parse_args()
+    rutas = generar(args.destino, tamanos_de(args))
+    print(f"Generadas: {', '.join(rutas)}")
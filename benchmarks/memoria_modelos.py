@@ -0,0 +1,108 @@
+import sys
+import os
+import tracemalloc
+import uuid
+from datetime import date, timedelta
+# Igual que en las páginas: añadimos la raíz del proyecto para poder usar el paquete src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.clientes import Cliente
+from src.mascotas import Mascota
+from src.citas import Cita
+from src import utils
+
+# Benchmark de memoria de los modelos: compara las clases actuales (con __slots__,
+# historial perezoso y cadenas internadas) con las versiones de antes (con __dict__).
+# Uso: python benchmarks/memoria_modelos.py [numero_de_clientes]
+
+ESPECIES = [("Perro", "Mestizo"), ("Gato", "Siamés"), ("Perro", "Labrador"), ("Conejo", "Enano")]
+VETERINARIOS = ["Dr. Rufino", "Dra. Ana", "Dr. Tomás"]
+
+
+# --- Versiones anteriores de los modelos (un __dict__ por objeto) ---
+
+class ClienteAntiguo:
+    def __init__(self, nombre, telefono, email):
+        self.id = str(uuid.uuid4())
+        self.nombre = nombre
+        self.telefono = telefono
+        self.email = email
+        self.mascotas = []
+
+class MascotaAntigua:
+    def __init__(self, nombre, especie, raza, fecha_nacimiento, cliente_id):
+        self.id = str(uuid.uuid4())
+        self.nombre = nombre
+        self.especie = especie
+        self.raza = raza
+        self.fecha_nacimiento = fecha_nacimiento
+        self.cliente_id = cliente_id
+        self.historial_medico = {"vacunas": [], "peso": [], "observaciones": [], "tratamientos": []}
+
+class CitaAntigua:
+    def __init__(self, fecha, hora, motivo, veterinario, mascota):
+        self.fecha = fecha
+        self.hora = hora
+        self.motivo = motivo
+        self.veterinario = veterinario
+        self.mascota = mascota
+        self.id_mascota = mascota.id
+        self.id_cita = f"{fecha}_{hora}_{self.id_mascota}"
+
+
+def _texto(valor):
+    # Simula un texto leído de SQLite: una cadena nueva en cada fila aunque el valor se repita
+    return "".join(list(valor))
+
+def crear_datos(clase_cliente, clase_mascota, clase_cita, n_clientes):
+    #Crea n clientes con dos mascotas y dos citas por mascota. Devuelve las listas creadas.
+    clientes, mascotas, citas = [], [], []
+    inicio = date(2024, 1, 1)
+    for i in range(n_clientes):
+        cliente = clase_cliente(f"Cliente {i}", f"600{i:06d}", f"cliente{i}@test.com")
+        for j in range(2):
+            especie, raza = ESPECIES[(i + j) % len(ESPECIES)]
+            mascota = clase_mascota(f"Mascota {i}-{j}", _texto(especie), _texto(raza), inicio, cliente.id)
+            cliente.mascotas.append(mascota)
+            mascotas.append(mascota)
+            for k in range(2):
+                fecha = inicio + timedelta(days=(i + k) % 365)
+                hora = _texto(f"{9 + (i + j + k) % 12:02d}:00")
+                citas.append(clase_cita(fecha, hora, "Revision", _texto(VETERINARIOS[k % 3]), mascota))
+        clientes.append(cliente)
+    return clientes, mascotas, citas
+
+def medir(clase_cliente, clase_mascota, clase_cita, n_clientes):
+    #Bytes reservados (según tracemalloc) para crear todos los objetos.
+    tracemalloc.start()
+    datos = crear_datos(clase_cliente, clase_mascota, clase_cita, n_clientes)
+    memoria, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return memoria, datos
+
+def tamano_objeto(objeto):
+    #Tamaño de un objeto más su __dict__ (si lo tiene), sin contar lo que referencia.
+    return sys.getsizeof(objeto) + (sys.getsizeof(objeto.__dict__) if hasattr(objeto, "__dict__") else 0)
+
+
+if __name__ == '__main__':
+    n_clientes = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    antes, (c_antes, m_antes, ci_antes) = medir(ClienteAntiguo, MascotaAntigua, CitaAntigua, n_clientes)
+    utils.INTERNAR_CADENAS = False
+    sin_internar, _ = medir(Cliente, Mascota, Cita, n_clientes)
+    utils.INTERNAR_CADENAS = True
+    ahora, (c_ahora, m_ahora, ci_ahora) = medir(Cliente, Mascota, Cita, n_clientes)
+
+    print(f"{n_clientes} clientes, {len(m_ahora)} mascotas, {len(ci_ahora)} citas")
+    print(f"{'Objeto':<10}{'Antes (B)':>12}{'Ahora (B)':>12}")
+    for nombre, viejo, nuevo in (("Cliente", c_antes[0], c_ahora[0]),
+                                 ("Mascota", m_antes[0], m_ahora[0]),
+                                 ("Cita", ci_antes[0], ci_ahora[0])):
+        print(f"{nombre:<10}{tamano_objeto(viejo):>12}{tamano_objeto(nuevo):>12}")
+    print(f"Historial vacío por mascota (antes): {sys.getsizeof(m_antes[0].historial_medico) + 4 * sys.getsizeof([])} B")
+
+    print()
+    for etiqueta, memoria in (("antes", antes), ("con __slots__", sin_internar), ("con __slots__ + intern", ahora)):
+        print(f"Memoria total {etiqueta:<24}{memoria / 1024 / 1024:8.1f} MiB")
+    print(f"Ahorro: {(1 - ahora / antes) * 100:.0f}% ({(antes - ahora) / (len(m_ahora) + len(c_ahora) + len(ci_ahora)):.0f} B por objeto)")
@@ -0,0 +1,185 @@
+import sys
+import os
+import argparse
+import json
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+# Raíz del proyecto al principio de la ruta: así 'streamlit' es nuestra carpeta (db_utils) y no la librería
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import db_connection
+from src.veterinaria import Veterinaria
+from src.clientes import cargar_clientes_db
+from streamlit import db_utils
+from generador import generar, argumentos_tamanos, tamanos_de
+
+# Suite de benchmarks de los caminos críticos, sobre BBDD sintéticas de generador.py.
+# Guarda tiempos y pico de memoria en un JSON (línea base) y, si se le pasa otro JSON,
+# compara con él y marca las regresiones.
+#
+# Uso:
+#     python benchmarks/suite.py                                  # escala de cadena de clínicas
+#     python benchmarks/suite.py --citas 50000 --historial 100000 # más pequeña
+#     python benchmarks/suite.py --comparar benchmarks/linea_base.json --salida nueva.json
+
+CARPETA = os.path.dirname(os.path.abspath(__file__))
+UMBRAL_REGRESION = 0.20 # Más de un 20% peor que la línea base se marca como regresión
+
+
+def preparar_datos(carpeta, tamanos):
+    #Genera las BBDD si no existen (o si se pidieron con otro tamaño) y devuelve sus rutas.
+    marca = os.path.join(carpeta, "tamanos.json")
+    rutas = (os.path.join(carpeta, "veterinaria.db"), os.path.join(carpeta, "clinica_vet.db"))
+    if os.path.exists(marca) and all(os.path.exists(r) for r in rutas):
+        with open(marca) as f:
+            if json.load(f) == tamanos.como_dict():
+                return rutas
+    print("Generando datos sintéticos (solo la primera vez)...")
+    rutas = generar(carpeta, tamanos)
+    with open(marca, "w") as f:
+        json.dump(tamanos.como_dict(), f)
+    return rutas
+
+def medir(funcion, repeticiones):
+    #Ejecuta 'funcion' varias veces y devuelve tiempos y pico de memoria.
+    # La memoria se mide en una ejecución aparte: tracemalloc ralentiza y falsearía los tiempos.
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "segundos_mediana": statistics.median(tiempos),
+        "segundos_min": min(tiempos),
+        "repeticiones": repeticiones,
+        "pico_memoria_kib": round(pico / 1024),
+    }
+
+
+def casos(ruta_veterinaria, ruta_clinica, semilla):
+    #Devuelve la lista de (nombre, función, repeticiones) a medir.
+    rng = random.Random(semilla)
+    db_connection.DB_NAME = ruta_veterinaria
+    db_utils.DB_NAME = ruta_clinica
+    veterinaria = Veterinaria() # Primera carga (calienta la caché del sistema de ficheros)
+
+    ids_mascotas = list(veterinaria._mascotas_por_id)
+    ids_buscados = [rng.choice(ids_mascotas) for _ in range(100000)]
+    mascotas = [veterinaria.buscar_mascota_por_id(i) for i in rng.sample(ids_mascotas, 500)]
+
+    def buscar_mascotas():
+        for id_mascota in ids_buscados:
+            veterinaria.buscar_mascota_por_id(id_mascota)
+
+    def inicializar(instantanea=False):
+        # Sin instantánea se mide la carga desde SQL; con ella, un arranque con la BBDD sin cambios
+        veterinaria.usar_instantanea = instantanea
+        veterinaria.inicializar()
+
+    dias_usados = [0] # Cada repetición reserva en días nuevos, para no chocar con la anterior
+    def crear_citas():
+        # 500 citas de un veterinario nuevo, 12 al día (una por hueco libre)
+        dia = date(2030, 1, 1) + timedelta(days=dias_usados[0])
+        for n, mascota in enumerate(mascotas):
+            veterinaria.crear_cita(dia + timedelta(days=n // 12), f"{9 + n % 12}:00", "Revisión",
+                                   "Dr. Benchmark", mascota)
+        dias_usados[0] += len(mascotas) // 12 + 1
+
+    def buscar_pacientes():
+        db_utils.cache_consultas.limpiar() # Medimos las consultas, no la caché
+        for texto in ("tob", "luna gato", "garcía", "labrador max", "cliente123"):
+            db_utils.buscar_pacientes(texto)
+
+    def paginar_citas(fria=True):
+        # Primera página de Gestion_citas y 20 "Siguiente"
+        if fria:
+            db_utils.cache_consultas.limpiar()
+        pagina = db_utils.listar_citas()
+        for _ in range(20):
+            pagina = db_utils.listar_citas(pagina.cursor_siguiente)
+
+    return [
+        ("veterinaria_inicializar", inicializar, 3),
+        ("veterinaria_inicializar_instantanea", lambda: inicializar(instantanea=True), 3),
+        ("cargar_clientes_db", cargar_clientes_db, 5),
+        ("buscar_mascota_por_id_x100k", buscar_mascotas, 5),
+        ("crear_cita_x500", crear_citas, 3),
+        ("ver_mascotas_busqueda_fts_x5", buscar_pacientes, 10),
+        ("gestion_citas_join_21_paginas", paginar_citas, 10),
+        ("gestion_citas_21_paginas_en_cache", lambda: paginar_citas(fria=False), 10), # Rerun de la página
+    ]
+
+
+def comparar(resultados, linea_base, umbral=UMBRAL_REGRESION):
+    #Imprime la diferencia con la línea base. Devuelve la lista de regresiones.
+    regresiones = []
+    for nombre, actual in resultados.items():
+        anterior = linea_base.get("resultados", {}).get(nombre)
+        if not anterior:
+            continue
+        # El mínimo es mucho más estable que la mediana entre ejecuciones (el ruido solo suma)
+        for clave in ("segundos_min", "pico_memoria_kib"):
+            if not anterior[clave]:
+                continue
+            cambio = actual[clave] / anterior[clave] - 1
+            marca = ""
+            if cambio > umbral:
+                regresiones.append((nombre, clave, cambio))
+                marca = "  <-- REGRESIÓN"
+            print(f"  {nombre:<32}{clave:<20}{cambio:+8.1%}{marca}")
+    return regresiones
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks de los caminos críticos.")
+    argumentos_tamanos(parser)
+    parser.add_argument("--datos", default=os.path.join(CARPETA, "datos"), help="Carpeta de las BBDD generadas")
+    parser.add_argument("--salida", default=os.path.join(CARPETA, "linea_base.json"))
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior con el que comparar")
+    args = parser.parse_args()
+
+    tamanos = tamanos_de(args)
+    originales = preparar_datos(args.datos, tamanos)
+
+    # Trabajamos sobre copias: crear_cita escribe y no queremos ensuciar los datos generados
+    with tempfile.TemporaryDirectory() as temporal:
+        copias = [shutil.copy(ruta, temporal) for ruta in originales]
+        resultados = {}
+        for nombre, funcion, repeticiones in casos(*copias, tamanos.semilla):
+            resultados[nombre] = medir(funcion, repeticiones)
+            print(f"{nombre:<32}{resultados[nombre]['segundos_mediana'] * 1000:10.1f} ms"
+                  f"{resultados[nombre]['pico_memoria_kib']:12d} KiB")
+        Veterinaria().historial_pendiente.vaciar()
+        db_connection.cerrar_pools()
+
+    informe = {
+        "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "maquina": platform.platform(),
+        "tamanos": tamanos.como_dict(),
+        "resultados": resultados,
+    }
+    with open(args.salida, "w") as f:
+        json.dump(informe, f, indent=2)
+    print(f"Resultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            linea_base = json.load(f)
+        if linea_base.get("tamanos") != informe["tamanos"]:
+            print("Aviso: la línea base se midió con otros tamaños de datos.")
+        print(f"Comparación con {args.comparar}:")
+        if comparar(resultados, linea_base):
+            sys.exit(1)
@@ -1,4 +1,5 @@
 # src/__init__.py
 
-# Solo exportamos la clase principal para que sea accesible desde fuera
-from .veterinaria import Veterinaria
+# Exportamos la clase principal (y el acceso compartido a ella) para que sea accesible desde fuera
+from .veterinaria import Veterinaria, obtener_veterinaria
+from .utils import Utils
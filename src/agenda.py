@@ -0,0 +1,122 @@
+from bisect import bisect_left, insort
+from datetime import time, timedelta
+from .exceptions import CitaSolapadaError
+
+# Horario de la clínica (en minutos desde medianoche) y duración de cada cita
+HORA_APERTURA = 9 * 60
+HORA_CIERRE = 21 * 60 # La última cita empieza a las 20:00
+DURACION_CITA = 60
+
+
+def a_minutos(hora):
+    #Convierte 'HH:MM' (o un datetime.time) a minutos desde medianoche.
+    if isinstance(hora, int):
+        return hora # Ya viene en minutos
+    valor = _MINUTOS_DE_TEXTO.get(hora) if type(hora) is str else None
+    if valor is not None:
+        return valor # Hora ya normalizada: sin partir el texto
+    if isinstance(hora, time):
+        return hora.hour * 60 + hora.minute
+    horas, minutos = str(hora).strip().split(":")[:2]
+    valor = int(horas) * 60 + int(minutos)
+    if not 0 <= valor < 24 * 60:
+        raise ValueError(f"Hora fuera de rango: {hora}")
+    return valor
+
+def a_hora(minutos):
+    #Convierte minutos desde medianoche a texto 'HH:MM' (siempre con dos cifras).
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+# 'HH:MM' -> minutos para las 1440 horas normalizadas (así vienen de la BBDD y de normalizar_hora)
+_MINUTOS_DE_TEXTO = {a_hora(minutos): minutos for minutos in range(24 * 60)}
+
+def normalizar_hora(hora):
+    #'9:5' -> '09:05'. Así las horas se pueden comparar como texto en SQLite.
+    return a_hora(a_minutos(hora))
+
+def horas_del_dia(duracion=DURACION_CITA):
+    #Todas las horas de inicio posibles de un día, en minutos.
+    return range(HORA_APERTURA, HORA_CIERRE - duracion + 1, duracion)
+
+def limites_solape(hora, duracion=DURACION_CITA):
+    #Rango abierto ('desde', 'hasta') de horas de inicio que chocarían con una cita a 'hora'.
+    # Se devuelve como texto para poder usarlo en un "hora > ? AND hora < ?" sobre el índice.
+    inicio = a_minutos(hora)
+    desde = a_hora(inicio - duracion) if inicio - duracion >= 0 else ""
+    hasta = a_hora(inicio + duracion) if inicio + duracion < 24 * 60 else "24:00"
+    return desde, hasta
+
+
+class Agenda:
+    """
+    Índice de huecos ocupados por veterinario y día.
+    Para cada (veterinario, fecha) guarda una lista ordenada con la hora de inicio
+    (en minutos) de cada cita, así comprobar un solape es una búsqueda binaria.
+    """
+    def __init__(self, duracion=DURACION_CITA):
+        self.duracion = duracion
+        self._ocupado = {}
+
+    def esta_libre(self, veterinario, fecha, hora):
+        #True si el veterinario no tiene ninguna cita que se solape con una nueva a esa hora.
+        inicios = self._ocupado.get((veterinario, fecha))
+        if not inicios:
+            return True
+        inicio = a_minutos(hora)
+        # Solo pueden chocar la cita anterior y la siguiente en la lista ordenada
+        i = bisect_left(inicios, inicio)
+        if i < len(inicios) and inicios[i] - inicio < self.duracion:
+            return False
+        if i > 0 and inicio - inicios[i - 1] < self.duracion:
+            return False
+        return True
+
+    def anadir(self, veterinario, fecha, hora):
+        #Marca el hueco como ocupado. Lanza CitaSolapadaError si choca con otra cita.
+        inicio = a_minutos(hora)
+        if not self.esta_libre(veterinario, fecha, inicio):
+            raise CitaSolapadaError(veterinario, fecha, hora)
+        insort(self._ocupado.setdefault((veterinario, fecha), []), inicio)
+
+    def anadir_lote(self, citas):
+        #Marca de una vez los huecos de muchas citas (veterinario, fecha, hora), al cargar.
+        # Cada día se ordena una sola vez en vez de insertar cita a cita. Si dos citas se
+        # solapan se queda la más temprana (la otra se carga, pero no ocupa hueco).
+        por_dia = {}
+        for veterinario, fecha, hora in citas:
+            try:
+                por_dia.setdefault((veterinario, fecha), []).append(a_minutos(hora))
+            except ValueError:
+                pass # Hora mal escrita: la cita no ocupa hueco
+        for clave, inicios in por_dia.items():
+            if clave in self._ocupado: # El día ya tenía citas: se comprueban una a una
+                for inicio in inicios:
+                    if self.esta_libre(*clave, inicio):
+                        insort(self._ocupado[clave], inicio)
+                continue
+            inicios.sort()
+            ocupados = self._ocupado[clave] = []
+            for inicio in inicios:
+                if not ocupados or inicio - ocupados[-1] >= self.duracion:
+                    ocupados.append(inicio)
+
+    def quitar(self, veterinario, fecha, hora):
+        #Libera el hueco (por ejemplo, al borrar la cita o a su cliente).
+        inicios = self._ocupado.get((veterinario, fecha))
+        if inicios:
+            inicio = a_minutos(hora)
+            i = bisect_left(inicios, inicio)
+            if i < len(inicios) and inicios[i] == inicio:
+                del inicios[i]
+
+    def huecos_libres(self, veterinario, desde, hasta=None):
+        #Horas libres ('HH:MM') de un veterinario para cada día entre 'desde' y 'hasta' (incluidos).
+        # Devuelve un diccionario fecha -> lista de horas.
+        hasta = hasta or desde
+        resultado = {}
+        dia = desde
+        while dia <= hasta:
+            resultado[dia] = [a_hora(m) for m in horas_del_dia(self.duracion)
+                              if self.esta_libre(veterinario, dia, m)]
+            dia += timedelta(days=1)
+        return resultado
@@ -0,0 +1,106 @@
+import threading
+from array import array
+from .agenda import a_minutos
+from .tipos import HORAS
+
+# Días entre date.toordinal() y la época de NumPy (1970-01-01)
+_ORDINAL_1970 = 719163
+
+COLUMNAS = ("Fecha", "Hora", "Mascota", "Dueño", "Veterinario", "Motivo")
+
+
+class AlmacenCitas:
+    """
+    Las citas guardadas por columnas (una lista o array por campo, todas en paralelo)
+    para poder sacar la tabla de citas de golpe, sin recorrer los objetos Cita campo a campo.
+    Fecha y hora van en arrays de enteros (día y minutos) que NumPy puede leer sin copiarlos.
+    """
+    def __init__(self):
+        self.fechas = array("i") # date.toordinal()
+        self.horas = array("h") # Minutos desde medianoche
+        self.ids_cita = []
+        self.ids_mascota = []
+        self.mascotas = [] # Nombre de la mascota
+        self.veterinarios = []
+        self.motivos = []
+        self.duenos = {} # id_mascota -> nombre del dueño
+        self._cerrojo = threading.Lock() # Un array no puede crecer mientras NumPy lo está leyendo
+
+    def __len__(self):
+        return len(self.ids_cita)
+
+    def anadir(self, cita, dueno, id_cita=None):
+        #Añade una cita al final de cada columna (O(1) amortizado). 'id_cita' si ya se tiene calculado.
+        with self._cerrojo:
+            self.fechas.append(cita.fecha.toordinal())
+            self.horas.append(a_minutos(cita.hora))
+            self.ids_cita.append(id_cita or cita.id_cita)
+            self.ids_mascota.append(cita.id_mascota)
+            self.mascotas.append(cita.mascota.nombre)
+            self.veterinarios.append(cita.veterinario)
+            self.motivos.append(cita.motivo)
+            self.duenos[cita.id_mascota] = dueno
+
+    def anadir_lote(self, citas, ids_cita, duenos):
+        #Como anadir() pero con muchas citas a la vez (al cargar): cada columna crece de golpe.
+        # 'duenos' es id_mascota -> nombre del dueño.
+        with self._cerrojo:
+            self.fechas.extend(c.fecha.toordinal() for c in citas)
+            self.horas.extend(a_minutos(c.hora) for c in citas)
+            self.ids_cita += ids_cita
+            ids_mascota = [c.mascota.id for c in citas]
+            self.ids_mascota += ids_mascota
+            self.mascotas += [c.mascota.nombre for c in citas]
+            self.veterinarios += [c.veterinario for c in citas]
+            self.motivos += [c.motivo for c in citas]
+            self.duenos.update((id_mascota, duenos.get(id_mascota, "")) for id_mascota in set(ids_mascota))
+
+    def quitar(self, ids_cita=(), ids_mascota=()):
+        #Quita las citas con esos ids o de esas mascotas. Rehace las columnas: O(n), pero solo al borrar.
+        ids_cita, ids_mascota = set(ids_cita), set(ids_mascota)
+        with self._cerrojo:
+            for id_mascota in ids_mascota:
+                self.duenos.pop(id_mascota, None)
+            seguir = [i for i, (id_c, id_m) in enumerate(zip(self.ids_cita, self.ids_mascota))
+                      if id_c not in ids_cita and id_m not in ids_mascota]
+            if len(seguir) == len(self.ids_cita):
+                return
+            self.fechas = array("i", (self.fechas[i] for i in seguir))
+            self.horas = array("h", (self.horas[i] for i in seguir))
+            for nombre in ("ids_cita", "ids_mascota", "mascotas", "veterinarios", "motivos"):
+                columna = getattr(self, nombre)
+                setattr(self, nombre, [columna[i] for i in seguir])
+
+    def poner_dueno(self, ids_mascota, dueno):
+        #Cambia el nombre del dueño que sale en las citas de esas mascotas.
+        with self._cerrojo:
+            for id_mascota in ids_mascota:
+                if id_mascota in self.duenos:
+                    self.duenos[id_mascota] = dueno
+
+    def a_dataframe(self, desde=None, hasta=None):
+        #DataFrame de pandas con las citas (entre 'desde' y 'hasta' si se dan), ordenado por fecha y hora.
+        # Todo se hace por columnas con NumPy; fecha y hora se leen de los arrays sin copiarlos.
+        import numpy as np
+        import pandas as pd # Solo lo necesitan las páginas de Streamlit
+
+        with self._cerrojo:
+            if not self.ids_cita:
+                return pd.DataFrame(columns=list(COLUMNAS))
+            fechas = np.frombuffer(self.fechas, dtype=np.intc)
+            horas = np.frombuffer(self.horas, dtype=np.short)
+            filas = np.arange(len(fechas))
+            if desde is not None:
+                filas = filas[(fechas >= desde.toordinal()) & (fechas <= (hasta or desde).toordinal())]
+            filas = filas[np.lexsort((horas[filas], fechas[filas]))]
+            ids_mascota = np.array(self.ids_mascota, dtype=object)[filas]
+            datos = {
+                "Fecha": (fechas[filas] - _ORDINAL_1970).astype("datetime64[D]"),
+                "Hora": np.array(HORAS, dtype=object)[horas[filas]],
+                "Mascota": np.array(self.mascotas, dtype=object)[filas],
+                "Dueño": pd.Series(ids_mascota).map(self.duenos).to_numpy(),
+                "Veterinario": np.array(self.veterinarios, dtype=object)[filas],
+                "Motivo": np.array(self.motivos, dtype=object)[filas],
+            }
+            del fechas, horas # Soltamos las vistas antes de que el array pueda volver a crecer
+        return pd.DataFrame(datos, columns=list(COLUMNAS))
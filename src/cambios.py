@@ -0,0 +1,111 @@
+# Seguimiento de cambios en clientes, mascotas y citas (migración 7 en db_connection.py).
+# Un contador global (tabla secuencia_cambios) sube con cada fila que se inserta, modifica o
+# borra. Los triggers ponen ese número en la columna 'version' de la fila y, al borrar, dejan
+# una lápida con la clave en 'borrados'. Quien guarde el último número que vio solo tiene que
+# pedir lo que tenga un número mayor: leer los cambios cuesta lo que se ha cambiado, no lo que
+# ocupa la BBDD. Apuntar, corregir o borrar algo en el historial médico cuenta como un cambio
+# de la mascota (las altas desde la migración 7, lo demás desde la 9).
+#
+# Es un contador y no una fecha de modificación: dos escrituras en el mismo instante o un reloj
+# que se atrasa harían perder cambios, y el contador sube dentro de la misma transacción.
+
+# Tabla -> (clave primaria, columnas cuyo cambio sube la versión de la fila)
+TABLAS_SEGUIDAS = {
+    "clientes": ("id_cliente", ("nombre", "apellido", "email", "telefono")),
+    "mascotas": ("id_mascota", ("nombre", "especie", "raza", "fecha_nacimiento", "cliente_id")),
+    "citas": ("id_cita", ("fecha", "hora", "motivo", "veterinario", "id_mascota")),
+}
+TABLAS_HISTORIAL = ("vacunas", "pesos", "observaciones", "tratamientos")
+
+_SUBIR = "UPDATE secuencia_cambios SET valor = valor + 1;"
+_VALOR = "(SELECT valor FROM secuencia_cambios)"
+
+
+def seguir_cambios(conn):
+    #Paso de migración: contador, tabla de lápidas, columna 'version' (con índice) y triggers.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS secuencia_cambios (
+            id INTEGER PRIMARY KEY CHECK (id = 1), -- Una sola fila
+            valor INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO secuencia_cambios (id, valor) VALUES (1, 0)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS borrados (
+            secuencia INTEGER PRIMARY KEY,
+            tabla TEXT NOT NULL,
+            clave TEXT NOT NULL
+        )
+    """)
+    for tabla, (clave, columnas) in TABLAS_SEGUIDAS.items():
+        # Las filas que ya había se quedan con versión 0: están en cualquier carga completa
+        conn.execute(f"ALTER TABLE {tabla} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabla}_version ON {tabla} (version)")
+        marcar = f"UPDATE {tabla} SET version = {_VALOR} WHERE {clave} = NEW.{clave};"
+        conn.execute(f"CREATE TRIGGER {tabla}_alta AFTER INSERT ON {tabla} BEGIN {_SUBIR} {marcar} END")
+        # Solo las columnas de datos: el UPDATE de 'version' del propio trigger no vuelve a dispararlo
+        conn.execute(f"CREATE TRIGGER {tabla}_cambio AFTER UPDATE OF {', '.join(columnas)} ON {tabla} "
+                     f"BEGIN {_SUBIR} {marcar} END")
+        # También salta con los ON DELETE CASCADE: borrar un cliente deja lápidas de sus mascotas y citas
+        conn.execute(f"CREATE TRIGGER {tabla}_baja AFTER DELETE ON {tabla} BEGIN {_SUBIR} "
+                     f"INSERT INTO borrados (secuencia, tabla, clave) VALUES ({_VALOR}, '{tabla}', OLD.{clave}); END")
+    for tabla in TABLAS_HISTORIAL:
+        conn.execute(f"CREATE TRIGGER {tabla}_mascota AFTER INSERT ON {tabla} BEGIN {_SUBIR} "
+                     f"UPDATE mascotas SET version = {_VALOR} WHERE id_mascota = NEW.id_mascota; END")
+
+
+def seguir_cambios_historial(conn):
+    #Paso de migración: corregir o borrar un registro del historial también sube la versión de la
+    # mascota (la migración 7 solo lo hacía al insertar). Sin esto, ni refrescar() ni el sello de la
+    # instantánea se enteraban de un DELETE en vacunas, por ej.
+    for tabla in TABLAS_HISTORIAL:
+        conn.execute(f"CREATE TRIGGER {tabla}_mascota_cambio AFTER UPDATE ON {tabla} BEGIN {_SUBIR} "
+                     f"UPDATE mascotas SET version = {_VALOR} WHERE id_mascota IN (NEW.id_mascota, OLD.id_mascota); END")
+        # Con el ON DELETE CASCADE de una mascota también salta, pero esa fila se está borrando: no hace nada
+        conn.execute(f"CREATE TRIGGER {tabla}_mascota_baja AFTER DELETE ON {tabla} BEGIN {_SUBIR} "
+                     f"UPDATE mascotas SET version = {_VALOR} WHERE id_mascota = OLD.id_mascota; END")
+
+
+class Cambios:
+    """
+    Lo que ha cambiado en la BBDD desde una secuencia dada (ver leer_cambios).
+    """
+    def __init__(self, secuencia):
+        self.secuencia = secuencia # Valor del contador al leer: la siguiente marca de agua
+        self.borrados = {tabla: [] for tabla in TABLAS_SEGUIDAS} # tabla -> claves borradas
+        self.clientes = [] # (id_cliente, nombre, email, telefono)
+        self.mascotas = [] # (id_mascota, nombre, especie, raza, fecha_nacimiento, cliente_id)
+        self.citas = [] # Mismas columnas que leer_citas_db
+
+    def __len__(self):
+        return sum(map(len, self.borrados.values())) + len(self.clientes) + len(self.mascotas) + len(self.citas)
+
+
+def secuencia_actual():
+    #Valor actual del contador de cambios.
+    from .db_connection import conexion
+    with conexion() as conn:
+        return conn.execute("SELECT valor FROM secuencia_cambios").fetchone()[0]
+
+def leer_cambios(desde):
+    #Filas nuevas o modificadas y claves borradas con secuencia mayor que 'desde'.
+    # Todo se lee en una misma transacción, así las consultas ven la misma foto de la BBDD.
+    from .db_connection import conexion
+    with conexion() as conn:
+        conn.execute("BEGIN")
+        cambios = Cambios(conn.execute("SELECT valor FROM secuencia_cambios").fetchone()[0])
+        if cambios.secuencia <= desde:
+            return cambios
+        for tabla, clave in conn.execute("SELECT tabla, clave FROM borrados WHERE secuencia > ? ORDER BY secuencia",
+                                         (desde,)):
+            cambios.borrados[tabla].append(clave)
+        cambios.clientes = conn.execute(
+            "SELECT id_cliente, nombre, email, telefono FROM clientes WHERE version > ? ORDER BY version",
+            (desde,)).fetchall()
+        cambios.mascotas = conn.execute(
+            "SELECT id_mascota, nombre, especie, raza, fecha_nacimiento, cliente_id FROM mascotas "
+            "WHERE version > ? ORDER BY version", (desde,)).fetchall()
+        cambios.citas = conn.execute(
+            "SELECT id_cita, fecha, hora, motivo, veterinario, id_mascota FROM citas "
+            "WHERE version > ? ORDER BY version", (desde,)).fetchall()
+    return cambios
@@ -1,42 +1,113 @@
 from datetime import date
-from .db_connection import get_connection
+from .db_connection import conexion
+from .agenda import a_minutos, a_hora, DURACION_CITA
+from .tipos import a_dia
+from . import cola_escritura
+from .exceptions import CitaSolapadaError, BaseDatosOcupadaError
+from .utils import Utils
+
+def id_cita_de(fecha, hora, id_mascota):
+    # ID único basado en fecha, hora y el ID de la mascota
+    return f"{fecha}_{hora}_{id_mascota}"
 
 class Cita:
     """
     Representa una cita médica programada en la clínica.
     """
-    def __init__(self, fecha: date, hora: str, motivo: str, veterinario: str, mascota):
+    # Atributos fijos (sin __dict__ por objeto)
+    __slots__ = ("fecha", "hora", "motivo", "veterinario", "mascota", "id_cita")
+
+    def __init__(self, fecha: date, hora: str, motivo: str, veterinario: str, mascota, id_cita=None):
         self.fecha = fecha
-        self.hora = hora
+        self.hora = Utils.internar(hora)
         self.motivo = motivo
-        self.veterinario = veterinario
+        self.veterinario = Utils.internar(veterinario) # Se repite en miles de citas
         self.mascota = mascota
-        
+        # Se fija al crearla: si luego cambian la fecha o la hora, la cita sigue siendo la misma fila.
+        # Al cargar de la BBDD o de la instantánea llega el guardado y no hace falta generarlo.
+        self.id_cita = id_cita if id_cita is not None else id_cita_de(fecha, self.hora, mascota.id)
+
+    @property
+    def id_mascota(self):
         # El ID de la mascota es crucial para la BBDD
-        self.id_mascota = mascota.id 
-        
-        # Genera un ID único basado en fecha, hora y el ID de la mascota
-        self.id_cita = f"{fecha}_{hora}_{self.id_mascota}"
+        return self.mascota.id
+
+
+def _insertar_cita(conn, id_cita, dia, minutos, motivo, veterinario, id_mascota):
+    # El INSERT solo se hace si el veterinario no tiene otra cita que se solape ese día
+    # (la comprobación usa el índice (veterinario, fecha, hora) y va en la misma sentencia,
+    # así dos sesiones no pueden coger el mismo hueco).
+    cursor = conn.execute(
+        """
+        INSERT INTO citas (id_cita, fecha, hora, motivo, veterinario, id_mascota)
+        SELECT ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM citas
+            WHERE veterinario = ? AND fecha = ? AND hora > ? AND hora < ?
+        )
+        """,
+        (id_cita, dia, minutos, motivo, veterinario, id_mascota,
+         veterinario, dia, minutos - DURACION_CITA, minutos + DURACION_CITA)
+    )
+    if cursor.rowcount != 1:
+        raise CitaSolapadaError(veterinario, date.fromordinal(dia), a_hora(minutos))
+    return True
+
+cola_escritura.registrar_operacion("cita", _insertar_cita)
 
+def guardar_cita_db(nueva_cita):
+    #Manda a guardar la cita (por la cola de escritura si está activa). Devuelve un Future,
+    # que falla con CitaSolapadaError si el hueco ya estaba cogido en la BBDD.
+    return cola_escritura.guardar("cita", nueva_cita.id_cita, a_dia(nueva_cita.fecha), a_minutos(nueva_cita.hora),
+                                  nueva_cita.motivo, nueva_cita.veterinario, nueva_cita.id_mascota)
 
 def registrar_cita_db(nueva_cita):
     #Inserta una nueva cita en la tabla 'citas' de SQLite.
-    conn = get_connection()
-    cursor = conn.cursor()
-    
+    # Si choca con otra cita del mismo veterinario lanza CitaSolapadaError, y si la BBDD
+    # sigue bloqueada por otro proceso tras los reintentos, BaseDatosOcupadaError.
     try:
-        cursor.execute(
-            nueva_cita.id_cita, 
-            str(nueva_cita.fecha),
-            nueva_cita.hora, 
-            nueva_cita.motivo, 
-            nueva_cita.veterinario, 
-            nueva_cita.id_mascota
-        )
-        conn.commit()
-        return True
+        return cola_escritura.esperar(guardar_cita_db(nueva_cita))
+    except (CitaSolapadaError, BaseDatosOcupadaError):
+        raise
     except Exception as e:
         print(f"Error al registrar cita en DB: {e}")
         return False
-    finally:
-        conn.close()
\ No newline at end of file
+
+
+def leer_citas_db(desde=None, hasta=None):
+    #Filas (id_cita, fecha, hora, motivo, veterinario, id_mascota) de las citas.
+    # Si se dan 'desde' y 'hasta' solo las de esas fechas (incluidas), usando idx_citas_fecha.
+    try:
+        with conexion() as conn:
+            cursor = conn.cursor()
+            if desde is None:
+                # Pedimos todas las citas
+                cursor.execute("SELECT id_cita, fecha, hora, motivo, veterinario, id_mascota FROM citas")
+            else:
+                cursor.execute(
+                    "SELECT id_cita, fecha, hora, motivo, veterinario, id_mascota FROM citas "
+                    "WHERE fecha BETWEEN ? AND ?", (a_dia(desde), a_dia(hasta)))
+            return cursor.fetchall()
+    except Exception as e:
+        print(f" Error cargando citas: {e}")
+        return []
+
+def construir_citas(rows, mascotas_por_id):
+    #Convierte filas de leer_citas_db en objetos Cita enlazados con su objeto Mascota.
+    # Las citas de mascotas que no están en el diccionario se ignoran.
+    # La fecha y la hora ya llegan convertidas (date y 'HH:MM') por los tipos DIA y MINUTOS.
+    citas_memoria = []
+    for row in rows:
+        id_c, fecha, hora, motivo, vet, id_mascota = row
+        
+        # Buscar el objeto mascota real en memoria usando el ID
+        mascota_obj = mascotas_por_id.get(id_mascota)
+        
+        if mascota_obj:
+            # Recreamos el objeto Cita con su ID original
+            citas_memoria.append(Cita(fecha, hora, motivo, vet, mascota_obj, id_c))
+    return citas_memoria
+
+def cargar_citas_db(mascotas_por_id):
+    #Lee todas las citas y las enlaza con su objeto Mascota (diccionario id -> mascota).
+    return construir_citas(leer_citas_db(), mascotas_por_id)
@@ -1,10 +1,17 @@
 import uuid #Para generar IDs aleatorios y distintos
 import sqlite3 #Para mirar en la BBDD si un cliente esta repetido por ej.
-from datetime import date, datetime
-from .db_connection import get_connection
+import threading
+from .db_connection import conexion
+from . import cola_escritura, escritor
+from .exceptions import BaseDatosOcupadaError
+
+TAMANO_LOTE = 1000 # Clientes que leemos de SQLite de cada vez
 
 class Cliente:
-    def __init__(self, nombre: str, telefono: str, email: str, id_cliente: str = None):
+    # Con __slots__ cada objeto guarda sus atributos en huecos fijos en vez de en un __dict__
+    __slots__ = ("id", "nombre", "telefono", "email", "_mascotas")
+
+    def __init__(self, nombre: str, telefono: str, email: str, id_cliente: str = None, mascotas_pendientes: bool = False):
         
         if id_cliente is None:
             self.id = str(uuid.uuid4()) #Genera un ID unico e irrepetible
@@ -14,104 +21,182 @@ class Cliente:
         self.nombre = nombre
         self.telefono = telefono
         self.email = email
-        self.mascotas = [] #La mascota pertenece al cliente
+        # La mascota pertenece al cliente. Con mascotas_pendientes=True (carga perezosa)
+        # no se leen de la BBDD hasta que alguien usa cliente.mascotas por primera vez.
+        self._mascotas = None if mascotas_pendientes else []
+
+    @property
+    def mascotas(self):
+        if self._mascotas is None:
+            self.fijar_mascotas(cargar_mascotas_de_clientes_db([self.id]).get(self.id, []))
+        return self._mascotas
+
+    @mascotas.setter
+    def mascotas(self, lista):
+        self._mascotas = lista
+
+    def mascotas_cargadas(self):
+        return self._mascotas is not None
+
+    def fijar_mascotas(self, lista):
+        #Pone las mascotas leídas de la BBDD solo si aún no estaban (dos hilos pueden cargarlas a la vez).
+        with _cerrojo_carga:
+            if self._mascotas is None:
+                self._mascotas = lista
+        return self._mascotas
 
     def __str__(self):
         return f"Cliente ID: {self.id[:8]}... | Nombre: {self.nombre} | Email: {self.email}"
 
+_cerrojo_carga = threading.Lock()
+
+
+def _insertar_cliente(conn, id_cliente, nombre, email, telefono):
+    conn.execute(
+        "INSERT INTO clientes (id_cliente, nombre, email, telefono) VALUES (?, ?, ?, ?)",
+        (id_cliente, nombre, email, telefono)
+    )
+    return True
+
+cola_escritura.registrar_operacion("cliente", _insertar_cliente)
+
+def guardar_cliente_db(cliente: Cliente):
+    #Manda a guardar el cliente (por la cola de escritura si está activa). Devuelve un Future.
+    return cola_escritura.guardar("cliente", cliente.id, cliente.nombre, cliente.email, cliente.telefono)
 
 def registrar_cliente_db(cliente: Cliente):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute(
-            cliente.id, 
-            cliente.nombre, 
-            cliente.email, 
-            cliente.telefono
-        )
-        
-        conn.commit()
-        return True
+        # Espera a que quede guardado (sin cola, la conexión sale del pool y se hace commit al momento)
+        return cola_escritura.esperar(guardar_cliente_db(cliente))
     
     except sqlite3.IntegrityError:
         print(f"Error: El cliente con ID {cliente.id} o email {cliente.email} ya existe.")
         return False
+    except BaseDatosOcupadaError:
+        raise # No se guardó: quien llama tiene que enterarse
     except Exception as e:
         print(f"Error al insertar cliente: {e}")
         return False
-    finally:
-        conn.close()
 
 def eliminar_cliente_db(id_cliente):
    # Elimina un cliente de la BBDD por ID
-    conn = get_connection()
-    cursor = conn.cursor()
-    
+    return eliminar_clientes_db([id_cliente]) > 0
+
+# Tablas que cuelgan de una mascota, en el orden en que se borran (hijas antes que padres)
+TABLAS_DE_MASCOTA = ("vacunas", "pesos", "observaciones", "tratamientos", "citas")
+MAX_PARAMETROS = 500 # SQLite limita los '?' por sentencia, así que troceamos listas muy largas
+
+def eliminar_clientes_db(ids_clientes, devolver_ids=False):
+    #Elimina uno o varios clientes con sus mascotas, citas e historial en UNA sola transacción.
+    # Se borra por conjuntos (DELETE ... WHERE ... IN) en vez de fila a fila, y las claves
+    # foráneas están activas en la conexión, así que no puede quedar nada huérfano.
+    # Devuelve cuántos clientes se han borrado (con devolver_ids=True, la lista de sus IDs).
+    # Lanza BaseDatosOcupadaError si otro proceso tiene la BBDD bloqueada demasiado tiempo.
+    ids = list(dict.fromkeys(ids_clientes)) # Sin repetidos y manteniendo el orden
     try:
-        # Con el ON DELETE CASCADE conseguimos que cuando borres cliente también mascotas y citas
-        cursor.execute("DELETE FROM clientes WHERE id_cliente = ?", (id_cliente,))
-        
-        if cursor.rowcount > 0:
-            conn.commit()
-            return True
-        return False
-        
+        borrados = escritor.escribir(_borrar_clientes, ids)
+    except BaseDatosOcupadaError:
+        raise
     except Exception as e:
-        print(f"Error al eliminar cliente de DB: {e}")
-        return False
-    finally:
-        conn.close()
+        print(f"Error al eliminar clientes de DB: {e}")
+        borrados = []
+    return borrados if devolver_ids else len(borrados)
+
+def _borrar_clientes(conn, ids):
+    # Devuelve los IDs de los clientes que de verdad se han borrado (los que ya no estaban no cuentan)
+    borrados = []
+    for i in range(0, len(ids), MAX_PARAMETROS):
+        bloque = ids[i:i + MAX_PARAMETROS]
+        marcas = ", ".join("?" * len(bloque))
+        mascotas_del_bloque = f"SELECT id_mascota FROM mascotas WHERE cliente_id IN ({marcas})"
+        for tabla in TABLAS_DE_MASCOTA:
+            conn.execute(f"DELETE FROM {tabla} WHERE id_mascota IN ({mascotas_del_bloque})", bloque)
+        conn.execute(f"DELETE FROM mascotas WHERE cliente_id IN ({marcas})", bloque)
+        # Con BEGIN IMMEDIATE nadie más escribe entre esta lectura y el DELETE
+        existentes = {fila[0] for fila in conn.execute(f"SELECT id_cliente FROM clientes WHERE id_cliente IN ({marcas})", bloque)}
+        conn.execute(f"DELETE FROM clientes WHERE id_cliente IN ({marcas})", bloque)
+        quedan = {fila[0] for fila in conn.execute(f"SELECT id_cliente FROM clientes WHERE id_cliente IN ({marcas})", bloque)}
+        borrados += [id_cliente for id_cliente in bloque if id_cliente in existentes - quedan]
+    return borrados
+
+def iter_clientes(tamano_lote=TAMANO_LOTE):
+    #Generador que va devolviendo los clientes (con sus mascotas ya dentro) uno a uno.
+    # Lee de tamano_lote en tamano_lote clientes (keyset sobre el rowid), cada bloque con una
+    # sola consulta clientes LEFT JOIN mascotas, y agrupa las filas seguidas del mismo cliente.
+    # La conexión vuelve al pool antes de devolver cada bloque: quien recorre el generador
+    # despacio (o lo deja a medias) no retiene una conexión ni una foto de la BBDD.
+    from .mascotas import Mascota # Lo hacemos porque mascota.py importa cliente.py
+
+    ultimo = 0
+    while True:
+        with conexion() as conn:
+            filas = conn.execute("""
+                SELECT c.rowid, c.id_cliente, c.nombre, c.email, c.telefono,
+                       m.id_mascota, m.nombre, m.especie, m.raza, m.fecha_nacimiento
+                FROM (SELECT rowid, * FROM clientes WHERE rowid > ? ORDER BY rowid LIMIT ?) c
+                LEFT JOIN mascotas m ON m.cliente_id = c.id_cliente
+                ORDER BY c.rowid, m.rowid
+            """, (ultimo, tamano_lote)).fetchall()
+        if not filas:
+            return
+
+        lote = []
+        for rowid, id_cli, nombre, email, telefono, id_masc, m_nom, m_esp, m_raza, m_fecha in filas:
+            # Cuando cambia el id de cliente, el anterior ya está completo
+            if not lote or lote[-1].id != id_cli:
+                lote.append(Cliente(nombre, telefono, email, id_cli))
 
-def cargar_clientes_db():
+            # Con LEFT JOIN un cliente sin mascotas trae las columnas de mascota a NULL
+            # (la fecha de nacimiento ya llega como date, o None si no se conoce)
+            if id_masc is not None:
+                lote[-1].mascotas.append(Mascota(m_nom, m_esp, m_raza, m_fecha, id_cli, id_masc))
+        ultimo = filas[-1][0]
+        yield from lote
+
+def cargar_clientes_db(perezoso=False):
     #Recupera todos los clientes de la BBDD y también sus mascotas asociadas.
     #Devuelve una lista de objetos Cliente.
-    conn = get_connection()
-    cursor = conn.cursor()
-    lista_clientes = []
-    
+    # Con perezoso=True solo lee la tabla clientes: las mascotas se cargan al usarlas.
     try:
-        # Seleccionamos todos los clientes
-        cursor.execute("SELECT id_cliente, nombre, email, telefono FROM clientes")
-        rows = cursor.fetchall()
-        
-        # Lo hacemos porque mascota.py importa cliente.py
-        from .mascotas import Mascota 
-
-        for row in rows:
-            id_cli, nombre, email, telefono = row
-            cliente_obj = Cliente(nombre, telefono, email, id_cli)
-            
-            # Para cada cliente, buscamos sus mascotas en la BBDD
-            # Hacemos una segunda consulta filtrando por cliente_id
-            cursor.execute("""
-                SELECT id_mascota, nombre, especie, raza, fecha_nacimiento 
-                FROM mascotas WHERE cliente_id = ?
-            """, (id_cli,))
-            
-            mascotas_rows = cursor.fetchall()
-            
-            for m_row in mascotas_rows:
-                id_masc, m_nom, m_esp, m_raza, m_fecha_str = m_row
-                
-                # Convertimos la fecha de string (SQLite) a objeto date (Python)
-                try:
-                    fecha_nac = datetime.strptime(m_fecha_str, '%Y-%m-%d').date()
-                except ValueError:
-                    fecha_nac = date.today() # Fallback si la fecha está mal
-                
-                # Creamos el objeto Mascota y lo añadimos a la lista del cliente
-                mascota_obj = Mascota(m_nom, m_esp, m_raza, fecha_nac, id_cli, id_masc)
-                
-                
-                cliente_obj.mascotas.append(mascota_obj)
-            
-            lista_clientes.append(cliente_obj)
-            
+        if perezoso:
+            with conexion() as conn:
+                filas = conn.execute("SELECT id_cliente, nombre, email, telefono FROM clientes ORDER BY rowid").fetchall()
+            return [Cliente(nombre, telefono, email, id_cli, mascotas_pendientes=True)
+                    for id_cli, nombre, email, telefono in filas]
+        return list(iter_clientes())
     except Exception as e:
         print(f"Error cargando clientes: {e}")
-    finally:
-        conn.close()
-        
-    return lista_clientes
\ No newline at end of file
+        return []
+
+def cargar_mascotas_de_clientes_db(ids_clientes):
+    #Lee las mascotas (con su historial) de los clientes indicados.
+    # Devuelve un diccionario id_cliente -> lista de Mascota. Usa el índice idx_mascotas_cliente.
+    from .mascotas import Mascota
+    from .historial import cargar_historial_db
+    ids = list(dict.fromkeys(ids_clientes))
+    por_cliente = {}
+    with conexion() as conn:
+        for i in range(0, len(ids), MAX_PARAMETROS):
+            bloque = ids[i:i + MAX_PARAMETROS]
+            filas = conn.execute(f"""
+                SELECT id_mascota, nombre, especie, raza, fecha_nacimiento, cliente_id
+                FROM mascotas WHERE cliente_id IN ({", ".join("?" * len(bloque))})
+                ORDER BY rowid
+            """, bloque).fetchall()
+            for id_masc, nombre, especie, raza, fecha_nac, id_cli in filas:
+                mascota = Mascota(nombre, especie, raza, fecha_nac, id_cli, id_masc)
+                por_cliente.setdefault(id_cli, []).append(mascota)
+    cargar_historial_db({m.id: m for lista in por_cliente.values() for m in lista}, solo_estas=True)
+    return por_cliente
+
+def clientes_de_mascotas_db(ids_mascotas):
+    #IDs de los dueños de las mascotas indicadas (para saber qué clientes hay que cargar).
+    ids = list(dict.fromkeys(ids_mascotas))
+    clientes = []
+    with conexion() as conn:
+        for i in range(0, len(ids), MAX_PARAMETROS):
+            bloque = ids[i:i + MAX_PARAMETROS]
+            clientes += [fila[0] for fila in conn.execute(
+                f"SELECT DISTINCT cliente_id FROM mascotas WHERE id_mascota IN ({', '.join('?' * len(bloque))})",
+                bloque)]
+    return list(dict.fromkeys(clientes))
@@ -0,0 +1,241 @@
+import os
+import json
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from . import db_connection, escritor
+from .db_connection import abrir_conexion
+from .logging import AppLogger
+
+# Cola de escrituras con commit agrupado (group commit).
+# Las altas de clientes, mascotas y citas se mandan a un único hilo escritor. Ese hilo junta
+# lo que llega dentro de una ventana corta y lo guarda en UNA transacción (cada operación en su
+# SAVEPOINT, así si una falla las demás siguen adelante): un solo commit y un solo fsync por lote.
+# Quien escribe recibe un Future que se resuelve cuando su escritura ya es durable.
+#
+# Antes de entrar en la cola, cada operación se apunta en un diario (JSON por líneas, al lado
+# de la BBDD). Si el proceso se cae con operaciones pendientes, al volver a arrancar se repiten.
+#
+# Se activa con COLA_ESCRITURA=1 (o activar()). Sin cola, guardar() escribe en el momento.
+# En los dos casos la transacción pasa por escritor.escribir(): si otro proceso tiene la BBDD
+# bloqueada se reintenta, y si no se consigue el Future falla con BaseDatosOcupadaError.
+
+# Cuánto se espera a juntar más escrituras. Con 0 el lote es lo que se acumuló mientras se hacía
+# el commit anterior, que con muchas sesiones a la vez ya agrupa bien y no añade latencia.
+VENTANA_MS = float(os.environ.get("VENTANA_ESCRITURA_MS", "0"))
+MAX_LOTE = 500 # Operaciones como mucho por transacción
+# Lo más que espera quien guarda a que se confirme su escritura (ver esperar()). Tiene que
+# cubrir los reintentos de escritor.py con la BBDD ocupada, y algo de cola por delante.
+ESPERA_MAXIMA_S = float(os.environ.get("ESPERA_ESCRITURA_S", "30"))
+
+# Operaciones que se pueden encolar: nombre -> función(conn, *parámetros).
+# Van por nombre (y con parámetros que se puedan pasar a JSON) para poder apuntarlas en el diario.
+OPERACIONES = {}
+
+def registrar_operacion(nombre, funcion):
+    OPERACIONES[nombre] = funcion
+
+
+class ColaEscritura:
+    """
+    Hilo escritor único con commit agrupado y diario para recuperar lo pendiente tras una caída.
+    """
+    def __init__(self, ruta=None, ventana_ms=None, max_lote=MAX_LOTE, diario=None):
+        self.ruta = os.path.abspath(ruta or db_connection.DB_NAME)
+        self.ventana = (VENTANA_MS if ventana_ms is None else ventana_ms) / 1000
+        self.max_lote = max_lote
+        self.diario = diario or self.ruta + "-cola"
+        self._cola = queue.Queue()
+        self._cerrojo = threading.Lock() # Protege el diario y el número de secuencia
+        self._secuencia = 0
+        self.lotes = 0 # Transacciones hechas (para ver cuánto se agrupa)
+        self._log = AppLogger("ColaEscritura")
+        self._reproducir_diario()
+        self._fichero = open(self.diario, "a", encoding="utf-8")
+        self._hilo = threading.Thread(target=self._bucle, name="escritor-sqlite", daemon=True)
+        self._hilo.start()
+
+    def enviar(self, operacion, *parametros):
+        #Encola una operación. Devuelve un Future con su resultado (o su excepción).
+        if operacion not in OPERACIONES:
+            raise ValueError(f"Operación '{operacion}' desconocida")
+        futuro = Future()
+        with self._cerrojo:
+            if not self.viva():
+                raise RuntimeError("La cola de escritura está cerrada")
+            self._secuencia += 1
+            self._apuntar({"n": self._secuencia, "op": operacion, "params": list(parametros)})
+            self._cola.put((self._secuencia, operacion, parametros, futuro))
+        return futuro
+
+    def viva(self):
+        #False si se cerró o si el hilo escritor se ha parado: lo que se encolase no se guardaría nunca.
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def _apuntar(self, registro):
+        # El flush basta para sobrevivir a una caída del proceso (el SO ya tiene la línea)
+        self._fichero.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        self._fichero.flush()
+
+    def _bucle(self):
+        # Conexión propia con synchronous=FULL: cuando el commit vuelve, el lote está en disco
+        conn = abrir_conexion(self.ruta)
+        conn.execute("PRAGMA synchronous = FULL")
+        try:
+            while True:
+                primero = self._cola.get()
+                if primero is None:
+                    return
+                lote, fin = [primero], False
+                # Juntamos lo que llegue dentro de la ventana (sin pasar de max_lote)
+                limite = time.monotonic() + self.ventana
+                while len(lote) < self.max_lote:
+                    espera = limite - time.monotonic()
+                    try:
+                        siguiente = self._cola.get(timeout=espera) if espera > 0 else self._cola.get_nowait()
+                    except queue.Empty:
+                        break
+                    if siguiente is None:
+                        fin = True # Cerramos después de guardar este lote
+                        break
+                    lote.append(siguiente)
+                try:
+                    self._escribir_lote(conn, lote)
+                except Exception as e:
+                    # Pase lo que pase con un lote, el hilo sigue vivo y nadie se queda esperando
+                    self._log.error(f"Lote de escritura fallido: {e}")
+                    for _, _, _, futuro in lote:
+                        if not futuro.done():
+                            futuro.set_exception(e)
+                if fin:
+                    return
+        finally:
+            conn.close()
+
+    def _escribir_lote(self, conn, lote):
+        # Lo que se canceló mientras esperaba en la cola no se escribe (y su Future ya no se puede resolver)
+        hecho = lote[-1][0]
+        lote = [e for e in lote if e[3].set_running_or_notify_cancel()]
+        try:
+            resultados = escritor.escribir(_ejecutar, [(operacion, parametros) for _, operacion, parametros, _ in lote],
+                                           conn=conn)
+        except sqlite3.Error as e:
+            # No se pudo hacer el commit (o la BBDD siguió ocupada todo el presupuesto): falla el lote entero
+            resultados = [(False, e)] * len(lote)
+        self.lotes += 1
+        with self._cerrojo:
+            if self._cola.empty():
+                self._fichero.truncate(0) # Nada pendiente: vaciamos el diario
+            else:
+                self._apuntar({"hecho": hecho})
+        for (_, _, _, futuro), (correcto, valor) in zip(lote, resultados):
+            if correcto:
+                futuro.set_result(valor)
+            else:
+                futuro.set_exception(valor)
+
+    def _reproducir_diario(self):
+        # Repite las operaciones apuntadas que no llegaron a marcarse como hechas.
+        # Si una ya estaba guardada (se cayó entre el commit y la marca) fallará con
+        # IntegrityError o como cita solapada consigo misma: en ese caso no hay nada que hacer.
+        if not os.path.exists(self.diario):
+            return
+        hecho, pendientes = 0, []
+        with open(self.diario, encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    continue # Última línea a medio escribir
+                if "hecho" in registro:
+                    hecho = max(hecho, registro["hecho"])
+                else:
+                    pendientes.append(registro)
+        pendientes = [r for r in pendientes if r["n"] > hecho and r["op"] in OPERACIONES]
+        if pendientes:
+            resultados = escritor.escribir(_ejecutar, [(r["op"], r["params"]) for r in pendientes], ruta=self.ruta)
+            repetidas = sum(1 for correcto, _ in resultados if correcto)
+            self._log.warning(f"Diario de escritura: {repetidas} de {len(pendientes)} operaciones pendientes "
+                              f"guardadas al arrancar (el resto ya estaban en la BBDD).")
+        open(self.diario, "w").close()
+
+    def cerrar(self):
+        #Guarda lo que quede en la cola y para el hilo escritor.
+        with self._cerrojo:
+            hilo, self._hilo = self._hilo, None
+        if hilo is not None:
+            self._cola.put(None)
+            hilo.join()
+            self._fichero.close()
+
+
+def _ejecutar(conn, operaciones):
+    # Ejecuta cada operación en su SAVEPOINT dentro de la transacción abierta.
+    # Devuelve una lista de (True, resultado) o (False, excepción), una por operación.
+    # Tiene que haber una transacción abierta (escritor.escribir la abre): un SAVEPOINT fuera
+    # de ella haría commit al liberarlo.
+    resultados = []
+    for operacion, parametros in operaciones:
+        conn.execute("SAVEPOINT operacion")
+        try:
+            resultados.append((True, OPERACIONES[operacion](conn, *parametros)))
+            conn.execute("RELEASE operacion")
+        except Exception as e:
+            conn.execute("ROLLBACK TO operacion")
+            conn.execute("RELEASE operacion")
+            resultados.append((False, e))
+    return resultados
+
+
+# --- Cola compartida del proceso ---
+
+_cola = None
+_cola_cerrojo = threading.Lock()
+_activa = os.environ.get("COLA_ESCRITURA", "") not in ("", "0")
+
+def activar():
+    global _activa
+    _activa = True
+
+def desactivar():
+    #Deja de usar la cola (guardando antes lo pendiente).
+    global _activa, _cola
+    with _cola_cerrojo:
+        _activa = False
+        cola, _cola = _cola, None
+    if cola is not None:
+        cola.cerrar()
+
+def esta_activa():
+    return _activa
+
+def obtener_cola():
+    #Cola del fichero actual (DB_NAME). La primera vez repite lo pendiente del diario.
+    global _cola
+    with _cola_cerrojo:
+        if _cola is None or _cola.ruta != os.path.abspath(db_connection.DB_NAME):
+            if _cola is not None:
+                _cola.cerrar()
+            _cola = ColaEscritura()
+        elif not _cola.viva():
+            # El hilo escritor se paró: una cola nueva repite del diario lo que quedó sin guardar
+            _cola = ColaEscritura()
+        return _cola
+
+def esperar(futuro):
+    #Resultado de un Future de guardar(); si no llega en ESPERA_MAXIMA_S lanza TimeoutError
+    # en vez de dejar colgada la sesión que guarda.
+    return futuro.result(timeout=ESPERA_MAXIMA_S)
+
+def guardar(operacion, *parametros):
+    #Guarda una operación: por la cola si está activa, o en el momento si no. Devuelve un Future.
+    if _activa:
+        return obtener_cola().enviar(operacion, *parametros)
+    futuro = Future()
+    try:
+        futuro.set_result(escritor.escribir(OPERACIONES[operacion], *parametros))
+    except Exception as e:
+        futuro.set_exception(e)
+    return futuro
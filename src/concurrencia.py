@@ -0,0 +1,66 @@
+import threading
+from contextlib import contextmanager
+
+
+class CerrojoLectoresEscritor:
+    """
+    Cerrojo de lectores-escritor: muchas lecturas a la vez, o una sola escritura.
+    El hilo que escribe puede volver a entrar (para leer o escribir) sin bloquearse, y una
+    lectura dentro de otra lectura del mismo hilo tampoco espera. Los escritores tienen
+    preferencia, así un flujo constante de lecturas no los deja esperando para siempre.
+    Ojo: no se puede pasar de lectura a escritura; pedir escritura dentro de una lectura lanza RuntimeError
+    (si esperase, se bloquearía para siempre esperando a que acabe su propia lectura).
+    """
+    def __init__(self):
+        self._condicion = threading.Condition(threading.Lock())
+        self._lectores = 0
+        self._escritor = None # Hilo que tiene la escritura
+        self._profundidad = 0 # Cuántas veces ha entrado el escritor
+        self._esperando = 0 # Escritores en cola
+        self._local = threading.local() # Lecturas abiertas por cada hilo
+
+    @contextmanager
+    def lectura(self):
+        lecturas = getattr(self._local, "lecturas", 0)
+        anidada = lecturas > 0 or self._escritor == threading.get_ident()
+        if not anidada:
+            with self._condicion:
+                while self._escritor is not None or self._esperando:
+                    self._condicion.wait()
+                self._lectores += 1
+        self._local.lecturas = lecturas + 1
+        try:
+            yield
+        finally:
+            self._local.lecturas -= 1
+            if not anidada:
+                with self._condicion:
+                    self._lectores -= 1
+                    if not self._lectores:
+                        self._condicion.notify_all()
+
+    @contextmanager
+    def escritura(self):
+        yo = threading.get_ident()
+        if getattr(self._local, "lecturas", 0) and self._escritor != yo:
+            raise RuntimeError("No se puede pedir la escritura dentro de una lectura")
+        with self._condicion:
+            if self._escritor == yo:
+                self._profundidad += 1
+            else:
+                self._esperando += 1
+                try:
+                    while self._escritor is not None or self._lectores:
+                        self._condicion.wait()
+                finally:
+                    self._esperando -= 1
+                self._escritor = yo
+                self._profundidad = 1
+        try:
+            yield
+        finally:
+            with self._condicion:
+                self._profundidad -= 1
+                if not self._profundidad:
+                    self._escritor = None
+                    self._condicion.notify_all()
@@ -1,20 +1,28 @@
 import sqlite3
 import os #Para que se vaya guardando todo ( operating System)
+import queue
+import threading
+from contextlib import contextmanager
+from .migraciones import aplicar_migraciones
+from . import trazas
+from .tipos import tipar_fechas_y_horas # Registra también los conversores DIA y MINUTOS
+from .cambios import seguir_cambios, seguir_cambios_historial
 
 # 1. Definimos el nombre del archivo de la BBDD
 DB_NAME = 'veterinaria.db'
 
-def setup_database():
-    
-    #Establece la conexión a SQLite y asegura que las tablas
-   # necesarias (clientes, mascotas, citas) existan.
-    
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+# 2. Parámetros del pool de conexiones
+TAMANO_POOL = 8 # Máximo de conexiones abiertas a la vez por fichero
+BUSY_TIMEOUT_MS = 5000 # Cuánto espera SQLite si otra conexión tiene el fichero bloqueado
+CACHE_KIB = 16384 # Caché de páginas por conexión (16 MB, en SQLite el valor negativo va en KiB)
 
-    # Tabla de Clientes
-    # id_cliente es la CLAVE PRIMARIA
-    cursor.execute("""
+# 3. Migraciones del esquema (ver migraciones.py). Nunca se modifica una ya publicada:
+# si hace falta cambiar algo se añade una nueva con el siguiente número.
+MIGRACIONES = [
+    (1, [
+        # Tabla de Clientes
+        # id_cliente es la CLAVE PRIMARIA
+        """
         CREATE TABLE IF NOT EXISTS clientes (
             id_cliente TEXT PRIMARY KEY,
             nombre TEXT NOT NULL,
@@ -22,12 +30,12 @@ def setup_database():
             email TEXT UNIQUE,  
             telefono TEXT
         )
-    """)
+        """,
 
-    # Tabla de Mascotas
-    # id_mascota es la CLAVE PRIMARIA
-    # cliente_id es la CLAVE FORÁNEA
-    cursor.execute("""
+        # Tabla de Mascotas
+        # id_mascota es la CLAVE PRIMARIA
+        # cliente_id es la CLAVE FORÁNEA
+        """
         CREATE TABLE IF NOT EXISTS mascotas (
             id_mascota TEXT PRIMARY KEY,
             nombre TEXT NOT NULL,
@@ -38,12 +46,12 @@ def setup_database():
             FOREIGN KEY (cliente_id) REFERENCES clientes (id_cliente)
                 ON DELETE CASCADE -- Si se borra el cliente, se borran sus mascotas
         )
-    """)
-    
-    # Tabla de Citas
-    # id_cita es la CLAVE PRIMARIA
-    # id_mascota es la CLAVE FORÁNEA
-    cursor.execute("""
+        """,
+
+        # Tabla de Citas
+        # id_cita es la CLAVE PRIMARIA
+        # id_mascota es la CLAVE FORÁNEA
+        """
         CREATE TABLE IF NOT EXISTS citas (
             id_cita TEXT PRIMARY KEY,
             fecha TEXT NOT NULL,
@@ -54,17 +62,243 @@ def setup_database():
             FOREIGN KEY (id_mascota) REFERENCES mascotas (id_mascota)
                 ON DELETE CASCADE
         )
-    """)
-    
+        """,
+    ]),
+    (2, [
+        # Índices secundarios: sin ellos el JOIN clientes-mascotas, la carga de citas
+        # de una mascota y los filtros por fecha recorren la tabla entera
+        "CREATE INDEX IF NOT EXISTS idx_mascotas_cliente ON mascotas (cliente_id)",
+        "CREATE INDEX IF NOT EXISTS idx_citas_mascota ON citas (id_mascota)",
+        "CREATE INDEX IF NOT EXISTS idx_citas_fecha ON citas (fecha, hora)",
+    ]),
+    (3, [
+        # Historial médico: una tabla por tipo de registro (antes solo vivía en memoria)
+        """
+        CREATE TABLE IF NOT EXISTS vacunas (
+            id INTEGER PRIMARY KEY,
+            id_mascota TEXT NOT NULL,
+            nombre TEXT,
+            fecha TEXT,
+            FOREIGN KEY (id_mascota) REFERENCES mascotas (id_mascota)
+                ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS pesos (
+            id INTEGER PRIMARY KEY,
+            id_mascota TEXT NOT NULL,
+            peso REAL,
+            fecha TEXT,
+            FOREIGN KEY (id_mascota) REFERENCES mascotas (id_mascota)
+                ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS observaciones (
+            id INTEGER PRIMARY KEY,
+            id_mascota TEXT NOT NULL,
+            texto TEXT,
+            fecha TEXT,
+            FOREIGN KEY (id_mascota) REFERENCES mascotas (id_mascota)
+                ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tratamientos (
+            id INTEGER PRIMARY KEY,
+            id_mascota TEXT NOT NULL,
+            texto TEXT,
+            fecha TEXT,
+            FOREIGN KEY (id_mascota) REFERENCES mascotas (id_mascota)
+                ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_vacunas_mascota ON vacunas (id_mascota)",
+        "CREATE INDEX IF NOT EXISTS idx_pesos_mascota ON pesos (id_mascota)",
+        "CREATE INDEX IF NOT EXISTS idx_observaciones_mascota ON observaciones (id_mascota)",
+        "CREATE INDEX IF NOT EXISTS idx_tratamientos_mascota ON tratamientos (id_mascota)",
+    ]),
+    (4, [
+        # Agenda por veterinario: comprobar solapes y buscar huecos libres de un día
+        # es una búsqueda por rango sobre este índice
+        "CREATE INDEX IF NOT EXISTS idx_citas_veterinario ON citas (veterinario, fecha, hora)",
+    ]),
+    (5, [
+        # Fechas como número de día y horas como minutos (tipos DIA y MINUTOS, ver tipos.py):
+        # se leen sin parsear texto y los filtros por rango comparan enteros
+        tipar_fechas_y_horas,
+    ]),
+    (6, [
+        # Marca de agua de la ETL desde clinica_vet.db (ver etl.py): último id copiado de cada tabla
+        """
+        CREATE TABLE IF NOT EXISTS etl_progreso (
+            tabla TEXT PRIMARY KEY,
+            ultimo_id INTEGER NOT NULL
+        )
+        """,
+    ]),
+    (7, [
+        # Columna 'version' y lápidas de borrado en clientes, mascotas y citas, mantenidas por
+        # triggers (ver cambios.py): la Veterinaria se refresca leyendo solo lo que ha cambiado
+        seguir_cambios,
+    ]),
+    (8, [
+        # Identificador al azar de cada BBDD: una regenerada o sustituida puede llegar a la misma
+        # secuencia de cambios con otros datos, y la instantánea (instantanea.py) no debe confundirlas
+        "ALTER TABLE secuencia_cambios ADD COLUMN bd TEXT",
+        "UPDATE secuencia_cambios SET bd = lower(hex(randomblob(8)))",
+    ]),
+    (9, [
+        # UPDATE y DELETE en las tablas del historial también cuentan como cambio de la mascota
+        # (la 7 solo seguía los INSERT): si no, la instantánea servía un historial ya borrado
+        seguir_cambios_historial,
+    ]),
+]
+
+def setup_database():
     
-    conn.commit()
-    conn.close()
+    #Establece la conexión a SQLite y asegura que las tablas
+   # necesarias (clientes, mascotas, citas) existan y que el esquema esté al día.
+    with conexion() as conn:
+        aplicar_migraciones(conn, MIGRACIONES)
     
     return f"Conexión a '{DB_NAME}' establecida y tablas aseguradas."
 
+def configurar_conexion(conn):
+    #Aplica a una conexión recién abierta los PRAGMA que usamos en toda la app.
+    # WAL permite que los lectores no bloqueen al que escribe (y al revés),
+    # y con synchronous=NORMAL solo se hace fsync al hacer checkpoint, no en cada commit.
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA foreign_keys = ON") # Sin esto SQLite ignora los ON DELETE CASCADE
+    conn.execute(f"PRAGMA cache_size = -{CACHE_KIB}")
+    return conn
+
+def abrir_conexion(ruta=None):
+    #Abre una conexión nueva ya configurada. check_same_thread=False porque
+    # Streamlit atiende cada sesión en un hilo distinto y el pool las reparte entre ellos.
+    # PARSE_DECLTYPES: las columnas DIA y MINUTOS se leen ya convertidas (ver tipos.py)
+    conn = sqlite3.connect(ruta or DB_NAME, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                           detect_types=sqlite3.PARSE_DECLTYPES,
+                           factory=trazas.fabrica_conexion()) # Conexión trazada si TRAZAR_SQL está activo
+    return configurar_conexion(conn)
+
+
+class PoolConexiones:
+    """
+    Pool acotado de conexiones de larga duración a un fichero SQLite.
+    Las conexiones se crean bajo demanda (hasta 'tamano') y se reutilizan,
+    así cada operación se ahorra abrir el fichero y leer el esquema.
+    """
+    def __init__(self, ruta: str, tamano: int = TAMANO_POOL):
+        self.ruta = ruta
+        self.tamano = tamano
+        self._libres = queue.LifoQueue() # LIFO: reutilizamos la conexión con la caché más caliente
+        self._huecos = threading.BoundedSemaphore(tamano)
+        self._todas = []
+        self._cerrojo = threading.Lock()
+
+    def prestar(self):
+        #Devuelve una conexión libre, abriendo una nueva si aún no se llegó al límite.
+        # Si todas están prestadas, espera a que alguien devuelva una.
+        self._huecos.acquire()
+        try:
+            return self._libres.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            conn = abrir_conexion(self.ruta)
+        except Exception:
+            self._huecos.release()
+            raise
+        with self._cerrojo:
+            self._todas.append(conn)
+        return conn
+
+    def devolver(self, conn):
+        #Vuelve a dejar la conexión en el pool. Si quedó una transacción a medias la deshacemos
+        # para que el siguiente que la use no herede cambios sin confirmar.
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._libres.put(conn)
+        except sqlite3.Error:
+            self._descartar(conn)
+        finally:
+            self._huecos.release()
+
+    def _descartar(self, conn):
+        with self._cerrojo:
+            if conn in self._todas:
+                self._todas.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def conexion(self):
+        #Presta una conexión durante el bloque 'with'. Si el bloque termina bien se hace
+        # commit, si lanza una excepción se hace rollback, y en ambos casos se devuelve al pool.
+        conn = self.prestar()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.devolver(conn)
+
+    def cerrar(self):
+        #Cierra todas las conexiones que el pool ha abierto.
+        with self._cerrojo:
+            todas, self._todas = self._todas, []
+        while True:
+            try:
+                self._libres.get_nowait()
+            except queue.Empty:
+                break
+        for conn in todas:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+# Un pool por fichero, así los tests (o la app de Streamlit) pueden cambiar DB_NAME sin mezclar conexiones
+_pools = {}
+_pools_cerrojo = threading.Lock()
+
+def obtener_pool(ruta=None):
+    #Devuelve el pool del fichero indicado (por defecto DB_NAME), creándolo la primera vez.
+    ruta = os.path.abspath(ruta or DB_NAME)
+    with _pools_cerrojo:
+        pool = _pools.get(ruta)
+        if pool is None:
+            pool = PoolConexiones(ruta)
+            _pools[ruta] = pool
+        return pool
+
+def conexion(ruta=None):
+    #Atajo para 'with conexion() as conn:' sobre el pool de la BBDD principal.
+    return obtener_pool(ruta).conexion()
+
+def cerrar_pools():
+    #Cierra todas las conexiones de todos los pools (al apagar la app o entre tests).
+    with _pools_cerrojo:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.cerrar()
+
 def get_connection():
-    #Devuelve una nueva conexión a la base de datos para usar en CRUD.
-    return sqlite3.connect(DB_NAME)
+    #Devuelve una nueva conexión (ya configurada) a la base de datos.
+    # Para el CRUD es mejor usar 'conexion()', que la reutiliza desde el pool.
+    return abrir_conexion()
 
 # Llamada inicial para configurar la BBDD
 if __name__ == '__main__':
@@ -0,0 +1,78 @@
+import os
+import time
+import random
+import sqlite3
+from . import db_connection
+from .exceptions import BaseDatosOcupadaError
+
+# Escrituras que aguantan varios procesos contra la misma BBDD (varias instancias de Streamlit
+# detrás de un proxy, la ETL, importaciones...). SQLite solo deja escribir a una conexión a la vez:
+#   - Cada escritura abre la transacción con BEGIN IMMEDIATE, que pide el permiso de escritura al
+#     empezar. Con un BEGIN normal la transacción empieza leyendo y, si otro escribe entretanto,
+#     al querer escribir falla con SQLITE_BUSY sin esperar (en WAL su foto ya no es la última).
+#   - Si la BBDD está ocupada (SQLITE_BUSY / SQLITE_LOCKED) se deshace, se espera un tiempo al azar
+#     que crece exponencialmente (así los procesos que chocan no vuelven a chocar a la vez) y se
+#     repite la transacción entera.
+#   - Si pasado el presupuesto sigue ocupada se lanza BaseDatosOcupadaError: la escritura no se
+#     pierde en silencio, quien llama se entera y puede avisar al usuario.
+# Dentro de cada intento SQLite solo espera ESPERA_SQLITE_MS (su busy_timeout): el resto de la
+# espera la gestionamos aquí, con azar, en vez de dejar a todos los procesos sondeando a la vez.
+
+PRESUPUESTO_S = float(os.environ.get("PRESUPUESTO_ESCRITURA_S", "10")) # Tiempo total de reintentos
+ESPERA_INICIAL_S = 0.005
+ESPERA_MAXIMA_S = 0.5
+ESPERA_SQLITE_MS = 20
+
+# SQLITE_BUSY y SQLITE_LOCKED (el módulo sqlite3 solo trae las constantes desde Python 3.11)
+_OCUPADA = (5, 6)
+
+
+def es_bloqueo(error):
+    #True si el error es de BBDD ocupada o bloqueada (lo que merece reintentar).
+    if isinstance(error, BaseDatosOcupadaError) or not isinstance(error, sqlite3.OperationalError):
+        return False
+    codigo = getattr(error, "sqlite_errorcode", None)
+    if codigo is not None:
+        return codigo & 0xFF in _OCUPADA # El byte bajo es el código principal (SQLITE_BUSY_SNAPSHOT -> BUSY)
+    mensaje = str(error)
+    return "locked" in mensaje or "busy" in mensaje
+
+
+def escribir(funcion, *parametros, conn=None, ruta=None, presupuesto=None):
+    #Ejecuta funcion(conn, *parametros) en una transacción BEGIN IMMEDIATE y hace commit.
+    # Si la BBDD está ocupada lo reintenta con espera exponencial al azar; si no lo consigue en
+    # 'presupuesto' segundos lanza BaseDatosOcupadaError. Cualquier otro error deshace y se relanza.
+    # Sin 'conn' se usa una conexión del pool de 'ruta' (por defecto DB_NAME).
+    # Devuelve lo que devuelva 'funcion'.
+    if conn is None:
+        with db_connection.conexion(ruta) as conn:
+            return escribir(funcion, *parametros, conn=conn, presupuesto=presupuesto)
+    if conn.in_transaction:
+        # Ya hay una transacción abierta por quien llama: no se puede repetir solo un trozo
+        return funcion(conn, *parametros)
+
+    presupuesto = PRESUPUESTO_S if presupuesto is None else presupuesto
+    inicio = time.monotonic()
+    espera_antes = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+    conn.execute(f"PRAGMA busy_timeout = {ESPERA_SQLITE_MS}")
+    try:
+        intentos = 0
+        while True:
+            intentos += 1
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                resultado = funcion(conn, *parametros)
+                conn.commit()
+                return resultado
+            except BaseException as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                if not es_bloqueo(e):
+                    raise
+                restante = presupuesto - (time.monotonic() - inicio)
+                if restante <= 0:
+                    raise BaseDatosOcupadaError(intentos, time.monotonic() - inicio) from e
+                tope = min(ESPERA_MAXIMA_S, ESPERA_INICIAL_S * 2 ** (intentos - 1))
+                time.sleep(min(random.uniform(0, tope), restante))
+    finally:
+        conn.execute(f"PRAGMA busy_timeout = {espera_antes}")
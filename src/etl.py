@@ -0,0 +1,211 @@
+import json
+import sqlite3
+import uuid
+from .db_connection import conexion, setup_database
+from . import escritor
+from .agenda import a_minutos
+from .tipos import a_dia
+
+# ETL de clinica_vet.db (tabla plana de la app de Streamlit) al esquema normalizado de veterinaria.db.
+# Se adjunta la BBDD de la clínica (ATTACH) y se copian pacientes, citas e historial por bloques:
+# cada bloque va en su propia transacción junto con la marca de agua (último id copiado de esa
+# tabla en etl_progreso), así si se corta a medias se puede volver a lanzar y sigue por donde iba.
+# Cada bloque se escribe con escritor.escribir: si la app u otro proceso está escribiendo, se
+# espera y se reintenta, y si no se consigue se lanza BaseDatosOcupadaError (la marca no avanza).
+# La memoria no depende del tamaño de los ficheros: solo el bloque actual y el mapa de dueños.
+#
+#   pacientes -> clientes (uno por email) + mascotas (id 'clinica-<id>')
+#   citas     -> citas (id 'clinica-cita-<id>')
+#   historial -> observaciones (descripción) y tratamientos (tratamiento)
+#
+# Lo que no se puede convertir (fechas u horas ilegibles, citas de pacientes que no existen)
+# se apunta en filas_malformadas y no para la ETL.
+
+TAMANO_BLOQUE = 5000 # Filas por transacción
+ALIAS = "clinica"
+
+
+class ResultadoETL:
+    """
+    Resumen de una ejecución de la ETL.
+    """
+    def __init__(self):
+        self.clientes = 0
+        self.mascotas = 0
+        self.citas = 0
+        self.historial = 0
+        self.malformadas = 0
+
+    def __str__(self):
+        return (f"Copiados {self.clientes} clientes nuevos, {self.mascotas} mascotas, {self.citas} citas "
+                f"y {self.historial} registros de historial ({self.malformadas} filas apartadas)")
+
+
+def id_mascota_de(paciente_id):
+    #ID en veterinaria.db de la mascota que viene del paciente 'paciente_id' de la clínica.
+    return f"clinica-{paciente_id}"
+
+
+def _marca_de_agua(conn, tabla):
+    fila = conn.execute("SELECT ultimo_id FROM etl_progreso WHERE tabla = ?", (tabla,)).fetchone()
+    return fila[0] if fila else 0
+
+def _por_bloques(conn, tabla, columnas, tamano_bloque):
+    # Va devolviendo bloques de filas de clinica.<tabla> con id mayor que la marca de agua.
+    # Es keyset sobre la clave primaria: cada bloque cuesta lo mismo, vaya por donde vaya.
+    ultimo = _marca_de_agua(conn, tabla)
+    while True:
+        filas = conn.execute(f"SELECT id, {columnas} FROM {ALIAS}.{tabla} WHERE id > ? ORDER BY id LIMIT ?",
+                             (ultimo, tamano_bloque)).fetchall()
+        if not filas:
+            return
+        yield filas
+        ultimo = filas[-1][0]
+
+def _guardar_bloque(conn, tabla, ultimo_id, sentencias, malformadas, resultado):
+    #Escribe un bloque y avanza la marca de agua en la misma transacción (BEGIN IMMEDIATE, con
+    # reintentos si la BBDD está ocupada). 'sentencias' es una lista de
+    # (sql, [(fila original, parámetros), ...], contador del resultado).
+    # Devuelve, por contador, los parámetros de las filas que no han fallado.
+    aceptadas, copiadas, apartadas = escritor.escribir(_escribir_bloque, tabla, ultimo_id, sentencias,
+                                                       malformadas, conn=conn)
+    # El resultado se toca solo con el bloque ya guardado: un intento repetido no cuenta dos veces
+    for contador, n in copiadas.items():
+        setattr(resultado, contador, getattr(resultado, contador) + n)
+    resultado.malformadas += apartadas
+    return aceptadas
+
+def _escribir_bloque(conn, tabla, ultimo_id, sentencias, malformadas):
+    # Si una fila rompe una restricción, se repite el bloque fila a fila y esa fila se aparta.
+    # Se cuenta con rowcount: lo que un INSERT OR IGNORE se salta (ya estaba) no cuenta como copiado.
+    malformadas = list(malformadas) # Si escribir repite la transacción, se parte otra vez de las de antes
+    aceptadas = {contador: [] for _, _, contador in sentencias}
+    copiadas = {contador: 0 for _, _, contador in sentencias}
+    conn.execute("SAVEPOINT bloque_etl")
+    try:
+        for sql, filas, contador in sentencias:
+            copiadas[contador] += conn.executemany(sql, [params for _, params in filas]).rowcount
+            aceptadas[contador] += [params for _, params in filas]
+        conn.execute("RELEASE bloque_etl")
+    except sqlite3.IntegrityError:
+        conn.execute("ROLLBACK TO bloque_etl")
+        conn.execute("RELEASE bloque_etl")
+        aceptadas = {contador: [] for _, _, contador in sentencias}
+        copiadas = {contador: 0 for _, _, contador in sentencias}
+        for sql, filas, contador in sentencias:
+            for original, params in filas:
+                try:
+                    copiadas[contador] += conn.execute(sql, params).rowcount
+                    aceptadas[contador].append(params)
+                except sqlite3.IntegrityError as e:
+                    malformadas.append((original, "", str(e)))
+
+    conn.executemany(
+        "INSERT INTO filas_malformadas (tabla, clave, columna, valor, fila) VALUES (?, ?, ?, ?, ?)",
+        [(f"{ALIAS}.{tabla}", str(original[0]), columna, str(valor), json.dumps(original, ensure_ascii=False))
+         for original, columna, valor in malformadas])
+    conn.execute("INSERT OR REPLACE INTO etl_progreso (tabla, ultimo_id) VALUES (?, ?)", (tabla, ultimo_id))
+    return aceptadas, copiadas, len(malformadas)
+
+
+def _clave_dueno(email, nombre, telefono):
+    # Mismo dueño = mismo email (sin mayúsculas). Sin email, mismo nombre y teléfono.
+    email = (email or "").strip().lower()
+    return email if email else ("", nombre or "", telefono or "")
+
+def _copiar_pacientes(conn, tamano_bloque, resultado):
+    # Mapa dueño -> id_cliente con los que ya están en veterinaria.db (de la app o de otra ejecución)
+    ids_por_dueno = {_clave_dueno(email, nombre, telefono): id_cliente for id_cliente, email, nombre, telefono
+                     in conn.execute("SELECT id_cliente, email, nombre, telefono FROM clientes")}
+    sql_cliente = "INSERT INTO clientes (id_cliente, nombre, email, telefono) VALUES (?, ?, ?, ?)"
+    sql_mascota = """
+        INSERT OR IGNORE INTO mascotas (id_mascota, nombre, especie, raza, fecha_nacimiento, cliente_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+    columnas = "nombre, especie, raza, fecha_nacimiento, propietario, telefono, email"
+    for filas in _por_bloques(conn, "pacientes", columnas, tamano_bloque):
+        clientes, mascotas, malformadas = [], [], []
+        nuevos = {} # Dueños de este bloque: pasan al mapa solo si su cliente se llega a guardar
+        for fila in filas:
+            id_paciente, nombre, especie, raza, nacimiento, propietario, telefono, email = fila
+            clave = _clave_dueno(email, propietario, telefono)
+            id_cliente = ids_por_dueno.get(clave) or nuevos.get(clave)
+            if id_cliente is None:
+                id_cliente = nuevos[clave] = str(uuid.uuid4())
+                clientes.append((fila, (id_cliente, propietario or "(sin nombre)", email or None, telefono)))
+            try:
+                dia = a_dia(nacimiento or None)
+            except ValueError:
+                malformadas.append((fila, "fecha_nacimiento", nacimiento))
+                dia = None # La mascota se copia igual, sin fecha de nacimiento
+            mascotas.append((fila, (id_mascota_de(id_paciente), nombre, especie, raza, dia, id_cliente)))
+        aceptadas = _guardar_bloque(conn, "pacientes", filas[-1][0],
+                                    [(sql_cliente, clientes, "clientes"), (sql_mascota, mascotas, "mascotas")],
+                                    malformadas, resultado)
+        guardados = {params[0] for params in aceptadas["clientes"]}
+        ids_por_dueno.update((clave, id_cliente) for clave, id_cliente in nuevos.items() if id_cliente in guardados)
+
+def _copiar_citas(conn, tamano_bloque, resultado):
+    sql = """
+        INSERT OR IGNORE INTO citas (id_cita, fecha, hora, motivo, veterinario, id_mascota)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+    for filas in _por_bloques(conn, "citas", "paciente_id, fecha, hora, motivo, veterinario", tamano_bloque):
+        citas, malformadas = [], []
+        for fila in filas:
+            id_cita, paciente_id, fecha, hora, motivo, veterinario = fila
+            try:
+                dia = a_dia(fecha or "") # Una cita sin fecha tampoco se puede copiar
+            except ValueError:
+                malformadas.append((fila, "fecha", fecha))
+                continue
+            try:
+                minutos = a_minutos(hora)
+            except ValueError:
+                malformadas.append((fila, "hora", hora))
+                continue
+            citas.append((fila, (f"clinica-cita-{id_cita}", dia, minutos, motivo, veterinario,
+                                 id_mascota_de(paciente_id))))
+        _guardar_bloque(conn, "citas", filas[-1][0], [(sql, citas, "citas")], malformadas, resultado)
+
+def _copiar_historial(conn, tamano_bloque, resultado):
+    sql_observacion = "INSERT INTO observaciones (id_mascota, texto, fecha) VALUES (?, ?, ?)"
+    sql_tratamiento = "INSERT INTO tratamientos (id_mascota, texto, fecha) VALUES (?, ?, ?)"
+    for filas in _por_bloques(conn, "historial", "paciente_id, fecha, descripcion, tratamiento", tamano_bloque):
+        observaciones, tratamientos = [], []
+        for fila in filas:
+            _, paciente_id, fecha, descripcion, tratamiento = fila
+            if descripcion:
+                observaciones.append((fila, (id_mascota_de(paciente_id), descripcion, fecha)))
+            if tratamiento:
+                tratamientos.append((fila, (id_mascota_de(paciente_id), tratamiento, fecha)))
+        _guardar_bloque(conn, "historial", filas[-1][0],
+                        [(sql_observacion, observaciones, "historial"), (sql_tratamiento, tratamientos, "historial")],
+                        [], resultado)
+
+
+def migrar_clinica(ruta_clinica="clinica_vet.db", tamano_bloque=TAMANO_BLOQUE):
+    #Copia lo nuevo de clinica_vet.db a veterinaria.db. Se puede lanzar tantas veces como se
+    # quiera: cada tabla sigue desde su marca de agua, así que nada se copia dos veces.
+    setup_database()
+    resultado = ResultadoETL()
+    with conexion() as conn:
+        conn.execute(f"ATTACH DATABASE ? AS {ALIAS}", (ruta_clinica,))
+        try:
+            # Primero los pacientes: las citas y el historial apuntan a sus mascotas
+            _copiar_pacientes(conn, tamano_bloque, resultado)
+            _copiar_citas(conn, tamano_bloque, resultado)
+            _copiar_historial(conn, tamano_bloque, resultado)
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute(f"DETACH DATABASE {ALIAS}") # La conexión vuelve al pool
+    return resultado
+
+
+if __name__ == '__main__':
+    # Uso: python -m src.etl [clinica_vet.db] [filas por bloque]
+    import sys
+    ruta = sys.argv[1] if len(sys.argv) > 1 else "clinica_vet.db"
+    tamano = int(sys.argv[2]) if len(sys.argv) > 2 else TAMANO_BLOQUE
+    print(migrar_clinica(ruta, tamano))
@@ -1,3 +1,5 @@
+import sqlite3
+
 class ClienteNoEncontradoError(Exception):
     #Excepción lanzada cuando se intenta operar con un cliente que no existe.
     def __init__(self, id_cliente):
@@ -7,3 +9,20 @@ class ClienteNoEncontradoError(Exception):
 class CitaError(Exception):
     #Excepción base para errores relacionados con la gestión de citas.#
     pass
+
+class CitaSolapadaError(CitaError):
+    #Excepción lanzada cuando el veterinario ya tiene otra cita que se solapa con la nueva.
+    def __init__(self, veterinario, fecha, hora):
+        self.veterinario = veterinario
+        self.fecha = fecha
+        self.hora = hora
+        super().__init__(f"Error: {veterinario} ya tiene una cita el {fecha} que se solapa con las {hora}.")
+
+class BaseDatosOcupadaError(sqlite3.OperationalError):
+    #Excepción lanzada cuando otra conexión (u otro proceso) tiene la BBDD bloqueada para escribir
+    # y se ha agotado el tiempo de reintentos: la escritura NO se ha guardado.
+    def __init__(self, intentos, segundos):
+        self.intentos = intentos
+        self.segundos = segundos
+        super().__init__(f"Error: La base de datos está ocupada; no se pudo escribir tras {intentos} "
+                         f"intentos en {segundos:.1f} s. Vuelve a intentarlo.")
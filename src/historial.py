@@ -0,0 +1,179 @@
+import sqlite3
+import os
+import threading
+import atexit
+import weakref
+from . import db_connection, escritor
+from .db_connection import conexion
+
+# Cómo se guarda en SQLite cada lista de Mascota.historial_medico
+# (clave del diccionario en memoria -> INSERT en su tabla)
+TABLAS_HISTORIAL = {
+    "vacunas": "INSERT INTO vacunas (id_mascota, nombre, fecha) VALUES (?, ?, ?)",
+    "peso": "INSERT INTO pesos (id_mascota, peso, fecha) VALUES (?, ?, ?)",
+    "observaciones": "INSERT INTO observaciones (id_mascota, texto, fecha) VALUES (?, ?, ?)",
+    "tratamientos": "INSERT INTO tratamientos (id_mascota, texto, fecha) VALUES (?, ?, ?)",
+}
+
+TAMANO_LOTE = 100 # Cuántos registros pendientes fuerzan a escribir en disco
+INTERVALO_SEGUNDOS = 2.0 # Tiempo máximo que un registro espera en memoria antes de guardarse
+
+
+class BufferHistorial:
+    """
+    Buffer de escritura diferida para el historial médico.
+    Los registros nuevos se acumulan en memoria y se guardan todos juntos
+    (executemany en una sola transacción) cuando se llega a 'tamano_lote',
+    cuando pasan 'intervalo' segundos desde el primero pendiente, o al cerrar la app.
+    Si se pasa 'al_guardar', se llama (sin argumentos) después de cada escritura en disco.
+    """
+    def __init__(self, ruta=None, tamano_lote=TAMANO_LOTE, intervalo=INTERVALO_SEGUNDOS, al_guardar=None):
+        self.ruta = os.path.abspath(ruta or db_connection.DB_NAME) # Fijamos el fichero al crear el buffer
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.al_guardar = al_guardar
+        self._pendientes = {clave: [] for clave in TABLAS_HISTORIAL}
+        self._total = 0
+        self._temporizador = None
+        self._cerrojo = threading.Lock() # Protege las listas de pendientes
+        self._cerrojo_vaciado = threading.Lock() # Solo un vaciado a la vez, para respetar el orden
+        _buffers_vivos.add(self)
+
+    def anadir(self, clave, fila):
+        #Encola un registro (clave de historial_medico y tupla de valores del INSERT).
+        with self._cerrojo:
+            self._pendientes[clave].append(fila)
+            self._total += 1
+            lleno = self._total >= self.tamano_lote
+            if not lleno and self._temporizador is None:
+                # Primer registro pendiente: programamos el guardado por tiempo
+                self._temporizador = threading.Timer(self.intervalo, self.vaciar)
+                self._temporizador.daemon = True
+                self._temporizador.start()
+        if lleno:
+            self.vaciar()
+
+    def pendientes(self):
+        #Número de registros que aún no se han escrito en disco.
+        with self._cerrojo:
+            return self._total
+
+    def filas_pendientes(self, ids_mascotas):
+        #Registros aún sin escribir de esas mascotas, por clave (se reparten igual que los de leer_historial_db).
+        with self._cerrojo:
+            return {clave: [f for f in filas if f[0] in ids_mascotas] for clave, filas in self._pendientes.items()}
+
+    def vaciar(self):
+        #Escribe en la BBDD todo lo pendiente en una única transacción.
+        # Devuelve cuántos registros se han guardado.
+        with self._cerrojo_vaciado:
+            guardados = self._vaciar_lote()
+        # Fuera del cerrojo: el aviso puede necesitar otros cerrojos (el de la Veterinaria)
+        if guardados and self.al_guardar is not None:
+            self.al_guardar()
+        return guardados
+
+    def _vaciar_lote(self):
+        with self._cerrojo:
+            lote, self._pendientes = self._pendientes, {clave: [] for clave in TABLAS_HISTORIAL}
+            self._total = 0
+            if self._temporizador is not None:
+                self._temporizador.cancel()
+                self._temporizador = None
+
+        if not any(lote.values()):
+            return 0
+
+        try:
+            # Con reintentos si otro proceso está escribiendo (ver escritor.py)
+            guardados = escritor.escribir(_insertar_lote, lote, ruta=self.ruta)
+        except Exception as e:
+            # Si no se pudo escribir (BBDD bloqueada, por ej.) los devolvemos a la cola
+            print(f"Error guardando historial en DB: {e}")
+            with self._cerrojo:
+                for clave, filas in lote.items():
+                    self._pendientes[clave][:0] = filas
+                    self._total += len(filas)
+            return 0
+        return guardados
+
+
+def _insertar_lote(conn, lote):
+    return sum(_insertar_filas(conn, TABLAS_HISTORIAL[clave], filas) for clave, filas in lote.items() if filas)
+
+def _insertar_filas(conn, sql, filas):
+    #Inserta un bloque con executemany. Si alguna fila rompe una restricción
+    # (mascota que ya no existe, por ej.) repetimos fila a fila y descartamos solo esa.
+    # El SAVEPOINT deshace las filas que executemany llegó a meter antes de fallar.
+    conn.execute("SAVEPOINT lote_historial")
+    try:
+        conn.executemany(sql, filas)
+        conn.execute("RELEASE lote_historial")
+        return len(filas)
+    except sqlite3.IntegrityError:
+        conn.execute("ROLLBACK TO lote_historial")
+        conn.execute("RELEASE lote_historial")
+        guardadas = 0
+        for fila in filas:
+            try:
+                conn.execute(sql, fila)
+                guardadas += 1
+            except sqlite3.IntegrityError as e:
+                print(f"Registro de historial descartado {fila}: {e}")
+        return guardadas
+
+
+def cargar_historial_db(mascotas_por_id, solo_estas=False):
+    #Rellena historial_medico de las mascotas cargadas con lo guardado en la BBDD.
+    # Una consulta por tabla, en orden de inserción. Con solo_estas=True se leen solo
+    # las filas de esas mascotas (carga perezosa); si no, se recorre la tabla entera.
+    if solo_estas and not mascotas_por_id:
+        return
+    repartir_historial(leer_historial_db(list(mascotas_por_id) if solo_estas else None), mascotas_por_id)
+
+def leer_historial_db(ids_mascotas=None):
+    #Filas del historial (de esas mascotas, o de todas si no se dan) por clave de historial_medico.
+    # No necesita las mascotas en memoria: así se puede leer a la vez que ellas (ver Veterinaria).
+    consultas = {
+        "vacunas": "SELECT id_mascota, nombre, fecha FROM vacunas",
+        "peso": "SELECT id_mascota, peso, fecha FROM pesos",
+        "observaciones": "SELECT id_mascota, texto FROM observaciones",
+        "tratamientos": "SELECT id_mascota, texto FROM tratamientos",
+    }
+    ids = ids_mascotas
+    bloques = [None] if ids is None else [ids[i:i + 500] for i in range(0, len(ids), 500)]
+    filas = {clave: [] for clave in consultas}
+    with conexion() as conn:
+        for clave, consulta in consultas.items():
+            for bloque in bloques:
+                if bloque is None:
+                    filas[clave] += conn.execute(consulta + " ORDER BY id").fetchall()
+                else:
+                    filas[clave] += conn.execute(
+                        f"{consulta} WHERE id_mascota IN ({', '.join('?' * len(bloque))}) ORDER BY id", bloque).fetchall()
+    return filas
+
+def repartir_historial(filas, mascotas_por_id):
+    #Añade las filas de leer_historial_db al historial_medico de su mascota (las de otras se ignoran).
+    for clave, filas_clave in filas.items():
+        for fila in filas_clave:
+            mascota = mascotas_por_id.get(fila[0])
+            if mascota:
+                mascota.historial_medico[clave].append(_registro_historial(clave, fila))
+
+def _registro_historial(clave, fila):
+    # Cómo se guarda cada fila en la lista de historial_medico
+    if clave == "vacunas":
+        return {"nombre": fila[1], "fecha": fila[2]}
+    if clave == "peso":
+        return {"peso": fila[1], "fecha": fila[2]}
+    return fila[1]
+
+
+# Al cerrar el proceso guardamos lo que quede pendiente en cualquier buffer
+_buffers_vivos = weakref.WeakSet()
+
+@atexit.register
+def _vaciar_al_salir():
+    for buffer in list(_buffers_vivos):
+        buffer.vaciar()
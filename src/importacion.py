@@ -0,0 +1,235 @@
+import os
+import csv
+import sys
+import sqlite3
+import uuid
+from datetime import date
+from . import db_connection
+from .db_connection import conexion
+from .migraciones import aplicar_migraciones
+from .utils import Utils
+from .tipos import a_dia
+
+# Importación masiva de clientes y mascotas desde un CSV (para dar de alta una clínica entera).
+# Cada fila es un dueño con (opcionalmente) una de sus mascotas; un dueño con varias
+# mascotas aparece en varias filas con el mismo email.
+COLUMNAS = ("propietario", "telefono", "email", "nombre_mascota", "especie", "raza", "fecha_nacimiento")
+
+TAMANO_LOTE = 500 # Filas por transacción
+
+# Destinos soportados: el esquema normalizado del paquete src o el de la app de Streamlit
+DESTINOS = ("veterinaria", "clinica")
+
+
+def _db_utils():
+    # Módulo db_utils de la app de Streamlit. La app lo carga suelto (con su carpeta en sys.path)
+    # y los tests como streamlit.db_utils: usamos el que ya esté cargado para compartir su caché.
+    for nombre in ("db_utils", "streamlit.db_utils"):
+        if nombre in sys.modules:
+            return sys.modules[nombre]
+    carpeta = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "streamlit"))
+    if carpeta not in sys.path:
+        sys.path.append(carpeta)
+    import db_utils
+    return db_utils
+
+
+class ResultadoImportacion:
+    """
+    Resumen de una importación: cuántos registros se han creado y los errores
+    de cada fila que no se pudo importar (el resto de filas sigue adelante).
+    """
+    def __init__(self):
+        self.clientes = 0
+        self.mascotas = 0
+        self.errores = [] # Lista de (número de fila en el CSV, mensaje)
+
+    def __str__(self):
+        return f"Importados {self.clientes} clientes y {self.mascotas} mascotas ({len(self.errores)} filas con errores)"
+
+
+def leer_csv(ruta):
+    #Generador que lee el CSV fila a fila (sin cargarlo entero en memoria).
+    # Devuelve (número de fila, diccionario con las columnas). La fila 1 es la cabecera.
+    with open(ruta, newline="", encoding="utf-8-sig") as fichero:
+        lector = csv.DictReader(fichero)
+        faltan = [c for c in ("propietario", "email") if c not in (lector.fieldnames or [])]
+        if faltan:
+            raise ValueError(f"Faltan columnas obligatorias en el CSV: {', '.join(faltan)}")
+        for numero, fila in enumerate(lector, start=2):
+            yield numero, fila
+
+def validar_fila(fila):
+    #Limpia y valida una fila. Lanza ValueError con el motivo si no es válida.
+    datos = {c: (fila.get(c) or "").strip() for c in COLUMNAS}
+    if not datos["propietario"]:
+        raise ValueError("Falta el nombre del dueño.")
+    if not Utils.validar_email(datos["email"]):
+        raise ValueError(f"El email '{datos['email']}' no es válido.")
+    if datos["fecha_nacimiento"]:
+        try:
+            datos["fecha_nacimiento"] = date.fromisoformat(datos["fecha_nacimiento"])
+        except ValueError:
+            raise ValueError(f"Fecha de nacimiento '{datos['fecha_nacimiento']}' no válida (formato YYYY-MM-DD).")
+    else:
+        datos["fecha_nacimiento"] = None
+    return datos
+
+
+def _guardar_lote(conn, sentencias, resultado):
+    #Escribe un lote: 'sentencias' es una lista de (sql, [(número de fila, parámetros), ...], tipo).
+    # Primero se intenta con executemany; si alguna fila rompe una restricción, se deshace
+    # el lote (SAVEPOINT) y se repite fila a fila para apuntar el error solo en esa fila.
+    # Devuelve, por tipo, los parámetros de las filas que sí se han guardado.
+    guardadas = {tipo: [] for _, _, tipo in sentencias}
+    conn.execute("SAVEPOINT lote_importacion")
+    try:
+        for sql, filas, tipo in sentencias:
+            conn.executemany(sql, [params for _, params in filas])
+        conn.execute("RELEASE lote_importacion")
+        for _, filas, tipo in sentencias:
+            guardadas[tipo] = [params for _, params in filas]
+            setattr(resultado, tipo, getattr(resultado, tipo) + len(filas))
+        return guardadas
+    except sqlite3.IntegrityError:
+        conn.execute("ROLLBACK TO lote_importacion")
+        conn.execute("RELEASE lote_importacion")
+
+    for sql, filas, tipo in sentencias:
+        for numero, params in filas:
+            try:
+                conn.execute(sql, params)
+                guardadas[tipo].append(params)
+                setattr(resultado, tipo, getattr(resultado, tipo) + 1)
+            except sqlite3.IntegrityError as e:
+                resultado.errores.append((numero, f"No se pudo guardar: {e}"))
+    return guardadas
+
+
+def _importar_veterinaria(conn, filas, tamano_lote, resultado):
+    # Esquema normalizado: un registro en clientes por email y uno en mascotas por fila con mascota.
+    # Los dueños que ya estaban en la BBDD se reutilizan (deduplicamos por email en minúsculas).
+    ids_por_email = {
+        str(email).lower(): id_cliente
+        for id_cliente, email in conn.execute("SELECT id_cliente, email FROM clientes WHERE email IS NOT NULL")
+    }
+    sql_cliente = "INSERT INTO clientes (id_cliente, nombre, email, telefono) VALUES (?, ?, ?, ?)"
+    sql_mascota = """
+        INSERT INTO mascotas (id_mascota, nombre, especie, raza, fecha_nacimiento, cliente_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+    clientes, mascotas = [], []
+    nuevos = {} # email -> id de los clientes del lote en curso (aún no se sabe si se guardarán)
+
+    def vaciar():
+        guardadas = _guardar_lote(conn, [(sql_cliente, clientes, "clientes"), (sql_mascota, mascotas, "mascotas")],
+                                  resultado)
+        conn.commit()
+        # Solo los clientes que se han guardado valen para las filas siguientes; si uno se rechazó,
+        # la próxima fila con su email lo vuelve a intentar en vez de apuntar a un id que no existe
+        aceptados = {params[0] for params in guardadas["clientes"]}
+        ids_por_email.update((clave, id_cliente) for clave, id_cliente in nuevos.items() if id_cliente in aceptados)
+        nuevos.clear()
+        clientes.clear()
+        mascotas.clear()
+
+    for numero, datos in filas:
+        clave = datos["email"].lower()
+        id_cliente = ids_por_email.get(clave) or nuevos.get(clave)
+        if id_cliente is None:
+            id_cliente = str(uuid.uuid4())
+            nuevos[clave] = id_cliente
+            clientes.append((numero, (id_cliente, datos["propietario"], datos["email"], datos["telefono"])))
+
+        if datos["nombre_mascota"]:
+            fecha = a_dia(datos["fecha_nacimiento"]) # Columna DIA (None si no se conoce)
+            mascotas.append((numero, (str(uuid.uuid4()), datos["nombre_mascota"], datos["especie"],
+                                      datos["raza"], fecha, id_cliente)))
+
+        if len(clientes) + len(mascotas) >= tamano_lote:
+            vaciar()
+    vaciar()
+
+def _importar_clinica(conn, filas, tamano_lote, resultado):
+    # Esquema plano de clinica_vet.db: una fila de pacientes por mascota con los datos del dueño.
+    # Deduplicamos por email para que todas las mascotas de un dueño lleven el mismo nombre y teléfono.
+    duenos = {
+        str(email).lower(): (propietario, telefono)
+        for email, propietario, telefono in conn.execute(
+            "SELECT email, propietario, telefono FROM pacientes WHERE email IS NOT NULL GROUP BY email")
+    }
+    sql = """
+        INSERT INTO pacientes (nombre, especie, raza, fecha_nacimiento, propietario, telefono, email)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+    pacientes = []
+    nuevos = {} # Dueños del lote en curso: cuentan cuando se guarda alguna de sus mascotas
+
+    def vaciar():
+        guardadas = _guardar_lote(conn, [(sql, pacientes, "mascotas")], resultado)
+        conn.commit()
+        for params in guardadas["mascotas"]:
+            clave = params[6].lower()
+            if clave in nuevos:
+                duenos[clave] = nuevos.pop(clave)
+                resultado.clientes += 1
+        nuevos.clear()
+        pacientes.clear()
+
+    for numero, datos in filas:
+        if not datos["nombre_mascota"]:
+            resultado.errores.append((numero, "Falta el nombre de la mascota."))
+            continue
+        clave = datos["email"].lower()
+        if clave in duenos:
+            propietario, telefono = duenos[clave]
+        else:
+            propietario, telefono = nuevos.setdefault(clave, (datos["propietario"], datos["telefono"]))
+        fecha = str(datos["fecha_nacimiento"]) if datos["fecha_nacimiento"] else None
+        pacientes.append((numero, (datos["nombre_mascota"], datos["especie"], datos["raza"], fecha,
+                                   propietario, telefono, datos["email"])))
+        if len(pacientes) >= tamano_lote:
+            vaciar()
+    vaciar()
+
+
+def importar_csv(ruta_csv, destino="veterinaria", ruta_bd=None, tamano_lote=TAMANO_LOTE):
+    #Importa clientes y mascotas desde un CSV al destino indicado ("veterinaria" o "clinica").
+    # Las filas con errores se apuntan en el resultado y no paran la importación.
+    # Sin 'ruta_bd' se usa la BBDD configurada en ese momento (db_connection.DB_NAME o db_utils.DB_NAME).
+    if destino not in DESTINOS:
+        raise ValueError(f"Destino '{destino}' desconocido. Usa uno de: {', '.join(DESTINOS)}")
+    resultado = ResultadoImportacion()
+
+    def filas_validas():
+        for numero, fila in leer_csv(ruta_csv):
+            try:
+                yield numero, validar_fila(fila)
+            except ValueError as e:
+                resultado.errores.append((numero, str(e)))
+
+    if destino == "veterinaria":
+        importar, migraciones, db_utils = _importar_veterinaria, db_connection.MIGRACIONES, None
+        ruta_bd = ruta_bd or db_connection.DB_NAME
+    else:
+        db_utils = _db_utils()
+        importar, migraciones = _importar_clinica, db_utils.MIGRACIONES
+        ruta_bd = ruta_bd or db_utils.DB_NAME
+    try:
+        with conexion(ruta_bd) as conn:
+            aplicar_migraciones(conn, migraciones) # Una BBDD nueva o antigua queda con el esquema al día
+            importar(conn, filas_validas(), tamano_lote, resultado)
+    finally:
+        if db_utils is not None:
+            # La caché de lecturas de la app no ve lo que escribimos aquí (también si falla a medias)
+            db_utils.cache_consultas.invalidar("pacientes")
+    return resultado
+
+
+if __name__ == '__main__':
+    # Uso: python -m src.importacion fichero.csv [veterinaria|clinica]
+    destino = sys.argv[2] if len(sys.argv) > 2 else "veterinaria"
+    resultado = importar_csv(sys.argv[1], destino)
+    print(resultado)
+    for numero, mensaje in resultado.errores:
+        print(f"  Fila {numero}: {mensaje}")
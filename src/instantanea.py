@@ -0,0 +1,168 @@
+import os
+import sys
+import mmap
+import struct
+import marshal
+from array import array
+from datetime import date
+from . import db_connection
+from .clientes import Cliente
+from .mascotas import Mascota, CLAVES_HISTORIAL
+from .citas import Cita, id_cita_de
+from .tipos import HORAS, a_minutos
+from .migraciones import version_esquema
+from .logging import AppLogger
+
+# Instantánea binaria del estado cargado de la Veterinaria, para arrancar sin leer la BBDD.
+# Se guarda por columnas al lado de la BBDD ('<bbdd>-instantanea'):
+#   - números (días, minutos y posiciones de la mascota o el cliente) en arrays de enteros,
+#     que al leer se ven directamente sobre el fichero mapeado en memoria (mmap), sin copiarlos;
+#   - textos y registros del historial en listas serializadas con marshal (se leen en C de golpe).
+# Las claves foráneas van como posición en la columna de la otra tabla: enlazar es indexar una lista.
+#
+# Lleva un sello: identificador de la BBDD, versión del esquema y contador de cambios de cambios.py.
+# data_version no vale para esto porque solo tiene sentido dentro de una conexión abierta; el
+# contador está en la BBDD y sube con cualquier cambio en clientes, mascotas, citas o historial.
+# Si el sello no coincide, la instantánea no se usa y se carga de SQL.
+
+MAGIA = b"VETI"
+FORMATO = 1
+# Magia, formato, versión de marshal, orden de bytes, id de la BBDD, versión del esquema, secuencia, tamaño del índice
+_CABECERA = struct.Struct("<4sHBB16sIQI")
+_ALINEACION = 8 # Cada columna empieza en un múltiplo de 8 para poder verla como array
+_ORDEN = 1 if sys.byteorder == "little" else 2
+
+
+def ruta_instantanea(ruta_bd=None):
+    return os.path.abspath(ruta_bd or db_connection.DB_NAME) + "-instantanea"
+
+def _sello():
+    # (id de la BBDD, versión del esquema): lo que, junto con la secuencia, tiene que coincidir
+    with db_connection.conexion() as conn:
+        bd = conn.execute("SELECT bd FROM secuencia_cambios").fetchone()[0]
+        return bd.encode(), version_esquema(conn)
+
+
+def guardar_instantanea(clientes, citas, secuencia, ruta=None):
+    #Escribe la instantánea de 'clientes' (con sus mascotas e historial) y 'citas', sellada con
+    # la versión del esquema y 'secuencia' (el contador de cambios de cuando se leyeron).
+    # Se escribe en un fichero temporal y se renombra: nunca queda una instantánea a medias.
+    mascotas = [m for c in clientes for m in c.mascotas]
+    pos_cliente = {c.id: i for i, c in enumerate(clientes)}
+    pos_mascota = {m.id: i for i, m in enumerate(mascotas)}
+    citas = [c for c in citas if c.id_mascota in pos_mascota]
+    columnas = {
+        "clientes.id": [c.id for c in clientes],
+        "clientes.nombre": [c.nombre for c in clientes],
+        "clientes.email": [c.email for c in clientes],
+        "clientes.telefono": [c.telefono for c in clientes],
+        "mascotas.id": [m.id for m in mascotas],
+        "mascotas.nombre": [m.nombre for m in mascotas],
+        "mascotas.especie": [m.especie for m in mascotas],
+        "mascotas.raza": [m.raza for m in mascotas],
+        "mascotas.nacimiento": array("i", (m.fecha_nacimiento.toordinal() if m.fecha_nacimiento else 0
+                                           for m in mascotas)),
+        "mascotas.cliente": array("I", (pos_cliente[m.cliente_id] for m in mascotas)),
+        # None si es el que sale de fecha, hora y mascota (la mayoría): no hace falta guardarlo
+        "citas.id": [None if c.id_cita == id_cita_de(c.fecha, c.hora, c.id_mascota) else c.id_cita for c in citas],
+        "citas.fecha": array("i", (c.fecha.toordinal() for c in citas)),
+        "citas.hora": array("h", (a_minutos(c.hora) for c in citas)),
+        "citas.motivo": [c.motivo for c in citas],
+        "citas.veterinario": [c.veterinario for c in citas],
+        "citas.mascota": array("I", (pos_mascota[c.id_mascota] for c in citas)),
+    }
+    for clave in CLAVES_HISTORIAL:
+        registros = [(i, r) for i, m in enumerate(mascotas) if m.tiene_historial() for r in m.historial_medico[clave]]
+        columnas[f"historial.{clave}.mascota"] = array("I", (i for i, _ in registros))
+        columnas[f"historial.{clave}"] = [r for _, r in registros]
+
+    # Índice: columna -> (typecode del array o "" si va con marshal, inicio, longitud)
+    datos, indice, inicio = [], {}, 0
+    for nombre, valores in columnas.items():
+        if isinstance(valores, array):
+            tipo, bloque = valores.typecode, valores.tobytes()
+        else:
+            tipo, bloque = "", marshal.dumps(valores)
+        relleno = -len(bloque) % _ALINEACION
+        indice[nombre] = (tipo, inicio, len(bloque))
+        datos += [bloque, b"\0" * relleno]
+        inicio += len(bloque) + relleno
+    bloque_indice = marshal.dumps(indice)
+    bloque_indice += b"\0" * (-(_CABECERA.size + len(bloque_indice)) % _ALINEACION)
+
+    ruta = ruta or ruta_instantanea()
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(_CABECERA.pack(MAGIA, FORMATO, marshal.version, _ORDEN, *_sello(), secuencia, len(bloque_indice)))
+        f.write(bloque_indice)
+        f.writelines(datos)
+    os.replace(temporal, ruta)
+    return len(clientes), len(mascotas), len(citas)
+
+
+def cargar_instantanea(secuencia, ruta=None):
+    #Clientes (con mascotas e historial) y citas de la instantánea, o None si no hay una válida
+    # para la BBDD en la secuencia 'secuencia' (no existe, es de otro formato, está dañada o la BBDD ha cambiado).
+    ruta = ruta or ruta_instantanea()
+    sello = _sello()
+    try:
+        with open(ruta, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+            vista = memoryview(mapa)
+            try:
+                return _leer(vista, sello, secuencia)
+            finally:
+                vista.release() # Sin vistas abiertas, el mmap se puede cerrar
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError, KeyError, IndexError, EOFError, BufferError, struct.error) as e:
+        AppLogger("Instantanea").warning(f"Instantánea {ruta} descartada: {e}")
+        return None
+
+def _leer(vista, sello, secuencia):
+    magia, formato, version_marshal, orden, bd, esquema, secuencia_f, largo_indice = _CABECERA.unpack_from(vista)
+    if (magia, formato, version_marshal, orden) != (MAGIA, FORMATO, marshal.version, _ORDEN):
+        raise ValueError("formato distinto")
+    if ((bd, esquema), secuencia_f) != (sello, secuencia):
+        return None # Es de otra BBDD, o esta ha cambiado desde que se guardó
+    indice = marshal.loads(vista[_CABECERA.size:_CABECERA.size + largo_indice])
+    base = _CABECERA.size + largo_indice
+    vistas = []
+
+    def columna(nombre):
+        tipo, inicio, largo = indice[nombre]
+        bloque = vista[base + inicio:base + inicio + largo]
+        if not tipo:
+            return marshal.loads(bloque)
+        vistas.append(bloque.cast(tipo)) # Los enteros se leen sobre el propio fichero
+        return vistas[-1]
+
+    try:
+        clientes = [Cliente(nombre, telefono, email, id_cliente) for id_cliente, nombre, email, telefono
+                    in zip(columna("clientes.id"), columna("clientes.nombre"),
+                           columna("clientes.email"), columna("clientes.telefono"))]
+        mascotas = []
+        for id_mascota, nombre, especie, raza, dia, i in zip(
+                columna("mascotas.id"), columna("mascotas.nombre"), columna("mascotas.especie"),
+                columna("mascotas.raza"), columna("mascotas.nacimiento"), columna("mascotas.cliente")):
+            dueno = clientes[i]
+            mascota = Mascota(nombre, especie, raza, date.fromordinal(dia) if dia else None, dueno.id, id_mascota)
+            dueno.mascotas.append(mascota)
+            mascotas.append(mascota)
+        for clave in CLAVES_HISTORIAL:
+            for i, registro in zip(columna(f"historial.{clave}.mascota"), columna(f"historial.{clave}")):
+                mascotas[i].historial_medico[clave].append(registro)
+
+        fechas = {} # Un solo objeto date por día: muchas citas comparten fecha
+        citas = []
+        for id_cita, dia, minutos, motivo, veterinario, i in zip(
+                columna("citas.id"), columna("citas.fecha"), columna("citas.hora"),
+                columna("citas.motivo"), columna("citas.veterinario"), columna("citas.mascota")):
+            fecha = fechas.get(dia)
+            if fecha is None:
+                fecha = fechas[dia] = date.fromordinal(dia)
+            # id_cita es None si es el generado: entonces lo calcula Cita
+            citas.append(Cita(fecha, HORAS[minutos], motivo, veterinario, mascotas[i], id_cita))
+        return clientes, citas
+    finally:
+        for v in vistas:
+            v.release()
@@ -1,18 +1,29 @@
 import logging
 
 class AppLogger:
-    def __init__(self, name="AppVeterinaria", level=logging.INFO):
+    def __init__(self, name="AppVeterinaria", level=logging.INFO, fichero=None):
+        # Si se indica 'fichero', los mensajes se guardan también en ese fichero de log
         self.logger = logging.getLogger(name)
         self.logger.setLevel(level)
         
         if not self.logger.handlers:
-            handler = logging.StreamHandler()
             formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            handler = logging.StreamHandler()
             handler.setFormatter(formatter)
             self.logger.addHandler(handler)
+            if fichero:
+                handler_fichero = logging.FileHandler(fichero, encoding="utf-8")
+                handler_fichero.setFormatter(formatter)
+                self.logger.addHandler(handler_fichero)
     
     def info(self, message):
         self.logger.info(message)
 
     def error(self, message):
         self.logger.error(message)
+
+    def warning(self, message):
+        self.logger.warning(message)
+
+    def debug(self, message):
+        self.logger.debug(message)
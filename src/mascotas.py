@@ -1,9 +1,18 @@
 import uuid #Para generar un ID unico y aleatorio
 import sqlite3 #Para mirar en la BBDD si un cliente esta repetido por ej.
 from datetime import date
-from .db_connection import get_connection
+from .tipos import a_dia
+from . import cola_escritura
+from .exceptions import BaseDatosOcupadaError
+from .utils import Utils
+
+# Claves del historial médico de cada mascota
+CLAVES_HISTORIAL = ("vacunas", "peso", "observaciones", "tratamientos")
 
 class Mascota:
+    # Atributos fijos (sin __dict__ por objeto) para ocupar menos memoria con muchas mascotas
+    __slots__ = ("id", "nombre", "especie", "raza", "fecha_nacimiento", "cliente_id", "_historial")
+
     def __init__(self, nombre: str, especie: str, raza: str, fecha_nacimiento: date, 
                  cliente_id: str, id_mascota: str = None):
         
@@ -14,54 +23,62 @@ class Mascota:
             self.id = id_mascota
 
         self.nombre = nombre
-        self.especie = especie
-        self.raza = raza
+        self.especie = Utils.internar(especie) # Hay pocas especies y razas distintas
+        self.raza = Utils.internar(raza)
         self.fecha_nacimiento = fecha_nacimiento
         
         # Creamos la foreing key
         self.cliente_id = cliente_id 
         
-        # Historial médico (diccionario en memoria)
-        self.historial_medico = {
-            "vacunas": [],
-            "peso": [],
-            "observaciones": [],
-            "tratamientos": []
-        }
+        # Historial médico (diccionario en memoria). Se crea la primera vez que se usa:
+        # la mayoría de mascotas cargadas nunca lo consultan
+        self._historial = None
+
+    @property
+    def historial_medico(self):
+        if self._historial is None:
+            self._historial = {clave: [] for clave in CLAVES_HISTORIAL}
+        return self._historial
+
+    def tiene_historial(self):
+        #True si ya se ha creado el historial (para recorrerlo sin crearlo en todas las mascotas)
+        return self._historial is not None
 
     def __str__(self):
         return f"Mascota: {self.nombre} (Dueño ID: {self.cliente_id[:8]}...)"
 
 
+def _insertar_mascota(conn, id_mascota, nombre, especie, raza, dia_nacimiento, cliente_id):
+    conn.execute(
+        """
+        INSERT INTO mascotas (id_mascota, nombre, especie, raza, fecha_nacimiento, cliente_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (id_mascota, nombre, especie, raza, dia_nacimiento, cliente_id)
+    )
+    return True
+
+cola_escritura.registrar_operacion("mascota", _insertar_mascota)
+
+def guardar_mascota_db(mascota: Mascota):
+    #Manda a guardar la mascota (por la cola de escritura si está activa). Devuelve un Future.
+    # La fecha se guarda como número de día (columna DIA)
+    return cola_escritura.guardar("mascota", mascota.id, mascota.nombre, mascota.especie, mascota.raza,
+                                  a_dia(mascota.fecha_nacimiento), mascota.cliente_id)
+
 def registrar_mascota_db(mascota: Mascota):
     #Inserta un nuevo objeto Mascota en la tabla 'mascotas' de SQLite.
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     try:
-        # Convertimos la fecha a string para SQLite (formato YYYY-MM-DD)
-        fecha_str = str(mascota.fecha_nacimiento)
-
-        cursor.execute(
-            mascota.id, 
-            mascota.nombre, 
-            mascota.especie, 
-            mascota.raza, 
-            fecha_str, # Guardamos la fecha como texto
-            mascota.cliente_id 
-        )
-        
-        conn.commit()
-        return True
+        return cola_escritura.esperar(guardar_mascota_db(mascota))
     
     except sqlite3.IntegrityError:
         # Esto ocurre si el cliente_id no existe en la tabla de clientes
         print(f"Error: El cliente con ID {mascota.cliente_id} no existe.")
         return False
-        
+
+    except BaseDatosOcupadaError:
+        raise
+
     except Exception as e:
         print(f"Error al insertar mascota: {e}")
-        return False
-        
-    finally:
-        conn.close()
\ No newline at end of file
+        return False
\ No newline at end of file
@@ -0,0 +1,45 @@
+import sqlite3
+
+# Pequeño sistema de migraciones del esquema.
+# Cada BBDD guarda en PRAGMA user_version el número de la última migración aplicada,
+# así al arrancar solo se ejecuta lo que falta (y si está al día no se ejecuta ningún DDL).
+#
+# Una lista de migraciones es una lista de tuplas (numero, pasos) en orden creciente,
+# donde cada paso es una sentencia SQL o una función que recibe la conexión.
+
+def version_esquema(conn):
+    #Devuelve la versión del esquema guardada en la cabecera del fichero.
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def aplicar_migraciones(conn, migraciones):
+    #Aplica, en orden y una sola vez, las migraciones que aún no tenga la BBDD.
+    # Devuelve la versión final del esquema.
+    ultima = migraciones[-1][0]
+    version = version_esquema(conn)
+    if version >= ultima:
+        return version # Esquema al día: no tocamos nada
+
+    for numero, pasos in migraciones:
+        if numero <= version:
+            continue
+
+        # BEGIN IMMEDIATE bloquea a otros escritores, así dos procesos que arrancan
+        # a la vez no aplican la misma migración dos veces
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version_esquema(conn) >= numero:
+                conn.rollback() # Otro proceso se nos adelantó
+                continue
+            for paso in pasos:
+                if callable(paso):
+                    paso(conn)
+                else:
+                    conn.execute(paso)
+            conn.execute(f"PRAGMA user_version = {int(numero)}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        version = numero
+
+    return version
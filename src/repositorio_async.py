@@ -0,0 +1,80 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from . import db_connection
+from .db_connection import conexion
+from .clientes import registrar_cliente_db, cargar_clientes_db, eliminar_clientes_db
+from .mascotas import registrar_mascota_db
+from .citas import registrar_cita_db, cargar_citas_db
+
+# API asíncrona (asyncio) sobre las mismas operaciones de BBDD del paquete.
+# sqlite3 no tiene versión asíncrona, así que cada operación se ejecuta en un
+# ThreadPoolExecutor propio y la corrutina espera sin bloquear el bucle de eventos.
+#
+# Uso:
+#     async with RepositorioAsync() as repo:
+#         clientes, filas = await repo.a_la_vez(repo.cargar_clientes(), repo.leer("SELECT ..."))
+
+
+class RepositorioAsync:
+    """
+    Repositorio asíncrono de clientes, mascotas y citas.
+    Usa tantos hilos como conexiones tiene el pool, así ninguna operación
+    se queda con un hilo parado esperando a que se libere una conexión.
+    """
+    def __init__(self, max_conexiones=None):
+        self.max_conexiones = max_conexiones or db_connection.TAMANO_POOL
+        self._executor = ThreadPoolExecutor(max_workers=self.max_conexiones, thread_name_prefix="sqlite")
+
+    async def _ejecutar(self, funcion, *args):
+        # Lanza la función síncrona en el executor y espera su resultado
+        bucle = asyncio.get_running_loop()
+        return await bucle.run_in_executor(self._executor, functools.partial(funcion, *args))
+
+    # --- Escrituras ---
+
+    async def registrar_cliente(self, cliente):
+        return await self._ejecutar(registrar_cliente_db, cliente)
+
+    async def registrar_mascota(self, mascota):
+        return await self._ejecutar(registrar_mascota_db, mascota)
+
+    async def registrar_cita(self, cita):
+        # Lanza CitaSolapadaError igual que la versión síncrona
+        return await self._ejecutar(registrar_cita_db, cita)
+
+    async def eliminar_clientes(self, ids_clientes):
+        return await self._ejecutar(eliminar_clientes_db, list(ids_clientes))
+
+    # --- Lecturas ---
+
+    async def cargar_clientes(self):
+        return await self._ejecutar(cargar_clientes_db)
+
+    async def cargar_citas(self, mascotas_por_id):
+        return await self._ejecutar(cargar_citas_db, mascotas_por_id)
+
+    async def leer(self, query, params=()):
+        #Consulta libre de solo lectura; devuelve todas las filas.
+        return await self._ejecutar(_leer, query, params)
+
+    async def a_la_vez(self, *lecturas):
+        #Espera varias operaciones independientes a la vez (cada una en su conexión del pool).
+        return await asyncio.gather(*lecturas)
+
+    # --- Cierre ---
+
+    def cerrar(self):
+        #Espera a las operaciones en curso y libera los hilos.
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *excepcion):
+        await asyncio.get_running_loop().run_in_executor(None, self.cerrar)
+
+
+def _leer(query, params):
+    with conexion() as conn:
+        return conn.execute(query, params).fetchall()
@@ -0,0 +1,106 @@
+import json
+import sqlite3
+from datetime import date
+from .agenda import a_minutos, a_hora
+from .logging import AppLogger
+
+# Tipos de columna propios de veterinaria.db (ver migración 5 en db_connection.py).
+#   DIA     -> fecha guardada como número de día (date.toordinal()), se lee como date
+#   MINUTOS -> hora guardada como minutos desde medianoche, se lee como texto 'HH:MM'
+# Los conversores se eligen por el tipo declarado de la columna (las conexiones del pool se
+# abren con PARSE_DECLTYPES), así al leer no hay que parsear ningún texto fila a fila.
+#
+# Al escribir se convierte con a_dia()/a_minutos(). No registramos un adaptador global para
+# date: sqlite3 lo aplicaría también a clinica_vet.db, que sigue guardando las fechas como texto.
+
+# Las 1440 horas posibles ya formateadas: cada cita leída comparte el mismo objeto str
+HORAS = [a_hora(minutos) for minutos in range(24 * 60)]
+
+def a_dia(fecha):
+    #date (o texto 'YYYY-MM-DD') -> número de día para una columna DIA. None se queda en None.
+    if fecha is None:
+        return None
+    if not isinstance(fecha, date):
+        fecha = date.fromisoformat(str(fecha))
+    return fecha.toordinal()
+
+def _leer_dia(valor):
+    return date.fromordinal(int(valor))
+
+def _leer_minutos(valor):
+    return HORAS[int(valor)]
+
+sqlite3.register_converter("DIA", _leer_dia)
+sqlite3.register_converter("MINUTOS", _leer_minutos)
+
+
+def tipar_fechas_y_horas(conn):
+    #Paso de migración: pasa mascotas.fecha_nacimiento a DIA y citas.fecha/hora a DIA/MINUTOS.
+    # Lo que no se puede convertir se apunta en 'filas_malformadas' en vez de inventarlo:
+    # una fecha de nacimiento mala se deja a NULL y una cita sin fecha u hora válida se aparta.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS filas_malformadas (
+            id INTEGER PRIMARY KEY,
+            tabla TEXT NOT NULL,
+            clave TEXT,
+            columna TEXT,
+            valor TEXT,
+            fila TEXT -- La fila entera en JSON si se ha sacado de su tabla
+        )
+    """)
+    malformadas = []
+
+    # Mascotas: cambiamos la columna de sitio (otras tablas apuntan a mascotas, no se puede rehacer)
+    conn.execute("ALTER TABLE mascotas ADD COLUMN nacimiento DIA")
+    nacimientos = []
+    for id_mascota, fecha in conn.execute("SELECT id_mascota, fecha_nacimiento FROM mascotas "
+                                          "WHERE fecha_nacimiento IS NOT NULL").fetchall():
+        try:
+            nacimientos.append((a_dia(fecha), id_mascota))
+        except (TypeError, ValueError):
+            malformadas.append(("mascotas", id_mascota, "fecha_nacimiento", str(fecha), None))
+    conn.executemany("UPDATE mascotas SET nacimiento = ? WHERE id_mascota = ?", nacimientos)
+    conn.execute("ALTER TABLE mascotas DROP COLUMN fecha_nacimiento")
+    conn.execute("ALTER TABLE mascotas RENAME COLUMN nacimiento TO fecha_nacimiento")
+
+    # Citas: nadie apunta a esta tabla, así que se rehace con los tipos nuevos
+    conn.execute("""
+        CREATE TABLE citas_tipadas (
+            id_cita TEXT PRIMARY KEY,
+            fecha DIA NOT NULL,
+            hora MINUTOS NOT NULL,
+            motivo TEXT,
+            veterinario TEXT,
+            id_mascota TEXT,
+            FOREIGN KEY (id_mascota) REFERENCES mascotas (id_mascota)
+                ON DELETE CASCADE
+        )
+    """)
+    citas = []
+    for fila in conn.execute("SELECT id_cita, fecha, hora, motivo, veterinario, id_mascota FROM citas").fetchall():
+        id_cita, fecha, hora = fila[:3]
+        try:
+            citas.append((id_cita, a_dia(fecha), a_minutos(hora), *fila[3:]))
+        except (TypeError, ValueError):
+            columna = "hora" if _es_fecha(fecha) else "fecha"
+            valor = hora if columna == "hora" else fecha
+            malformadas.append(("citas", id_cita, columna, str(valor), json.dumps(fila, ensure_ascii=False)))
+    conn.executemany("INSERT INTO citas_tipadas VALUES (?, ?, ?, ?, ?, ?)", citas)
+    conn.execute("DROP TABLE citas")
+    conn.execute("ALTER TABLE citas_tipadas RENAME TO citas")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_citas_mascota ON citas (id_mascota)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_citas_fecha ON citas (fecha, hora)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_citas_veterinario ON citas (veterinario, fecha, hora)")
+
+    conn.executemany("INSERT INTO filas_malformadas (tabla, clave, columna, valor, fila) VALUES (?, ?, ?, ?, ?)",
+                     malformadas)
+    if malformadas:
+        AppLogger("Migraciones").warning(
+            f"{len(malformadas)} filas con fechas u horas no válidas; están en la tabla filas_malformadas.")
+
+def _es_fecha(valor):
+    try:
+        a_dia(valor)
+        return True
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,291 @@
+import os
+import sys
+import time
+import bisect
+import atexit
+import sqlite3
+import threading
+from .logging import AppLogger
+
+# Trazas de SQL (opcional, para encontrar qué página o función machaca la BBDD).
+# Las conexiones se abren con ConexionTrazada, que mide cada sentencia (texto, número de
+# parámetros, tiempo y filas devueltas), la suma al histograma de latencias de esa sentencia
+# y, si pasa del umbral, la escribe en el log de consultas lentas junto con su EXPLAIN QUERY PLAN.
+#
+# Se activa con la variable de entorno TRAZAR_SQL=1, o llamando a activar() antes de abrir
+# las conexiones (las del pool se abren una vez y se reutilizan). Desactivado no cuesta nada:
+# las conexiones son sqlite3.Connection normales.
+
+UMBRAL_LENTA_MS = float(os.environ.get("UMBRAL_SQL_LENTA_MS", "100"))
+FICHERO_LENTAS = os.environ.get("FICHERO_SQL_LENTAS", "consultas_lentas.log")
+LIMITES_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000) # Cubetas del histograma (la última, > 1 s)
+
+# Solo estas sentencias tienen un plan que merezca la pena enseñar
+_CON_PLAN = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+class EstadisticaSentencia:
+    """
+    Histograma de latencias de una sentencia SQL (agrupada por su texto normalizado).
+    """
+    def __init__(self, sql, parametros):
+        self.sql = sql
+        self.parametros = parametros # Número de parámetros ligados
+        self.llamadas = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.filas = 0
+        self.cubetas = [0] * (len(LIMITES_MS) + 1)
+        self.origenes = {} # Quién la ejecuta (página o módulo:función) -> llamadas
+
+    def anotar(self, ms, filas, origen):
+        self.llamadas += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.filas += max(filas, 0)
+        self.cubetas[bisect.bisect_left(LIMITES_MS, ms)] += 1
+        self.origenes[origen] = self.origenes.get(origen, 0) + 1
+
+    def percentil(self, p):
+        #Cota superior (en ms) de la cubeta donde cae el percentil p (0-100).
+        objetivo = self.llamadas * p / 100
+        acumulado = 0
+        for limite, cuantas in zip(LIMITES_MS + (self.max_ms,), self.cubetas):
+            acumulado += cuantas
+            if acumulado >= objetivo:
+                return min(limite, self.max_ms)
+        return self.max_ms
+
+    def como_dict(self):
+        return {
+            "sql": self.sql,
+            "parametros": self.parametros,
+            "llamadas": self.llamadas,
+            "total_ms": round(self.total_ms, 3),
+            "media_ms": round(self.total_ms / self.llamadas, 3) if self.llamadas else 0,
+            "p95_ms": self.percentil(95),
+            "max_ms": round(self.max_ms, 3),
+            "filas": self.filas,
+            "histograma": dict(zip([f"<={l}ms" for l in LIMITES_MS] + [f">{LIMITES_MS[-1]}ms"], self.cubetas)),
+            "origenes": dict(self.origenes),
+        }
+
+
+class Trazador:
+    """
+    Recoge las trazas de todas las conexiones trazadas del proceso (es seguro entre hilos).
+    """
+    def __init__(self, umbral_ms=UMBRAL_LENTA_MS, fichero=FICHERO_LENTAS):
+        self.umbral_ms = umbral_ms
+        self.fichero = fichero
+        self._estadisticas = {}
+        self._cerrojo = threading.Lock()
+        self._log = None
+
+    def anotar(self, conn, sql, parametros, ms, filas):
+        origen = _origen()
+        clave = " ".join(sql.split()) # Mismo texto con distintos espacios = misma sentencia
+        with self._cerrojo:
+            estadistica = self._estadisticas.get(clave)
+            if estadistica is None:
+                estadistica = self._estadisticas[clave] = EstadisticaSentencia(clave, len(parametros))
+            estadistica.anotar(ms, filas, origen)
+        if ms >= self.umbral_ms:
+            self._registrar_lenta(conn, clave, parametros, ms, filas, origen)
+
+    def _registrar_lenta(self, conn, sql, parametros, ms, filas, origen):
+        if self._log is None:
+            self._log = AppLogger(f"SQLLento.{self.fichero}", fichero=self.fichero)
+        plan = "(sin plan)"
+        if sql.lstrip().upper().startswith(_CON_PLAN):
+            try:
+                # Con el método de la clase base, para no trazar el propio EXPLAIN
+                filas_plan = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, parametros).fetchall()
+                plan = "; ".join(str(f[-1]) for f in filas_plan)
+            except (sqlite3.Error, ValueError, TypeError) as e:
+                plan = f"(no disponible: {e})"
+        self._log.warning(f"{ms:.1f} ms | {filas} filas | {len(parametros)} parámetros | {origen} | {sql} | plan: {plan}")
+
+    def estadisticas(self):
+        #Estadísticas de cada sentencia, de la que más tiempo ha consumido en total a la que menos.
+        with self._cerrojo:
+            datos = [e.como_dict() for e in self._estadisticas.values()]
+        return sorted(datos, key=lambda e: e["total_ms"], reverse=True)
+
+    def por_origen(self):
+        #Llamadas por página o función: para ver quién hace más consultas.
+        totales = {}
+        for estadistica in self.estadisticas():
+            for origen, llamadas in estadistica["origenes"].items():
+                totales[origen] = totales.get(origen, 0) + llamadas
+        return dict(sorted(totales.items(), key=lambda t: t[1], reverse=True))
+
+    def informe(self, limite=20):
+        #Tabla de texto con las sentencias más costosas.
+        lineas = [f"{'llamadas':>9} {'total ms':>10} {'media':>8} {'p95':>8} {'max':>8}  sentencia"]
+        for e in self.estadisticas()[:limite]:
+            lineas.append(f"{e['llamadas']:>9} {e['total_ms']:>10.1f} {e['media_ms']:>8.2f} "
+                          f"{e['p95_ms']:>8.1f} {e['max_ms']:>8.1f}  {e['sql'][:120]}")
+        return "\n".join(lineas)
+
+    def reiniciar(self):
+        with self._cerrojo:
+            self._estadisticas.clear()
+
+
+def _origen():
+    # Página de Streamlit que lanzó la consulta; si no la hay, la primera función fuera de este módulo
+    frame = sys._getframe(2)
+    primero = None
+    while frame is not None:
+        fichero = frame.f_code.co_filename
+        if f"{os.sep}pages{os.sep}" in fichero:
+            return os.path.splitext(os.path.basename(fichero))[0]
+        if primero is None and fichero != __file__ and not fichero.endswith("contextlib.py"):
+            primero = f"{os.path.basename(fichero)}:{frame.f_code.co_name}"
+        frame = frame.f_back
+    return primero or "?"
+
+
+class CursorTrazado(sqlite3.Cursor):
+    """
+    Cursor que mide cada sentencia. En un SELECT el trabajo de SQLite se reparte entre
+    el execute y los fetch, así que la traza se cierra cuando se han leído todas las filas
+    (o al volver a ejecutar, cerrar o soltar el cursor, como en conn.execute(...).fetchone()).
+    """
+    _traza = None # [sql, parámetros, ms acumulados, filas]
+
+    def execute(self, sql, parametros=()):
+        self._cerrar_traza()
+        inicio = time.perf_counter()
+        super().execute(sql, parametros)
+        self._traza = [sql, parametros, (time.perf_counter() - inicio) * 1000, 0]
+        if self.description is None: # No devuelve filas: ya ha terminado
+            self._traza[3] = self.rowcount
+            self._cerrar_traza()
+        return self
+
+    def executemany(self, sql, parametros):
+        self._cerrar_traza()
+        parametros = list(parametros)
+        inicio = time.perf_counter()
+        super().executemany(sql, parametros)
+        ms = (time.perf_counter() - inicio) * 1000
+        trazador.anotar(self.connection, sql, parametros[0] if parametros else (), ms, self.rowcount)
+        return self
+
+    def _leer(self, leer, *args):
+        # Ejecuta un fetch y suma su tiempo a la traza abierta
+        inicio = time.perf_counter()
+        try:
+            resultado = leer(*args)
+        except StopIteration:
+            self._traza[2] += (time.perf_counter() - inicio) * 1000
+            self._cerrar_traza()
+            raise
+        self._traza[2] += (time.perf_counter() - inicio) * 1000
+        return resultado
+
+    def fetchone(self):
+        if self._traza is None:
+            return super().fetchone()
+        fila = self._leer(super().fetchone)
+        if fila is None:
+            self._cerrar_traza()
+        else:
+            self._traza[3] += 1
+        return fila
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        if self._traza is None:
+            return super().fetchmany(size)
+        filas = self._leer(super().fetchmany, size)
+        self._traza[3] += len(filas)
+        if len(filas) < size:
+            self._cerrar_traza()
+        return filas
+
+    def fetchall(self):
+        if self._traza is None:
+            return super().fetchall()
+        filas = self._leer(super().fetchall)
+        self._traza[3] += len(filas)
+        self._cerrar_traza()
+        return filas
+
+    def __next__(self):
+        if self._traza is None:
+            return super().__next__()
+        fila = self._leer(super().__next__) # Si se acaban las filas, _leer cierra la traza
+        self._traza[3] += 1
+        return fila
+
+    def close(self):
+        self._cerrar_traza()
+        super().close()
+
+    def __del__(self):
+        # Un fetchone() que no llega al final no cierra la traza: se anota al soltar el cursor
+        try:
+            self._cerrar_traza()
+        except Exception:
+            pass # Al apagar el intérprete el trazador puede ya no existir
+
+    def _cerrar_traza(self):
+        traza, self._traza = self._traza, None
+        if traza is not None:
+            sql, parametros, ms, filas = traza
+            trazador.anotar(self.connection, sql, parametros, ms, filas)
+
+
+class ConexionTrazada(sqlite3.Connection):
+    """
+    Conexión cuyos cursores (también los de conn.execute) son CursorTrazado.
+    Los COMMIT también se miden: un commit lento bloquea a todos los escritores.
+    """
+    def cursor(self, factory=CursorTrazado):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+    def commit(self):
+        inicio = time.perf_counter()
+        super().commit()
+        trazador.anotar(self, "COMMIT", (), (time.perf_counter() - inicio) * 1000, 0)
+
+
+trazador = Trazador()
+_activo = os.environ.get("TRAZAR_SQL", "") not in ("", "0")
+
+def activar(umbral_ms=None, fichero=None):
+    #Activa las trazas para las conexiones que se abran a partir de ahora.
+    global _activo
+    if umbral_ms is not None:
+        trazador.umbral_ms = umbral_ms
+    if fichero is not None and fichero != trazador.fichero:
+        trazador.fichero = fichero
+        trazador._log = None
+    _activo = True
+
+def desactivar():
+    global _activo
+    _activo = False
+
+def esta_activo():
+    return _activo
+
+def fabrica_conexion():
+    #Clase de conexión para sqlite3.connect(..., factory=...): trazada solo si está activo.
+    return ConexionTrazada if _activo else sqlite3.Connection
+
+
+@atexit.register
+def _informe_al_salir():
+    # Al cerrar el proceso dejamos en el log el resumen de lo que se ha ejecutado
+    if _activo and trazador.estadisticas():
+        AppLogger("TrazasSQL").info("Resumen de SQL ejecutado:\n" + trazador.informe())
@@ -1,3 +1,9 @@
+import sys
+
+# Si está activo, los textos que se repiten mucho (especie, raza, veterinario, hora...)
+# se guardan una sola vez en memoria y todos los objetos apuntan a la misma cadena
+INTERNAR_CADENAS = True
+
 class Utils:
     def validar_email(email):
         #Comprueba si un email tiene un formato básico válido
@@ -8,3 +14,9 @@ class Utils:
     def formatear_nombre(nombre):
         #Convierte un nombre a formato Título y elimina espacios extr
         return str(nombre).strip().title()
+
+    def internar(texto):
+        #Devuelve la copia compartida de un texto repetido (sys.intern) si INTERNAR_CADENAS está activo
+        if INTERNAR_CADENAS and type(texto) is str:
+            return sys.intern(texto)
+        return texto
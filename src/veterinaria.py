@@ -1,153 +1,683 @@
+import os
+import gc
+import time
 import sqlite3
-from datetime import datetime, date
-from .db_connection import get_connection, setup_database
-from .clientes import Cliente, cargar_clientes_db
-from .mascotas import Mascota
-from .citas import Cita 
+import threading
+import functools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from .db_connection import setup_database, abrir_conexion
+from .clientes import Cliente, guardar_cliente_db, cargar_clientes_db, cargar_mascotas_de_clientes_db, clientes_de_mascotas_db
+from .mascotas import Mascota, guardar_mascota_db
+from .citas import Cita, guardar_cita_db, cargar_citas_db, leer_citas_db, construir_citas
+from .agenda import Agenda, normalizar_hora
+from .almacen_citas import AlmacenCitas
+from .historial import BufferHistorial, cargar_historial_db, leer_historial_db, repartir_historial
+from .cambios import leer_cambios, secuencia_actual
+from .instantanea import cargar_instantanea, guardar_instantanea
+from .exceptions import CitaError, CitaSolapadaError, BaseDatosOcupadaError
+from .concurrencia import CerrojoLectoresEscritor
+from .logging import AppLogger
+from . import cola_escritura
+
+# Carga perezosa: al arrancar solo se leen los clientes; las mascotas (con su historial)
+# se leen la primera vez que se usan y las citas por ventanas de fechas cuando se piden.
+# Así el arranque no crece con el tamaño de la BBDD. Se activa con CARGA_PEREZOSA=1.
+CARGA_PEREZOSA = os.environ.get("CARGA_PEREZOSA", "") not in ("", "0")
+
+# Instantánea (ver instantanea.py): tras una carga completa se guarda el estado en un fichero
+# binario y, si al arrancar la BBDD no ha cambiado desde entonces, se carga de ahí y no de SQL.
+# Se desactiva con INSTANTANEA=0.
+INSTANTANEA = os.environ.get("INSTANTANEA", "1") not in ("", "0")
+
+
+# Tiempos del arranque: cada fase apunta sus milisegundos en un diccionario que luego va al log
+@contextmanager
+def _fase(tiempos, nombre):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tiempos[nombre] = (time.perf_counter() - inicio) * 1000
+
+def _en_fase(tiempos, nombre, funcion, *args):
+    with _fase(tiempos, nombre):
+        return funcion(*args)
+
+@contextmanager
+def _sin_recolector():
+    # Al crear cientos de miles de objetos seguidos el recolector de ciclos salta una y otra vez
+    # recorriéndolos todos; durante la carga no puede haber ciclos que liberar, así que se pausa
+    activo = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if activo:
+            gc.enable()
+
+
+# El estado de la Veterinaria lo comparten todas las sesiones de Streamlit (todos los hilos
+# del servidor): las lecturas pueden ir a la vez, pero una escritura o una recarga va sola.
+def _lectura(metodo):
+    @functools.wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        with self._cerrojo.lectura():
+            return metodo(self, *args, **kwargs)
+    return envoltura
+
+def _escritura(metodo):
+    @functools.wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        with self._cerrojo.escritura():
+            try:
+                return metodo(self, *args, **kwargs)
+            finally:
+                # Lo que acabamos de escribir ya está en memoria: no hace falta recargarlo
+                self._absorber_cambios()
+    return envoltura
+
 
 class Veterinaria:
     _instance = None
+    _instance_cerrojo = threading.Lock()
+    carga_perezosa = CARGA_PEREZOSA
+    usar_instantanea = INSTANTANEA
 
     def __new__(cls): #Usamos Singleton en la clase Veterinaria para centralizar el estado y asegurar que todas las páginas accedan a la misma lista de datos y conexión a la base de datos.
-        if cls._instance is None:
-            cls._instance = super(Veterinaria, cls).__new__(cls)
-            cls._instance.inicializar()
+        with cls._instance_cerrojo: # Dos sesiones que arrancan a la vez no deben cargar dos copias
+            if cls._instance is None:
+                instancia = super(Veterinaria, cls).__new__(cls)
+                instancia._cerrojo = CerrojoLectoresEscritor()
+                instancia._vigia = None
+                instancia._vigia_cerrojo = threading.Lock()
+                instancia._version_conocida = None
+                instancia._en_vuelo = 0 # Altas nuestras ya en memoria que aún no están confirmadas en la BBDD
+                instancia.inicializar()
+                cls._instance = instancia
         return cls._instance
 
+    @_escritura
     def inicializar(self):
         #Configura la BBDD y carga los datos en memoria.
         print(" Inicializando sistema...")
-        setup_database() # Crea tablas si no existen
-        
-        # Primero carga los  Clientes y sus Mascotas desde SQLite
-        self.clientes = cargar_clientes_db() 
-        
-        # Cargar Citas desde SQLite 
-        self.citas = self.cargar_citas_db()  
-        
+        tiempos, inicio = {}, time.perf_counter()
+        with _fase(tiempos, "migraciones"):
+            setup_database() # Crea tablas si no existen
+        if cola_escritura.esta_activa():
+            with _fase(tiempos, "cola de escritura"):
+                cola_escritura.obtener_cola() # Arranca el escritor (y repite lo que quedó pendiente en su diario)
+
+        # Si veníamos de una carga anterior, guardamos antes el historial pendiente
+        if getattr(self, "historial_pendiente", None) is not None:
+            self.historial_pendiente.vaciar()
+        self.historial_pendiente = BufferHistorial(al_guardar=self._historial_guardado)
+
+        # Conexión propia solo para vigilar si otro proceso (u otra app) cambia la BBDD.
+        # Leemos la versión antes de cargar: si alguien escribe mientras cargamos, se recargará otra vez.
+        self._abrir_vigia()
+        self._version_conocida = self._version_datos()
+        self._secuencia = secuencia_actual() # Marca de agua para refrescar() (ver cambios.py)
+
+        with _sin_recolector():
+            self._cargar(tiempos)
+
+        total = (time.perf_counter() - inicio) * 1000
+        AppLogger("Arranque").info(f"Datos cargados en {total:.1f} ms: "
+                                   + " | ".join(f"{fase} {ms:.1f} ms" for fase, ms in tiempos.items()))
         print("✅ Sistema inicializado correctamente con SQLite.")
 
+    def _cargar(self, tiempos):
+        if self.carga_perezosa:
+            # Solo los clientes. Ni mascotas, ni historial, ni citas: se irán cargando según se usen
+            with _fase(tiempos, "clientes"):
+                self.clientes = cargar_clientes_db(perezoso=True)
+            self._dias_cargados = set()
+            self.citas = self._indexar_citas([])
+        elif not self._cargar_de_instantanea(tiempos):
+            self._cargar_en_paralelo(tiempos)
+            if self.usar_instantanea:
+                with _fase(tiempos, "guardar instantánea"):
+                    self._guardar_instantanea()
+
+    def _cargar_en_paralelo(self, tiempos):
+        # Clientes (con sus mascotas), historial y citas se leen a la vez, cada lectura en su hilo
+        # y con su conexión del pool: en WAL los lectores no se bloquean entre sí, y sqlite3 suelta
+        # el GIL mientras SQLite lee. Al final se enlaza todo con las mascotas en una sola pasada.
+        hilos = ThreadPoolExecutor(max_workers=3, thread_name_prefix="arranque")
+        with _fase(tiempos, "lectura en paralelo"), hilos:
+            clientes = hilos.submit(_en_fase, tiempos, "clientes y mascotas", cargar_clientes_db)
+            historial = hilos.submit(_en_fase, tiempos, "historial", leer_historial_db)
+            citas = hilos.submit(_en_fase, tiempos, "citas", leer_citas_db)
+            lista_clientes = clientes.result()
+            with _fase(tiempos, "índices"): # Solo el indexado; mientras, las otras dos lecturas siguen
+                self.clientes = lista_clientes
+            filas_historial, filas_citas = historial.result(), citas.result()
+        with _fase(tiempos, "enlazar"):
+            repartir_historial(filas_historial, self._mascotas_por_id)
+            self.citas = self._indexar_citas(construir_citas(filas_citas, self._mascotas_por_id))
+
+
+    def _cargar_de_instantanea(self, tiempos):
+        # Si la instantánea es de la BBDD tal y como está ahora, los objetos salen de ella sin SQL
+        if not self.usar_instantanea:
+            return False
+        with _fase(tiempos, "instantánea"):
+            leido = cargar_instantanea(self._secuencia)
+            if leido is None:
+                return False
+            self.clientes, citas = leido
+            self.citas = self._indexar_citas(citas)
+        return True
+
+    def _guardar_instantanea(self):
+        try:
+            guardar_instantanea(self.clientes, self.citas, self._secuencia)
+        except OSError as e:
+            AppLogger("Arranque").warning(f"No se pudo guardar la instantánea: {e}")
+
+    def guardar_instantanea(self):
+        #Guarda una instantánea del estado actual, al día con la BBDD, para que el próximo
+        # arranque no tenga que leer de SQL. Devuelve False si ahora no se puede (carga perezosa
+        # o altas aún sin confirmar, que no están en la BBDD).
+        with self._cerrojo.escritura():
+            if self.carga_perezosa or self._en_vuelo:
+                return False
+            self.refrescar() # Trae lo de otros procesos: la memoria queda igual que la BBDD
+            self._guardar_instantanea()
+        return True
+
+
+    # --- Detección de cambios externos ---
+    # PRAGMA data_version cambia en una conexión cada vez que OTRA conexión confirma una
+    # transacción en el fichero. Consultarlo es casi gratis (no lee tablas), así cada
+    # página puede comprobarlo en cada ejecución y solo recargar si de verdad hubo cambios.
+
+    def _abrir_vigia(self):
+        with self._vigia_cerrojo:
+            if self._vigia is not None:
+                self._vigia.close()
+            self._vigia = abrir_conexion()
+
+    def _version_datos(self):
+        with self._vigia_cerrojo:
+            return self._vigia.execute("PRAGMA data_version").fetchone()[0]
+
+    def _absorber_cambios(self):
+        # Tras una escritura nuestra la versión ha cambiado, pero no sabemos si solo por nosotros:
+        # otro proceso puede haber confirmado algo a la vez. Así que no la damos por conocida sin
+        # más: traemos lo cambiado desde la marca de agua del contador de cambios. Lo nuestro ya
+        # está en memoria y se vuelve a aplicar igual; lo de los demás entra.
+        if self._vigia is None or getattr(self, "_secuencia", None) is None:
+            return # Aún no ha terminado de inicializarse
+        if self._version_datos() != self._version_conocida:
+            self._traer_cambios()
+
+    def _historial_guardado(self):
+        # El buffer del historial escribe desde su propio hilo: también es un cambio nuestro
+        with self._cerrojo.escritura():
+            self._absorber_cambios()
+
+    def hay_cambios_externos(self):
+        #True si alguien que no somos nosotros ha escrito en la BBDD desde la última carga.
+        # Refrescar no quita lo que no está en la BBDD, así que las altas nuestras en vuelo no estorban.
+        return self._version_datos() != self._version_conocida
+
+    def refrescar_si_cambio(self):
+        #Trae los cambios solo si la BBDD ha cambiado por fuera. Devuelve True si refrescó.
+        if not self.hay_cambios_externos():
+            return False
+        with self._cerrojo.escritura():
+            if not self.hay_cambios_externos():
+                return False # Otra sesión ya refrescó mientras esperábamos
+            self.refrescar()
+        return True
+
+    def refrescar(self):
+        #Aplica en memoria solo lo que ha cambiado en la BBDD desde la última carga o refresco:
+        # lo borrado se quita, lo nuevo se añade y lo modificado se actualiza (con sus índices).
+        # Devuelve cuántas filas cambiadas se han leído.
+        with self._cerrojo.escritura():
+            self.historial_pendiente.vaciar() # Así el historial que se relea ya incluye lo nuestro
+            return self._traer_cambios()
+
+    def _traer_cambios(self):
+        # refrescar() sin vaciar antes el historial pendiente (lo que aún no se ha escrito de una
+        # mascota que se relee se le vuelve a poner, ver _aplicar_mascotas). Con el cerrojo de escritura.
+        # La versión se toma antes de leer: lo que se escriba mientras tanto se verá la próxima vez
+        self._version_conocida = self._version_datos()
+        cambios = leer_cambios(self._secuencia)
+        if cambios.secuencia < self._secuencia:
+            self.inicializar() # El contador ha ido hacia atrás: es otro fichero, se carga entero
+            return len(cambios)
+        self._aplicar_borrados(cambios.borrados)
+        self._aplicar_clientes(cambios.clientes)
+        self._aplicar_mascotas(cambios.mascotas)
+        self._aplicar_citas(cambios.citas)
+        self._secuencia = cambios.secuencia
+        return len(cambios)
+
+    def _aplicar_borrados(self, borrados):
+        # Primero las citas, luego las mascotas y luego los clientes (igual que los ON DELETE CASCADE)
+        self._quitar_citas([c for c in map(self._citas_por_id.get, borrados["citas"]) if c])
+        for mascota in [m for m in map(self._mascotas_por_id.get, borrados["mascotas"]) if m]:
+            dueno = self._clientes_por_id.get(mascota.cliente_id)
+            if dueno is not None:
+                self._quitar_mascota(dueno, mascota)
+        clientes = [c for c in map(self._clientes_por_id.get, borrados["clientes"]) if c]
+        for cliente in clientes:
+            self._desindexar_cliente(cliente)
+        if clientes:
+            self._clientes = [c for c in self._clientes if c not in clientes]
+
+    def _aplicar_clientes(self, filas):
+        for id_cliente, nombre, email, telefono in filas:
+            cliente = self._clientes_por_id.get(id_cliente)
+            if cliente is None:
+                # En modo perezoso sus mascotas se leerán al usarlas, como las de los demás
+                cliente = Cliente(nombre, telefono, email, id_cliente, mascotas_pendientes=self.carga_perezosa)
+                self._clientes.append(cliente)
+                self._indexar_cliente(cliente)
+                continue
+            email_anterior = str(cliente.email).lower()
+            if self._clientes_por_email.get(email_anterior) is cliente:
+                del self._clientes_por_email[email_anterior]
+            if nombre != cliente.nombre and cliente.mascotas_cargadas():
+                self.almacen_citas.poner_dueno([m.id for m in cliente.mascotas], nombre)
+            cliente.nombre, cliente.email, cliente.telefono = nombre, email, telefono
+            self._clientes_por_email.setdefault(str(email).lower(), cliente)
+
+    def _aplicar_mascotas(self, filas):
+        # Una mascota cambiada sigue siendo el mismo objeto (las citas apuntan a él);
+        # su historial se vuelve a leer, porque apuntar en él también cuenta como cambio
+        releer, movidas = {}, []
+        for id_mascota, nombre, especie, raza, fecha_nacimiento, id_cliente in filas:
+            dueno = self._clientes_por_id.get(id_cliente)
+            if dueno is None or not dueno.mascotas_cargadas():
+                continue # En modo perezoso se leerá entera cuando se use
+            mascota = self._mascotas_por_id.get(id_mascota)
+            if mascota is None:
+                mascota = Mascota(nombre, especie, raza, fecha_nacimiento, id_cliente, id_mascota)
+                dueno.mascotas.append(mascota)
+                self._indexar_mascota(dueno, mascota)
+            else:
+                if (mascota.nombre, mascota.cliente_id) != (nombre, id_cliente):
+                    # Cambia de nombre o de dueño: se reindexa y cambia lo que sale en la tabla de citas
+                    anterior = self._clientes_por_id.get(mascota.cliente_id)
+                    if anterior is not None:
+                        self._quitar_mascota(anterior, mascota)
+                    mascota.nombre, mascota.cliente_id = nombre, id_cliente
+                    dueno.mascotas.append(mascota)
+                    self._indexar_mascota(dueno, mascota)
+                    movidas.append(mascota)
+                mascota.especie, mascota.raza, mascota.fecha_nacimiento = especie, raza, fecha_nacimiento
+                for registros in mascota.historial_medico.values():
+                    registros.clear()
+            releer[mascota.id] = mascota
+        cargar_historial_db(releer, solo_estas=True)
+        repartir_historial(self.historial_pendiente.filas_pendientes(releer), releer)
+        if movidas:
+            citas = [c for c in self.citas if c.mascota in movidas]
+            self.almacen_citas.quitar(ids_cita=[c.id_cita for c in citas])
+            for cita in citas:
+                dueno = self._clientes_por_id.get(cita.mascota.cliente_id)
+                self.almacen_citas.anadir(cita, dueno.nombre if dueno else "")
+
+    def _aplicar_citas(self, filas):
+        if self.carga_perezosa:
+            filas = [f for f in filas if f[1] in self._dias_cargados] # Los otros días se leerán al pedirlos
+            self._precargar_mascotas([f[5] for f in filas])
+        nuevas, viejas = [], []
+        for fila in filas:
+            cita = self._citas_por_id.get(fila[0])
+            if cita is not None:
+                if (cita.fecha, cita.hora, cita.motivo, cita.veterinario, cita.id_mascota) == tuple(fila[1:]):
+                    continue # Ya la teníamos así (normalmente, una cita que hemos creado nosotros)
+                viejas.append(cita)
+            nuevas.append(fila)
+        self._quitar_citas(viejas)
+        for cita in construir_citas(nuevas, self._mascotas_por_id):
+            self.citas.append(cita)
+            self._indexar_cita(cita)
+
 
     def cargar_citas_db(self):
-        citas_memoria = []
-        conn = get_connection()
-        cursor = conn.cursor()
+        #Carga las citas de la BBDD (enlazadas con las mascotas en memoria) y rellena la agenda.
+        return self._indexar_citas(cargar_citas_db(self._mascotas_por_id))
+
+    def _indexar_citas(self, citas):
+        # Rehace la agenda, los índices de citas y el almacén por columnas a partir de la lista 'citas'
+        self.agenda = Agenda() # Huecos ocupados por veterinario y día
+        self._citas_por_dia = {}
+        self._citas_por_id = {}
+        ids = [self._indexar_cita(cita, en_bloque=True) for cita in citas]
+        self.agenda.anadir_lote((c.veterinario, c.fecha, c.hora) for c in citas)
+        self.almacen_citas = AlmacenCitas() # Las mismas citas por columnas, para la tabla de la página
+        duenos = {m.id: c.nombre for c in self._clientes if c.mascotas_cargadas() for m in c.mascotas}
+        self.almacen_citas.anadir_lote(citas, ids, duenos)
+        return citas
+
+    def _indexar_cita(self, cita, en_bloque=False):
+        # Con en_bloque=True solo los índices por día e id: la agenda y el almacén se llenan después de golpe
+        id_cita = cita.id_cita
+        self._citas_por_dia.setdefault(cita.fecha, []).append(cita)
+        self._citas_por_id[id_cita] = cita
+        if en_bloque:
+            return id_cita
+        dueno = self._clientes_por_id.get(cita.mascota.cliente_id)
+        self.almacen_citas.anadir(cita, dueno.nombre if dueno else "", id_cita)
         try:
-            # Pedimos todas las citas
-            cursor.execute("SELECT id_cita, fecha, hora, motivo, veterinario, id_mascota FROM citas")
-            rows = cursor.fetchall()
-            
-            for row in rows:
-                id_c, fecha_str, hora, motivo, vet, id_mascota = row
-                
-                # Buscar el objeto mascota real en memoria usando el ID
-                mascota_obj = self.buscar_mascota_por_id(id_mascota)
-                
-                if mascota_obj:
-                    # Convertir fecha string a objeto date de Python
-                    try:
-                        fecha_obj = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-                    except ValueError:
-                        fecha_obj = date.today() # Por si la fecha viniera mal
-                    
-                    # Recreamos el objeto Cita
-                    cita = Cita(fecha_obj, hora, motivo, vet, mascota_obj)
-                    cita.id_cita = id_c # Le volvemos a poner su ID original
-                    citas_memoria.append(cita)
-        except Exception as e:
-            print(f" Error cargando citas: {e}")
-        finally:
-            conn.close()
-        return citas_memoria
+            self.agenda.anadir(cita.veterinario, cita.fecha, cita.hora)
+        except (CitaError, ValueError):
+            pass # Citas antiguas solapadas o con hora mal escrita: se cargan igual
+        return id_cita
+
+    # Las cargas perezosas añaden a las listas, índices, agenda y almacén que recorren las lecturas,
+    # así que van con el cerrojo de escritura. Como no se puede pasar de lectura a escritura, los
+    # métodos de lectura las piden ANTES de coger su cerrojo de lectura. Se comprueba dos veces
+    # si falta algo: sin cerrojo (lo normal es que ya esté) y otra vez ya con él.
+
+    def _dias_sin_cargar(self, desde, hasta):
+        return [desde + timedelta(days=n) for n in range((hasta - desde).days + 1)
+                if desde + timedelta(days=n) not in self._dias_cargados]
+
+    def _asegurar_ventana(self, desde, hasta):
+        # En modo perezoso, carga las citas de los días entre 'desde' y 'hasta' que aún no estén en memoria
+        if not self.carga_perezosa or not self._dias_sin_cargar(desde, hasta):
+            return
+        with self._cerrojo.escritura():
+            faltan = self._dias_sin_cargar(desde, hasta)
+            if not faltan:
+                return # Otra sesión los cargó mientras esperábamos
+            dias = set(faltan)
+            filas = [f for f in leer_citas_db(faltan[0], faltan[-1]) if f[1] in dias]
+            self._precargar_mascotas([f[5] for f in filas])
+            for cita in construir_citas(filas, self._mascotas_por_id):
+                self.citas.append(cita)
+                self._indexar_cita(cita)
+            self._dias_cargados.update(dias)
+
+    def citas_entre(self, desde, hasta):
+        #Citas entre dos fechas (incluidas), ordenadas por fecha y hora.
+        # En modo perezoso solo se leen de la BBDD los días que aún no se habían pedido.
+        self._asegurar_ventana(desde, hasta)
+        with self._cerrojo.lectura():
+            citas = []
+            for n in range((hasta - desde).days + 1):
+                citas += self._citas_por_dia.get(desde + timedelta(days=n), [])
+        return sorted(citas, key=lambda c: (c.fecha, c.hora))
+
+    def citas_dataframe(self, desde, hasta):
+        #Tabla (DataFrame de pandas) de las citas entre dos fechas, ordenada por fecha y hora.
+        # Sale del almacén por columnas: no se recorren los objetos Cita uno a uno.
+        self._asegurar_ventana(desde, hasta)
+        with self._cerrojo.lectura():
+            return self.almacen_citas.a_dataframe(desde, hasta)
 
     def crear_cita(self, fecha, hora, motivo, veterinario, mascota):
-        #Crea una cita en memoria y la guarda en la BBDD.
+        #Crea una cita, la guarda en la BBDD y, si se guardó, la deja en memoria.
+        # Lanza CitaSolapadaError si el veterinario ya tiene una cita que se solapa.
+        nueva_cita, futuro = self._reservar_cita(fecha, hora, motivo, veterinario, mascota)
+        if self._esperar_guardado(futuro, functools.partial(self._anular_cita, nueva_cita)):
+            print(f"📅 Cita guardada en BD: {nueva_cita.id_cita}")
+            return nueva_cita
+        print(" Error guardando cita en BD.")
+        return None
+
+    @_escritura
+    def _reservar_cita(self, fecha, hora, motivo, veterinario, mascota):
+        # Ocupa el hueco en memoria y manda la cita a la BBDD, que vuelve a comprobar
+        # el solape por si otra sesión (u otro proceso) reservó el hueco antes
+        hora = normalizar_hora(hora)
+        self._asegurar_ventana(fecha, fecha)
+        if not self.agenda.esta_libre(veterinario, fecha, hora):
+            raise CitaSolapadaError(veterinario, fecha, hora)
         nueva_cita = Cita(fecha, hora, motivo, veterinario, mascota)
         self.citas.append(nueva_cita)
-        
-        from .citas import registrar_cita_db 
-        
-        if registrar_cita_db(nueva_cita):
-            print(f"📅 Cita guardada en BD: {nueva_cita.id_cita}")
-        else:
-            print(" Error guardando cita en BD.")
-        return nueva_cita
+        self._indexar_cita(nueva_cita)
+        self._en_vuelo += 1
+        return nueva_cita, guardar_cita_db(nueva_cita)
+
+    def _anular_cita(self, cita):
+        if self._citas_por_id.get(cita.id_cita) is cita:
+            self._quitar_citas([cita])
 
+    def _quitar_citas(self, citas):
+        # Quita de memoria esas citas: de la lista, los índices, la agenda y el almacén por columnas
+        if not citas:
+            return
+        for cita in citas:
+            self.agenda.quitar(cita.veterinario, cita.fecha, cita.hora)
+            self._citas_por_dia[cita.fecha].remove(cita)
+            del self._citas_por_id[cita.id_cita]
+        quitadas = {cita.id_cita for cita in citas}
+        self.citas = [c for c in self.citas if c.id_cita not in quitadas]
+        self.almacen_citas.quitar(ids_cita=quitadas)
 
+    def _esperar_guardado(self, futuro, deshacer):
+        # Espera a que la BBDD confirme un alta SIN tener el cerrojo: así, con la cola de escritura,
+        # las altas de varias sesiones acaban en el mismo commit. Si no se pudo guardar, se quita
+        # de memoria con 'deshacer'. Devuelve True si quedó guardada. Un solape o la BBDD ocupada
+        # por otro proceso se relanzan para que la página lo diga, en vez de perder el alta sin avisar.
+        # Si se agota la espera también se quita; si el alta acaba guardándose, refrescar() la trae.
+        try:
+            guardado, error = cola_escritura.esperar(futuro), None
+        except Exception as e:
+            guardado, error = False, e
+        with self._cerrojo.escritura():
+            if not guardado:
+                deshacer()
+            self._en_vuelo -= 1
+            self._absorber_cambios() # Lo que acabamos de escribir ya está en memoria
+        if isinstance(error, (CitaSolapadaError, BaseDatosOcupadaError)):
+            raise error
+        if error is not None:
+            print(f" No se pudo guardar en BD: {error}")
+        return guardado
+
+    def huecos_libres(self, veterinario, desde, hasta=None):
+        #Horas libres del veterinario para cada día entre 'desde' y 'hasta'.
+        self._asegurar_ventana(desde, hasta or desde)
+        with self._cerrojo.lectura():
+            return self.agenda.huecos_libres(veterinario, desde, hasta)
+
+
+    # --- Índices en memoria ---
+    # Diccionarios que apuntan a los mismos objetos que self.clientes, para que
+    # las búsquedas sean O(1) en vez de recorrer todas las listas.
+
+    @property
+    def clientes(self):
+        return self._clientes
+
+    @clientes.setter
+    def clientes(self, lista):
+        #Si se sustituye la lista entera (al cargar de la BBDD, por ej.) reconstruimos los índices.
+        self._clientes = lista
+        self._reconstruir_indices()
+
+    def _reconstruir_indices(self):
+        self._clientes_por_email = {}
+        self._clientes_por_id = {}
+        self._mascotas_por_id = {}
+        self._mascotas_por_nombre = {} # Clave: (id del cliente, nombre de la mascota en minúsculas)
+        for cliente in self._clientes:
+            self._indexar_cliente(cliente)
+
+    def _indexar_cliente(self, cliente):
+        # Con setdefault, si hubiera duplicados, gana el primero (igual que al recorrer la lista)
+        self._clientes_por_email.setdefault(str(cliente.email).lower(), cliente)
+        self._clientes_por_id.setdefault(cliente.id, cliente)
+        if cliente.mascotas_cargadas(): # En modo perezoso no forzamos la carga
+            for mascota in cliente.mascotas:
+                self._indexar_mascota(cliente, mascota)
+
+    def _indexar_mascota(self, cliente, mascota):
+        self._mascotas_por_id.setdefault(mascota.id, mascota)
+        self._mascotas_por_nombre.setdefault((cliente.id, mascota.nombre.lower()), mascota)
+
+    def _asegurar_mascotas(self, cliente):
+        # Carga (si hacía falta) e indexa las mascotas de un cliente
+        with self._cerrojo.escritura():
+            for mascota in cliente.mascotas:
+                self._indexar_mascota(cliente, mascota)
+
+    def _precargar_mascotas(self, ids_mascotas):
+        # Carga de una vez las mascotas de todos los dueños de 'ids_mascotas' que no estén en memoria
+        if not self.carga_perezosa or all(i in self._mascotas_por_id for i in ids_mascotas):
+            return
+        with self._cerrojo.escritura():
+            faltan = [i for i in dict.fromkeys(ids_mascotas) if i not in self._mascotas_por_id]
+            if not faltan:
+                return
+            clientes = [c for c in map(self._clientes_por_id.get, clientes_de_mascotas_db(faltan)) if c]
+            pendientes = [c.id for c in clientes if not c.mascotas_cargadas()]
+            leidas = cargar_mascotas_de_clientes_db(pendientes) if pendientes else {}
+            for cliente in clientes:
+                if not cliente.mascotas_cargadas():
+                    cliente.fijar_mascotas(leidas.get(cliente.id, []))
+                for mascota in cliente.mascotas:
+                    self._indexar_mascota(cliente, mascota)
+
+    def _desindexar_cliente(self, cliente):
+        for mascota in cliente.mascotas:
+            if self._mascotas_por_id.get(mascota.id) is mascota:
+                del self._mascotas_por_id[mascota.id]
+            clave = (cliente.id, mascota.nombre.lower())
+            if self._mascotas_por_nombre.get(clave) is mascota:
+                del self._mascotas_por_nombre[clave]
+        email = str(cliente.email).lower()
+        if self._clientes_por_email.get(email) is cliente:
+            del self._clientes_por_email[email]
+        if self._clientes_por_id.get(cliente.id) is cliente:
+            del self._clientes_por_id[cliente.id]
+
+
+    @_lectura
     def buscar_cliente(self, email):
         #Busca un cliente por su email.
-        for c in self.clientes:
-            if c.email.lower() == email.lower():
-                return c
-        return None
+        return self._clientes_por_email.get(str(email).lower())
+
+    @_lectura
+    def buscar_cliente_por_id(self, id_cliente):
+        #Busca un cliente por su ID.
+        return self._clientes_por_id.get(id_cliente)
 
     def buscar_mascota_por_id(self, id_mascota):
         #Busca una mascota por su ID único entre todos los clientes
-        for cliente in self.clientes:
-            for mascota in cliente.mascotas:
-                if mascota.id == id_mascota:
-                    return mascota
-        return None
+        self._precargar_mascotas([id_mascota]) # En modo perezoso, si aún no está en memoria
+        with self._cerrojo.lectura():
+            return self._mascotas_por_id.get(id_mascota)
 
     def buscar_mascota_de_cliente(self, email_cliente, nombre_mascota): #Para los clientes que tienen varias mascotas
         #Busca una mascota por nombre dentro de un cliente específico
         cliente = self.buscar_cliente(email_cliente)
         if cliente:
-            for m in cliente.mascotas:
-                if m.nombre.lower() == nombre_mascota.lower():
-                    return m
+            clave = (cliente.id, nombre_mascota.lower())
+            if clave not in self._mascotas_por_nombre and self.carga_perezosa:
+                self._asegurar_mascotas(cliente)
+            with self._cerrojo.lectura():
+                return self._mascotas_por_nombre.get(clave)
         return None
 
 
     def registrar_cliente(self, nombre, telefono, email):
         #Crea cliente y lo guarda en SQLite.
+        nuevo_cliente, futuro = self._alta_cliente(nombre, telefono, email)
+        if nuevo_cliente and self._esperar_guardado(futuro, functools.partial(self._quitar_cliente, nuevo_cliente)):
+            print(f"👤 Cliente registrado: {nombre}")
+            return nuevo_cliente
+        return None
+
+    @_escritura
+    def _alta_cliente(self, nombre, telefono, email):
         # Verificar si ya existe en memoria para ahorrar consulta
         if self.buscar_cliente(email):
             print(" El cliente ya existe en memoria.")
-            return None
+            return None, None
 
+        # Se añade ya en memoria: así nadie más da de alta el mismo email mientras se guarda
         nuevo_cliente = Cliente(nombre, telefono, email)
-        
-        from .clientes import registrar_cliente_db
-        
-        if registrar_cliente_db(nuevo_cliente):
-            self.clientes.append(nuevo_cliente)
-            print(f"👤 Cliente registrado: {nombre}")
-            return nuevo_cliente
-        return None
+        self.clientes.append(nuevo_cliente)
+        self._indexar_cliente(nuevo_cliente)
+        self._en_vuelo += 1
+        return nuevo_cliente, guardar_cliente_db(nuevo_cliente)
+
+    def _quitar_cliente(self, cliente):
+        self._desindexar_cliente(cliente)
+        if cliente in self.clientes:
+            self.clientes.remove(cliente)
 
+    @_escritura
     def eliminar_cliente(self, email):
         #Borra cliente de memoria y BBDD y sus mascotas en tambien
-        cliente = self.buscar_cliente(email)
-        if cliente:
-            from .clientes import eliminar_cliente_db
-            if eliminar_cliente_db(cliente.id):
-                self.clientes.remove(cliente)
-                # Recargamos citas para que desaparezcan las de este cliente
-                self.citas = self.cargar_citas_db() 
-                print(f"🗑️ Cliente {email} eliminado.")
-                return True
+        if self.eliminar_clientes([email]):
+            print(f"🗑️ Cliente {email} eliminado.")
+            return True
         return False
 
+    @_escritura
+    def eliminar_clientes(self, emails):
+        #Borra varios clientes (con sus mascotas, citas e historial) en una sola transacción.
+        # En memoria solo quitamos lo afectado, sin volver a cargar las citas de la BBDD.
+        # Devuelve cuántos clientes se han borrado.
+        # Un email repetido (o el mismo con otras mayúsculas) es un solo cliente: se cuenta una vez
+        clientes = list(dict.fromkeys(c for c in (self.buscar_cliente(e) for e in dict.fromkeys(emails)) if c))
+        if not clientes:
+            return 0
+
+        # Guardamos antes el historial pendiente para que el borrado lo incluya
+        self.historial_pendiente.vaciar()
+        from .clientes import eliminar_clientes_db
+        # En memoria solo se quitan los que la BBDD ha borrado de verdad
+        ids_clientes = set(eliminar_clientes_db([c.id for c in clientes], devolver_ids=True))
+        clientes = [c for c in clientes if c.id in ids_clientes]
+        if not clientes:
+            return 0
+
+        ids_mascotas = {m.id for c in clientes for m in c.mascotas}
+        for cliente in clientes:
+            self._desindexar_cliente(cliente)
+        self._clientes = [c for c in self._clientes if c.id not in ids_clientes]
+        self._quitar_citas([c for c in self.citas if c.id_mascota in ids_mascotas])
+        self.almacen_citas.quitar(ids_mascota=ids_mascotas) # Y sus dueños
+        return len(clientes)
+
     def registrar_mascota(self, email_cliente, nombre, especie, raza, fecha_nacimiento):
         #Añade una mascota a un cliente existente y guarda en SQLite.
+        cliente, nueva_mascota, futuro = self._alta_mascota(email_cliente, nombre, especie, raza, fecha_nacimiento)
+        if nueva_mascota is None:
+            return None
+        if self._esperar_guardado(futuro, functools.partial(self._quitar_mascota, cliente, nueva_mascota)):
+            print(f"🐾 Mascota {nombre} registrada a {cliente.nombre}.")
+            return nueva_mascota
+        print(" Fallo al guardar mascota en BD.")
+        return None
+
+    @_escritura
+    def _alta_mascota(self, email_cliente, nombre, especie, raza, fecha_nacimiento):
         cliente = self.buscar_cliente(email_cliente)
-        
-        if cliente:
-            nueva_mascota = Mascota(nombre, especie, raza, fecha_nacimiento, cliente.id)
-            from .mascotas import registrar_mascota_db
-            
-            if registrar_mascota_db(nueva_mascota):
-                cliente.mascotas.append(nueva_mascota)
-                print(f"🐾 Mascota {nombre} registrada a {cliente.nombre}.")
-                return nueva_mascota
-            else:
-                print(" Fallo al guardar mascota en BD.")
-        else:
+        if not cliente:
             print(" No se encontró al cliente.")
-        return None
+            return None, None, None
+        nueva_mascota = Mascota(nombre, especie, raza, fecha_nacimiento, cliente.id)
+        cliente.mascotas.append(nueva_mascota)
+        self._indexar_mascota(cliente, nueva_mascota)
+        self._en_vuelo += 1
+        return cliente, nueva_mascota, guardar_mascota_db(nueva_mascota)
+
+    def _quitar_mascota(self, cliente, mascota):
+        if mascota in cliente.mascotas:
+            cliente.mascotas.remove(mascota)
+        if self._mascotas_por_id.get(mascota.id) is mascota:
+            del self._mascotas_por_id[mascota.id]
+        clave = (cliente.id, mascota.nombre.lower())
+        if self._mascotas_por_nombre.get(clave) is mascota:
+            del self._mascotas_por_nombre[clave]
 
 
+    @_escritura
     def anadir_vacuna(self, email_cliente, nombre_mascota, vacuna, fecha):
         #Registra una vacuna en el historial de la mascota
         mascota = self.buscar_mascota_de_cliente(email_cliente, nombre_mascota)
@@ -155,12 +685,14 @@ class Veterinaria:
         if mascota:
             registro = {"nombre": vacuna, "fecha": str(fecha)}
             mascota.historial_medico["vacunas"].append(registro)
+            self.historial_pendiente.anadir("vacunas", (mascota.id, vacuna, str(fecha)))
             print(f"💉 Vacuna '{vacuna}' registrada a {nombre_mascota}.")
             return True
         else:
             print("No se encontró la mascota o el cliente para vacunar.")
             return False
 
+    @_escritura
     def registrar_peso(self, email_cliente, nombre_mascota, peso, fecha):
         #Registra el peso en el historial
         mascota = self.buscar_mascota_de_cliente(email_cliente, nombre_mascota)
@@ -168,20 +700,45 @@ class Veterinaria:
         if mascota:
             registro = {"peso": peso, "fecha": str(fecha)}
             mascota.historial_medico["peso"].append(registro)
+            self.historial_pendiente.anadir("peso", (mascota.id, peso, str(fecha)))
             print(f"⚖️ Peso de {peso}kg registrado a {nombre_mascota}.")
             return True
         else:
             print("No se encontró la mascota o el cliente para vacunar.")
             return False
 
+    @_escritura
     def anadir_observacion(self, email_cliente, nombre_mascota, texto_observacion):
         #Añade observaciones veterinarias
         mascota = self.buscar_mascota_de_cliente(email_cliente, nombre_mascota)
         
         if mascota:
             mascota.historial_medico["observaciones"].append(texto_observacion)
+            self.historial_pendiente.anadir("observaciones", (mascota.id, texto_observacion, str(date.today())))
             print(f"📝 Observación añadida a {nombre_mascota}.")
             return True
         else:
             print("No se encontró la mascota o el cliente para vacunar.")
-            return False
\ No newline at end of file
+            return False
+
+    @_escritura
+    def anadir_tratamiento(self, email_cliente, nombre_mascota, texto_tratamiento):
+        #Añade un tratamiento al historial
+        mascota = self.buscar_mascota_de_cliente(email_cliente, nombre_mascota)
+        
+        if mascota:
+            mascota.historial_medico["tratamientos"].append(texto_tratamiento)
+            self.historial_pendiente.anadir("tratamientos", (mascota.id, texto_tratamiento, str(date.today())))
+            print(f"💊 Tratamiento añadido a {nombre_mascota}.")
+            return True
+        else:
+            print("No se encontró la mascota o el cliente para el tratamiento.")
+            return False
+
+
+def obtener_veterinaria():
+    #Devuelve la Veterinaria compartida por todas las sesiones del servidor,
+    # recargándola antes solo si la BBDD ha cambiado desde fuera.
+    veterinaria = Veterinaria()
+    veterinaria.refrescar_si_cambio()
+    return veterinaria
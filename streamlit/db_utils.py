@@ -1,18 +1,36 @@
 
 import sqlite3
+import sys
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from datetime import date
+# Igual que en las páginas: añadimos la raíz del proyecto para poder usar el paquete src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.migraciones import aplicar_migraciones
+from src.agenda import Agenda, normalizar_hora, limites_solape
+from src.exceptions import CitaError
+from src import escritor # Escrituras con BEGIN IMMEDIATE y reintentos si otro proceso tiene la BBDD bloqueada
+from src import trazas # TRAZAR_SQL=1 para medir cada consulta (ver src/trazas.py)
 
 DB_NAME = "clinica_vet.db"
 
+#Con varias instancias de Streamlit contra el mismo fichero: en WAL leer no bloquea a quien escribe
+#(ni al revés), y las escrituras esperan su turno en escritor.escribir en vez de fallar.
 def get_connection():
-    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, factory=trazas.fabrica_conexion())
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA foreign_keys = ON") # Para que SQLite haga cumplir las FOREIGN KEY
     return conn
 
-def create_tables():
-    conn = get_connection()
-    c = conn.cursor()
-    
-    # Tabla Pacientes
-    c.execute('''
+# Migraciones del esquema de clinica_vet.db (PRAGMA user_version guarda la última aplicada)
+MIGRACIONES = [
+    (1, [
+        # Tabla Pacientes
+        '''
         CREATE TABLE IF NOT EXISTS pacientes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             nombre TEXT NOT NULL,
@@ -23,10 +41,10 @@ def create_tables():
             telefono TEXT,
             email TEXT
         )
-    ''')
+        ''',
 
-    # Tabla Citas 
-    c.execute('''
+        # Tabla Citas 
+        '''
         CREATE TABLE IF NOT EXISTS citas (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             paciente_id INTEGER,
@@ -36,10 +54,10 @@ def create_tables():
             veterinario TEXT,
             FOREIGN KEY(paciente_id) REFERENCES pacientes(id)
         )
-    ''')
+        ''',
 
-    # Tabla Historial 
-    c.execute('''
+        # Tabla Historial 
+        '''
         CREATE TABLE IF NOT EXISTS historial (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             paciente_id INTEGER,
@@ -48,24 +66,537 @@ def create_tables():
             tratamiento TEXT,
             FOREIGN KEY(paciente_id) REFERENCES pacientes(id)
         )
-    ''')
-    
-    conn.commit()
+        ''',
+    ]),
+    (2, [
+        # Ver_Clientes agrupa por email y cuenta mascotas: con este índice la consulta
+        # se resuelve solo con el índice (no lee la tabla)
+        "CREATE INDEX IF NOT EXISTS idx_pacientes_email ON pacientes (email, propietario, telefono)",
+        # JOIN citas-pacientes y borrado de citas de un paciente
+        "CREATE INDEX IF NOT EXISTS idx_citas_paciente ON citas (paciente_id)",
+        # Gestion_citas ordena por fecha DESC, hora ASC: el índice ya está en ese orden
+        "CREATE INDEX IF NOT EXISTS idx_citas_fecha ON citas (fecha DESC, hora)",
+        # Historial_medico filtra por paciente y ordena por fecha
+        "CREATE INDEX IF NOT EXISTS idx_historial_paciente ON historial (paciente_id, fecha)",
+    ]),
+    (3, [
+        # Índice de texto completo (FTS5) para el buscador de Ver_Mascotas.
+        # Es una tabla "external content": no duplica los datos, lee de pacientes.
+        # remove_diacritics hace que "Tomas" encuentre "Tomás".
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS pacientes_fts USING fts5(
+            nombre, raza, especie, propietario, email,
+            content='pacientes', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        # Triggers para que el índice siga a la tabla en cada INSERT, UPDATE y DELETE
+        '''
+        CREATE TRIGGER IF NOT EXISTS pacientes_fts_insert AFTER INSERT ON pacientes BEGIN
+            INSERT INTO pacientes_fts (rowid, nombre, raza, especie, propietario, email)
+            VALUES (new.id, new.nombre, new.raza, new.especie, new.propietario, new.email);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS pacientes_fts_delete AFTER DELETE ON pacientes BEGIN
+            INSERT INTO pacientes_fts (pacientes_fts, rowid, nombre, raza, especie, propietario, email)
+            VALUES ('delete', old.id, old.nombre, old.raza, old.especie, old.propietario, old.email);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS pacientes_fts_update AFTER UPDATE ON pacientes BEGIN
+            INSERT INTO pacientes_fts (pacientes_fts, rowid, nombre, raza, especie, propietario, email)
+            VALUES ('delete', old.id, old.nombre, old.raza, old.especie, old.propietario, old.email);
+            INSERT INTO pacientes_fts (rowid, nombre, raza, especie, propietario, email)
+            VALUES (new.id, new.nombre, new.raza, new.especie, new.propietario, new.email);
+        END
+        ''',
+        # Indexamos los pacientes que ya existían
+        "INSERT INTO pacientes_fts (pacientes_fts) VALUES ('rebuild')",
+    ]),
+    (4, [
+        # Estadísticas para el planificador
+        "ANALYZE",
+    ]),
+    (5, [
+        # Agenda por veterinario: solapes y huecos libres son búsquedas por rango en este índice
+        "CREATE INDEX IF NOT EXISTS idx_citas_veterinario ON citas (veterinario, fecha, hora)",
+        "ANALYZE citas",
+    ]),
+]
+
+def create_tables():
+    # Crea las tablas y aplica las migraciones pendientes.
+    # Si el esquema ya está al día no se ejecuta ningún CREATE.
+    conn = get_connection()
+    antes = conn.execute("PRAGMA user_version").fetchone()[0]
+    if aplicar_migraciones(conn, MIGRACIONES) != antes:
+        cache_consultas.limpiar() # Esquema nuevo (o BBDD nueva): nada de lo guardado vale
     conn.close()
 
+
+# --- Caché de lecturas ---
+# Streamlit vuelve a ejecutar la página entera en cada interacción, así que las mismas SELECT
+# (lista de pacientes, dueños agrupados, citas con JOIN) se repiten una y otra vez.
+# read_query guarda el resultado por (BBDD, SQL, parámetros) y recuerda de qué tablas depende;
+# run_query mira qué tabla modifica y borra solo las entradas que dependen de ella.
+# Lo que escriben otros procesos (la ETL, importaciones) no pasa por aquí: para eso está el TTL.
+
+TAMANO_CACHE = 256 # Resultados guardados como mucho (se descarta el menos usado)
+TTL_CACHE_S = float(os.environ.get("TTL_CACHE_CONSULTAS", "60")) # 0 = sin caducidad
+
+_RE_SELECT = re.compile(r"\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+# Piezas de una SELECT: textos, comentarios, identificadores (con o sin comillas) y símbolos sueltos
+_RE_PIEZA = re.compile(r"""'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/|"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\]"""
+                       r"""|[A-Za-z_][\w$]*|\S""", re.DOTALL)
+# Palabras que pueden ir detrás de una tabla y no son su alias
+_FIN_DE_TABLA = {"where", "group", "order", "limit", "offset", "having", "window", "union", "except",
+                 "intersect", "join", "left", "right", "full", "inner", "outer", "cross", "natural",
+                 "on", "using", "indexed", "not", "returning", "values", "select", "as"}
+_RE_TABLA_ESCRITURA = re.compile(
+    r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+([A-Za-z_][\w.]*)",
+    re.IGNORECASE)
+# Tablas que cambian solas cuando cambia otra (los triggers mantienen el índice FTS)
+_TABLAS_DERIVADAS = {"pacientes": ("pacientes_fts",)}
+
+def _piezas(query):
+    # Identificadores sin comillas y símbolos; los textos quedan como "'" y los comentarios desaparecen
+    piezas = []
+    for pieza in _RE_PIEZA.findall(query):
+        if pieza.startswith(("--", "/*")):
+            continue
+        if pieza.startswith("'"):
+            piezas.append("'")
+        elif pieza[0] in "\"`[":
+            piezas.append(pieza[1:-1].lower()) # Entre comillas es siempre un identificador
+        else:
+            piezas.append(pieza.lower())
+    return piezas
+
+def _cierre(piezas, i):
+    # Posición del ')' que cierra el '(' de piezas[i]
+    nivel = 0
+    for j in range(i, len(piezas)):
+        nivel += {"(": 1, ")": -1}.get(piezas[j], 0)
+        if nivel == 0:
+            return j
+    raise ValueError("paréntesis sin cerrar")
+
+def _es_nombre(pieza):
+    return pieza[0].isalpha() or pieza[0] == "_"
+
+def _recorrer(piezas, tablas, ctes):
+    # Busca tablas en toda la consulta: detrás de FROM/JOIN, en las CTE y dentro de cada paréntesis.
+    # 'ctes' son los nombres de CTE visibles: como en SQLite, una CTE tapa a la tabla que se llame
+    # igual desde que se declara (también en su cuerpo) y las de un paréntesis no salen de él.
+    i = 0
+    while i < len(piezas):
+        if piezas[i] == "with":
+            i = _leer_ctes(piezas, i + 1, tablas, ctes)
+        elif piezas[i] in ("from", "join"):
+            i = _leer_tablas(piezas, i + 1, tablas, ctes)
+        elif piezas[i] == "(":
+            fin = _cierre(piezas, i)
+            _recorrer(piezas[i + 1:fin], tablas, set(ctes))
+            i = fin + 1
+        else:
+            i += 1
+
+def _leer_ctes(piezas, i, tablas, ctes):
+    # WITH [RECURSIVE] nombre [(columnas)] AS [NOT] [MATERIALIZED] (cuerpo), ...
+    if piezas[i] == "recursive":
+        i += 1
+    while True:
+        ctes.add(piezas[i])
+        i += 1
+        if piezas[i] == "(":
+            i = _cierre(piezas, i) + 1
+        if piezas[i] != "as":
+            raise ValueError("CTE sin AS")
+        i += 1
+        while piezas[i] in ("not", "materialized"):
+            i += 1
+        if piezas[i] != "(":
+            raise ValueError("CTE sin cuerpo")
+        fin = _cierre(piezas, i)
+        _recorrer(piezas[i + 1:fin], tablas, set(ctes))
+        i = fin + 1
+        if piezas[i] != ",":
+            return i
+        i += 1
+
+def _leer_tablas(piezas, i, tablas, ctes):
+    # tabla [[AS] alias] [INDEXED BY índice | NOT INDEXED], (subconsulta) [[AS] alias], ...
+    # Devuelve por dónde sigue la consulta; lanza ValueError si encuentra algo que no entiende.
+    while True:
+        if piezas[i] == "(":
+            fin = _cierre(piezas, i)
+            _recorrer(piezas[i + 1:fin], tablas, set(ctes))
+            i = fin + 1
+        elif _es_nombre(piezas[i]) and piezas[i] not in _FIN_DE_TABLA:
+            if i + 1 < len(piezas) and piezas[i + 1] == "(":
+                raise ValueError("función de tabla") # json_each(...) y similares: no sabemos qué leen
+            if i + 2 < len(piezas) and piezas[i + 1] == ".":
+                i += 2 # esquema.tabla
+            if piezas[i] not in ctes:
+                tablas.add(piezas[i])
+            i += 1
+        else:
+            raise ValueError(f"tabla inesperada: {piezas[i]}")
+        if i < len(piezas) and piezas[i] == "as":
+            i += 2
+        elif i < len(piezas) and _es_nombre(piezas[i]) and piezas[i] not in _FIN_DE_TABLA:
+            i += 1 # Alias sin AS
+        if i < len(piezas) and piezas[i] == "indexed":
+            i += 3
+        elif piezas[i:i + 2] == ["not", "indexed"]:
+            i += 2
+        if i >= len(piezas) or piezas[i] != ",":
+            return i
+        i += 1
+
+def tablas_leidas(query):
+    #Tablas (en minúsculas) de las que lee una SELECT, o None si no se puede saber con certeza
+    # (y entonces no se guarda en caché). Entiende listas con comas (FROM a, b), JOIN,
+    # subconsultas y CTE: el nombre de una CTE no es una tabla, lo que lee su cuerpo sí.
+    tablas = set()
+    try:
+        _recorrer(_piezas(query), tablas, set())
+    except (IndexError, ValueError):
+        return None
+    return tablas
+
+def tabla_escrita(query):
+    #Tabla que modifica un INSERT/UPDATE/DELETE, o None si no se sabe (DDL, PRAGMA...).
+    encontrada = _RE_TABLA_ESCRITURA.match(query)
+    return encontrada.group(1).lower() if encontrada else None
+
+
+class CacheConsultas:
+    """
+    Caché LRU de resultados de SELECT, con tamaño máximo y caducidad opcional,
+    que sabe de qué tablas depende cada entrada para invalidar solo esas.
+    """
+    def __init__(self, tamano=TAMANO_CACHE, ttl=TTL_CACHE_S):
+        self.tamano = tamano
+        self.ttl = ttl or None
+        self._entradas = OrderedDict() # clave -> (filas, tablas, instante)
+        self._por_tabla = {} # tabla -> claves que dependen de ella
+        self._cerrojo = threading.Lock() # Cada sesión de Streamlit va en su hilo
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave):
+        #Filas guardadas para 'clave', o None si no están (o han caducado).
+        with self._cerrojo:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and self.ttl and time.monotonic() - entrada[2] > self.ttl:
+                self._quitar(clave)
+                entrada = None
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def guardar(self, clave, filas, tablas):
+        with self._cerrojo:
+            if clave in self._entradas:
+                self._quitar(clave)
+            self._entradas[clave] = (filas, tablas, time.monotonic())
+            for tabla in tablas:
+                self._por_tabla.setdefault(tabla, set()).add(clave)
+            while len(self._entradas) > self.tamano:
+                self._quitar(next(iter(self._entradas)))
+
+    def invalidar(self, *tablas):
+        #Borra las entradas que leen de alguna de estas tablas (o de sus derivadas).
+        with self._cerrojo:
+            for tabla in tablas:
+                for afectada in (tabla, *_TABLAS_DERIVADAS.get(tabla, ())):
+                    for clave in list(self._por_tabla.get(afectada, ())):
+                        self._quitar(clave)
+
+    def limpiar(self):
+        with self._cerrojo:
+            self._entradas.clear()
+            self._por_tabla.clear()
+
+    def _quitar(self, clave):
+        filas, tablas, _ = self._entradas.pop(clave)
+        for tabla in tablas:
+            claves = self._por_tabla.get(tabla)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._por_tabla[tabla]
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+cache_consultas = CacheConsultas()
+
+def _invalidar_por(query):
+    # Invalida lo que dependa de la tabla que modifica 'query' (todo, si no se sabe cuál es)
+    tabla = tabla_escrita(query)
+    if tabla is None:
+        cache_consultas.limpiar()
+    else:
+        cache_consultas.invalidar(tabla)
+
 #Nos sirve para cuando queramos hacer cambios en la bbdd, sin esto tendriamos que llamar a la bbdd todo el rato cada vez que queramos cambiar algo
+#Si otro proceso tiene la bbdd bloqueada se reintenta; si no se consigue lanza BaseDatosOcupadaError.
 def run_query(query, params=()): 
     conn = get_connection()
-    c = conn.cursor()
-    c.execute(query, params)
-    conn.commit()
-    conn.close()
+    try:
+        escritor.escribir(lambda c: c.execute(query, params), conn=conn)
+    finally:
+        _invalidar_por(query) # También si falla: puede haber escrito algo antes del error
+        conn.close()
 
 #Nos sirve para cuando queremos mirar y sacar informacion de la bbdd
+#Las SELECT se sirven de la caché si ya se hicieron y nadie ha tocado sus tablas desde entonces.
 def read_query(query, params=()):
+    tablas = tablas_leidas(query) if _RE_SELECT.match(query) else None
+    clave = (DB_NAME, query, tuple(params.items()) if isinstance(params, dict) else tuple(params))
+    if tablas:
+        filas = cache_consultas.obtener(clave)
+        if filas is not None:
+            return list(filas) # Copia: quien la recibe puede ordenarla o darle la vuelta
     conn = get_connection()
     c = conn.cursor()
     c.execute(query, params)
     data = c.fetchall()
     conn.close()
-    return data
\ No newline at end of file
+    if tablas:
+        cache_consultas.guardar(clave, tuple(data), frozenset(tablas))
+    return data
+
+#Buscador de pacientes sobre el índice FTS5: SQLite devuelve solo las filas que coinciden,
+#ordenadas por relevancia, en vez de cargar la tabla entera en pandas y filtrar allí.
+def buscar_pacientes(texto, especie=None, limite=500):
+    # Cada palabra se busca como prefijo ("tob" encuentra "Toby") y tienen que aparecer todas.
+    # Las comillas evitan que algo como "OR" o "-" se interprete como sintaxis de FTS5.
+    terminos = re.findall(r"\w+", str(texto))
+    if not terminos:
+        return []
+    consulta_fts = " ".join(f'"{t}"*' for t in terminos)
+
+    query = """
+        SELECT p.nombre, p.especie, p.raza, p.fecha_nacimiento, p.propietario, p.telefono, p.email
+        FROM pacientes_fts
+        JOIN pacientes p ON p.id = pacientes_fts.rowid
+        WHERE pacientes_fts MATCH ?
+    """
+    params = [consulta_fts]
+    if especie:
+        query += " AND p.especie = ?"
+        params.append(especie)
+    query += " ORDER BY pacientes_fts.rank LIMIT ?"
+    params.append(limite)
+    return read_query(query, tuple(params))
+
+
+
+#Borra uno o varios dueños (todas las filas de pacientes con esos emails) junto con sus citas
+#e historial, en una sola transacción y con DELETE por conjuntos en vez de uno por mascota.
+#Devuelve cuántos dueños (emails distintos) se han borrado, no cuántos pacientes.
+def eliminar_duenos(emails, tamano_bloque=500):
+    emails = list(dict.fromkeys(emails))
+    conn = get_connection()
+    try:
+        return escritor.escribir(_borrar_duenos, emails, tamano_bloque, conn=conn)
+    finally:
+        cache_consultas.invalidar("citas", "historial", "pacientes")
+        conn.close()
+
+def _borrar_duenos(conn, emails, tamano_bloque):
+    c = conn.cursor()
+    borrados = 0
+    # Troceamos por si la lista es enorme (SQLite limita los '?' por sentencia)
+    for i in range(0, len(emails), tamano_bloque):
+        bloque = emails[i:i + tamano_bloque]
+        marcas = ", ".join("?" * len(bloque))
+        pacientes_del_bloque = f"SELECT id FROM pacientes WHERE email IN ({marcas})"
+        c.execute(f"DELETE FROM citas WHERE paciente_id IN ({pacientes_del_bloque})", bloque)
+        c.execute(f"DELETE FROM historial WHERE paciente_id IN ({pacientes_del_bloque})", bloque)
+        borrados += c.execute(f"SELECT COUNT(DISTINCT email) FROM pacientes WHERE email IN ({marcas})", bloque).fetchone()[0]
+        c.execute(f"DELETE FROM pacientes WHERE email IN ({marcas})", bloque)
+    return borrados
+
+
+# --- Paginación por clave (keyset / seek) ---
+# En vez de OFFSET (que obliga a SQLite a leer y tirar todas las filas anteriores),
+# cada página empieza justo después de la última fila de la anterior usando los
+# valores de las columnas de orden, que están indexadas. Así cualquier página cuesta lo mismo.
+
+TAMANO_PAGINA = 50
+
+class Pagina:
+    """
+    Una página de resultados. Los cursores son los valores de las claves de orden
+    de la primera/última fila; None significa que no hay página en esa dirección.
+    """
+    def __init__(self, filas, cursor_anterior, cursor_siguiente, total_aproximado):
+        self.filas = filas
+        self.cursor_anterior = cursor_anterior
+        self.cursor_siguiente = cursor_siguiente
+        self.total_aproximado = total_aproximado
+
+def _condicion_keyset(orden, cursor, hacia_atras):
+    # Construye "a >= ? AND ((a > ?) OR (a = ? AND b < ?) OR ...)" respetando la dirección de cada clave.
+    # Lo hacemos así (y no con (a, b) > (?, ?)) porque el orden puede mezclar ASC y DESC.
+    # La primera parte, redundante, es la que deja a SQLite saltar directamente a esa
+    # posición del índice en vez de recorrerlo desde el principio.
+    # Las claves de orden no pueden ser NULL ("col > NULL" nunca es cierto).
+    def operador(direccion, estricto=True):
+        mayor = (direccion.upper() == "ASC") != hacia_atras
+        return (">" if mayor else "<") + ("" if estricto else "=")
+
+    primera, direccion_primera = orden[0]
+    partes = []
+    params = []
+    for i, (columna, direccion) in enumerate(orden):
+        iguales = [f"{c} = ?" for c, _ in orden[:i]]
+        partes.append("(" + " AND ".join(iguales + [f"{columna} {operador(direccion)} ?"]) + ")")
+        params.extend(cursor[:i + 1])
+
+    condicion = f"{primera} {operador(direccion_primera, estricto=False)} ? AND (" + " OR ".join(partes) + ")"
+    return condicion, [cursor[0]] + params
+
+def paginar(consulta, orden, params=(), cursor=None, hacia_atras=False, tamano=TAMANO_PAGINA,
+            agrupar=None, total_aproximado=None):
+    # consulta: SELECT ... FROM ... [WHERE ...] sin ORDER BY ni GROUP BY, cuyas últimas
+    #   columnas son las claves de orden (sin NULL, y la última única, p.ej. el id).
+    # orden: lista de (columna, "ASC"/"DESC") con las mismas columnas, tal cual se usan en el WHERE.
+    # agrupar: columnas del GROUP BY, si la consulta agrupa.
+    # cursor: cursor_siguiente o cursor_anterior de la página desde la que venimos.
+    # Devuelve una Pagina con las filas ya sin las columnas de clave.
+    n_claves = len(orden)
+    sql = consulta
+    params_sql = list(params)
+    if cursor is not None:
+        # Metemos la condición directamente en la consulta (no en una subconsulta)
+        # para que SQLite pueda ir por el índice y parar al llegar al LIMIT
+        condicion, params_condicion = _condicion_keyset(orden, list(cursor), hacia_atras)
+        sql += (" AND " if re.search(r"\bWHERE\b", consulta, re.IGNORECASE) else " WHERE ")
+        sql += f"({condicion})"
+        params_sql += params_condicion
+    if agrupar:
+        sql += f" GROUP BY {agrupar}"
+
+    # Hacia atrás leemos en orden inverso y luego damos la vuelta a las filas
+    invertir = {"ASC": "DESC", "DESC": "ASC"}
+    sql += " ORDER BY " + ", ".join(
+        f"{c} {invertir[d.upper()] if hacia_atras else d.upper()}" for c, d in orden
+    )
+    sql += " LIMIT ?"
+    params_sql.append(tamano + 1) # Una de más para saber si hay otra página después
+
+    filas = read_query(sql, tuple(params_sql))
+    hay_mas = len(filas) > tamano
+    filas = filas[:tamano]
+    if hacia_atras:
+        filas.reverse()
+
+    claves = [tuple(f[-n_claves:]) for f in filas]
+    if hacia_atras:
+        cursor_anterior = claves[0] if hay_mas and claves else None
+        cursor_siguiente = claves[-1] if claves else cursor
+    else:
+        cursor_anterior = claves[0] if cursor is not None and claves else None
+        cursor_siguiente = claves[-1] if hay_mas else None
+
+    return Pagina([f[:-n_claves] for f in filas], cursor_anterior, cursor_siguiente, total_aproximado)
+
+def contar_aproximado(tabla):
+    # Recuento barato (no recorre la tabla): el rango de rowid, que SQLite resuelve mirando
+    # solo los extremos del árbol. Cuenta de más si se han borrado filas por el medio.
+    fila = read_query(f"SELECT IFNULL(MAX(rowid) - MIN(rowid) + 1, 0) FROM {tabla}")
+    return fila[0][0]
+
+# Consultas paginadas que usan las páginas (las claves de orden tienen índice)
+
+def listar_pacientes(cursor=None, hacia_atras=False, especie=None, tamano=TAMANO_PAGINA):
+    consulta = """
+        SELECT nombre, especie, raza, fecha_nacimiento, propietario, telefono, email, id
+        FROM pacientes
+    """
+    params = ()
+    if especie:
+        consulta += " WHERE especie = ?"
+        params = (especie,)
+    return paginar(consulta, [("id", "ASC")], params, cursor, hacia_atras, tamano,
+                   total_aproximado=contar_aproximado("pacientes"))
+
+def listar_duenos(cursor=None, hacia_atras=False, tamano=TAMANO_PAGINA):
+    # Dueños únicos agrupados por email (recorre el índice idx_pacientes_email en orden).
+    # Los pacientes sin email no tienen dueño identificable y no se listan.
+    # Sin total aproximado: no hay forma barata de contar emails distintos (sqlite_stat1 solo se
+    # actualiza con ANALYZE y el rango de rowid cuenta pacientes, no dueños).
+    consulta = """
+        SELECT propietario, telefono, email, COUNT(id) AS total_mascotas, email
+        FROM pacientes
+        WHERE email IS NOT NULL
+    """
+    return paginar(consulta, [("email", "ASC")], (), cursor, hacia_atras, tamano, agrupar="email")
+
+def listar_citas(cursor=None, hacia_atras=False, tamano=TAMANO_PAGINA):
+    # Próximas citas con el nombre de la mascota y su dueño (recorre idx_citas_fecha en orden)
+    consulta = """
+        SELECT citas.fecha, citas.hora, pacientes.nombre, pacientes.propietario,
+               citas.veterinario, citas.motivo,
+               citas.fecha, citas.hora, citas.id
+        FROM citas
+        JOIN pacientes ON citas.paciente_id = pacientes.id
+    """
+    orden = [("citas.fecha", "DESC"), ("citas.hora", "ASC"), ("citas.id", "ASC")]
+    return paginar(consulta, orden, (), cursor, hacia_atras, tamano,
+                   total_aproximado=contar_aproximado("citas"))
+
+
+# --- Agenda de veterinarios ---
+
+#Horas libres de un veterinario entre dos fechas (incluidas): diccionario fecha -> ['09:00', ...].
+#Una sola consulta por rango sobre idx_citas_veterinario; los huecos se calculan en memoria.
+def huecos_libres(veterinario, desde, hasta=None):
+    hasta = hasta or desde
+    agenda = Agenda()
+    ocupadas = read_query(
+        "SELECT fecha, hora FROM citas WHERE veterinario = ? AND fecha BETWEEN ? AND ?",
+        (veterinario, str(desde), str(hasta)))
+    for fecha, hora in ocupadas:
+        try:
+            agenda.anadir(veterinario, date.fromisoformat(fecha), hora)
+        except (CitaError, ValueError):
+            pass # Citas antiguas solapadas o con la fecha/hora mal escrita
+    return agenda.huecos_libres(veterinario, desde, hasta)
+
+#Guarda la cita solo si el veterinario no tiene otra que se solape. Devuelve True si se guardó.
+#La comprobación y el INSERT van en la misma transacción (BEGIN IMMEDIATE), así dos
+#recepcionistas no pueden reservar el mismo hueco a la vez. Si la bbdd sigue bloqueada por otro
+#proceso tras los reintentos lanza BaseDatosOcupadaError (la cita NO se ha guardado).
+def reservar_cita(paciente_id, fecha, hora, motivo, veterinario):
+    hora = normalizar_hora(hora)
+    desde, hasta = limites_solape(hora)
+    conn = get_connection()
+    try:
+        return escritor.escribir(_insertar_si_libre, (paciente_id, str(fecha), hora, motivo, veterinario,
+                                                      veterinario, str(fecha), desde, hasta), conn=conn)
+    finally:
+        cache_consultas.invalidar("citas")
+        conn.close()
+
+def _insertar_si_libre(conn, params):
+    c = conn.execute(
+        """
+        INSERT INTO citas (paciente_id, fecha, hora, motivo, veterinario)
+        SELECT ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (
+            SELECT 1 FROM citas
+            WHERE veterinario = ? AND fecha = ? AND hora > ? AND hora < ?
+        )
+        """, params)
+    return c.rowcount == 1
@@ -7,16 +7,16 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')
 
 import streamlit as st
 import pandas as pd
-from datetime import date
+from datetime import date, timedelta
 # Importamos Utils para usar la función de formatear nombre y buscar mejor
-from src import Veterinaria, Utils 
+from src import obtener_veterinaria, Utils 
+from src.exceptions import CitaSolapadaError, BaseDatosOcupadaError
 
-# Aqui utilizamos el patron de singleton o memoria persistente, streamlit lo que hace es que cada vez que 
-# un usuario hace clic, este se reinicia. Utilizamos la funcion st.session_state para que le diga a streamlit
-# todo lo que pongamos se quede en su memoria. 
-# st.session_state es como la caja de memoria
-if "mi_clinica" not in st.session_state:
-    st.session_state["mi_clinica"] = Veterinaria()
+# La Veterinaria es una sola para todo el servidor: todas las sesiones (y usuarios) comparten
+# los datos cargados, así la carga de la BBDD se paga una vez y no por cada navegador.
+# obtener_veterinaria() comprueba en cada ejecución (con un PRAGMA muy barato) si otra sesión
+# u otro proceso ha cambiado la BBDD, y solo entonces la recarga.
+veterinaria = obtener_veterinaria()
 
 # Control de acceso
 # Si no está loggeado, te dira que tienes que iniciar sesion
@@ -25,31 +25,37 @@ if "login_correcto" not in st.session_state or not st.session_state["login_corre
     st.stop()
 
 st.title("📅 Gestión de Citas")
-# Recupera el objeto único de la clínica de la memoria persistente de Streamlit.
-veterinaria = st.session_state["mi_clinica"]
 
 # --- 1. Formulario para Crear Cita ---
 st.subheader("Registrar Nueva Cita")
+# Veterinario y fecha fuera del formulario para recalcular las horas libres al cambiarlos
+col_vet, col_fecha = st.columns(2)
+with col_vet:
+    veterinario_responsable = st.selectbox("Veterinario Responsable", ["Dr. Rufino", "Dra. Ana", "Dr. Tomás"])
+with col_fecha:
+    fecha_cita = st.date_input("Fecha", value=date.today())
+horas_libres = veterinaria.huecos_libres(veterinario_responsable, fecha_cita)[fecha_cita]
+
 with st.form("form_cita"):
     st.write("Datos de la Mascota y el Dueño:")
     nombre_dueño = st.text_input("Nombre del Dueño", key="nombre_dueño_cita") 
     nombre_mascota = st.text_input("Nombre Mascota", key="mascota_cita")
     
     st.write("Detalles de la Cita:")
-    col1, col2 = st.columns(2)
-    with col1:
-        fecha_cita = st.date_input("Fecha", value=date.today())
-    with col2:
-        hora_cita = st.text_input("Hora (HH:MM)", value="10:00")
+    # Solo se ofrecen las horas en las que el veterinario no tiene ya otra cita
+    hora_cita = st.selectbox("Hora", options=horas_libres)
+    if not horas_libres:
+        st.warning(f"{veterinario_responsable} no tiene huecos libres el {fecha_cita}.")
         
     motivo = st.text_area("Motivo de la Cita")
-    veterinario_responsable = st.selectbox("Veterinario Responsable", ["Dr. Rufino", "Dra. Ana", "Dr. Tomás"])
     
     #Ponemos un boton para subirlo
     submitted = st.form_submit_button("Programar Cita")
     
     # Aqui tenemos que meter toda la logica de la busqueda
-    if submitted:
+    if submitted and not hora_cita:
+        st.error("❌ Error: No has seleccionado ninguna hora libre.")
+    elif submitted:
         cliente_encontrado = None
         
         # 1. Buscamos el cliente por nombre.
@@ -70,8 +76,13 @@ with st.form("form_cita"):
             
             if mascota_encontrada:
                 # Ahora tenemos que crear la cita con la funcion de veterinaria
-                veterinaria.crear_cita(fecha_cita, hora_cita, motivo, veterinario_responsable, mascota_encontrada)
-                st.success(f"✅ Cita programada para {mascota_encontrada.nombre} (Dueño: {cliente_encontrado.nombre}) con el {veterinario_responsable}.")
+                try:
+                    if veterinaria.crear_cita(fecha_cita, hora_cita, motivo, veterinario_responsable, mascota_encontrada):
+                        st.success(f"✅ Cita programada para {mascota_encontrada.nombre} (Dueño: {cliente_encontrado.nombre}) con el {veterinario_responsable}.")
+                    else:
+                        st.error("❌ Error: No se pudo guardar la cita.")
+                except (CitaSolapadaError, BaseDatosOcupadaError) as e:
+                    st.error(f"❌ {e}")
             else:
                 st.error(f"❌ Error: Mascota '{nombre_mascota}' no registrada para el cliente {cliente_encontrado.nombre}.")
 
@@ -80,16 +91,21 @@ with st.form("form_cita"):
 st.write("---")
 st.subheader("Citas Programadas")
 
-if veterinaria.citas:
-    datos = {
-        "Fecha": [c.fecha.strftime('%d/%m/%Y') for c in veterinaria.citas],
-        "Hora": [c.hora for c in veterinaria.citas],
-        "Mascota": [c.mascota.nombre for c in veterinaria.citas],
-        "Dueño": [c.mascota.cliente.nombre for c in veterinaria.citas], 
-        "Veterinario": [c.veterinario for c in veterinaria.citas],
-        "Motivo": [c.motivo for c in veterinaria.citas]
-    }
-    df = pd.DataFrame(datos)
-    st.dataframe(df, use_container_width=True)
+# Solo las citas de un rango de fechas: con carga perezosa, solo esos días se leen de la BBDD
+col_desde, col_hasta = st.columns(2)
+ver_desde = col_desde.date_input("Desde", value=date.today(), key="ver_desde")
+ver_hasta = col_hasta.date_input("Hasta", value=date.today() + timedelta(days=30), key="ver_hasta")
+# La tabla sale entera del almacén por columnas de la Veterinaria (sin recorrer las citas una a una)
+df = veterinaria.citas_dataframe(ver_desde, ver_hasta) if ver_desde <= ver_hasta else pd.DataFrame()
+
+if not df.empty:
+    # Mostramos las citas por páginas
+    TAMANO_PAGINA = 50
+    total_paginas = (len(df) - 1) // TAMANO_PAGINA + 1
+    num_pagina = st.number_input("Página", min_value=1, max_value=total_paginas, value=1, step=1)
+    inicio = (num_pagina - 1) * TAMANO_PAGINA
+    st.caption(f"Página {num_pagina} de {total_paginas} ({len(df)} citas)")
+    st.dataframe(df.iloc[inicio:inicio + TAMANO_PAGINA], use_container_width=True,
+                 column_config={"Fecha": st.column_config.DateColumn("Fecha", format="DD/MM/YYYY")})
 else:
-    st.info("No hay citas programadas.")
\ No newline at end of file
+    st.info("No hay citas programadas en esas fechas.")
\ No newline at end of file
@@ -3,7 +3,8 @@ import streamlit as st
 import pandas as pd
 from datetime import date
 # Importamos nuestras funciones de base de datos
-from db_utils import run_query, read_query, create_tables
+from db_utils import read_query, create_tables, listar_citas, huecos_libres, reservar_cita
+from paginador import paginador
 
 st.set_page_config(page_title="Gestión de Citas", page_icon="📅", layout="wide")
 
@@ -34,9 +35,23 @@ def app():
     st.subheader("✍️ Programar Nueva Cita")
 
     with st.container(border=True): 
+        # Veterinario y fecha van fuera del formulario: al cambiarlos se recalculan
+        # las horas libres (dentro de un st.form no se recarga hasta enviar)
+        col_vet, col_fecha = st.columns(2)
+        with col_vet:
+            veterinario_responsable = st.selectbox(
+                "Veterinario Responsable", 
+                ["Dr. Rufino", "Dra. Ana", "Dr. Tomás"]
+            )
+        with col_fecha:
+            fecha_cita = st.date_input("Fecha", value=date.today())
+
+        # Solo ofrecemos las horas que ese veterinario tiene libres ese día
+        opciones_hora = huecos_libres(veterinario_responsable, fecha_cita)[fecha_cita]
+
         with st.form("form_cita"):
             
-            col_mascota, col_vet = st.columns(2)
+            col_mascota, col_hora = st.columns(2)
             
             with col_mascota:
                 if not opciones_pacientes:
@@ -48,62 +63,38 @@ def app():
                         options=list(opciones_pacientes.keys())
                     )
 
-            with col_vet:
-                veterinario_responsable = st.selectbox(
-                    "Veterinario Responsable", 
-                    ["Dr. Rufino", "Dra. Ana", "Dr. Tomás"]
-                )
-            
-            st.divider()
-            
-            col_fecha, col_hora = st.columns(2)
-            
-            with col_fecha:
-                fecha_cita = st.date_input("Fecha", value=date.today())
             with col_hora:
-                # Generamos horas de 09:00 a 20:00
-                opciones_hora = [f"{h:02d}:00" for h in range(9, 21)] 
                 hora_cita = st.selectbox("Hora", options=opciones_hora)
+                if not opciones_hora:
+                    st.warning(f"{veterinario_responsable} no tiene huecos libres el {fecha_cita}.")
                 
             motivo = st.text_area("Motivo de la consulta", height=80)
             
             submitted = st.form_submit_button("✅ Programar Cita", type="primary")
             
             if submitted:
-                if paciente_seleccionado_nombre:
+                if not paciente_seleccionado_nombre:
+                    st.error("❌ No has seleccionado ningún paciente válido.")
+                elif not hora_cita:
+                    st.error("❌ No has seleccionado ninguna hora libre.")
+                else:
                     # Recuperamos el ID real usando el nombre seleccionado
                     paciente_id = opciones_pacientes[paciente_seleccionado_nombre]
                     
-                    # Guardamos en SQLite
-                    query = """
-                        INSERT INTO citas (paciente_id, fecha, hora, motivo, veterinario) 
-                        VALUES (?, ?, ?, ?, ?)
-                    """
-                    params = (paciente_id, str(fecha_cita), str(hora_cita), motivo, veterinario_responsable)
-                    
-                    run_query(query, params)
-                    st.success(f"✅ Cita programada para **{paciente_seleccionado_nombre}** el {fecha_cita} a las {hora_cita}.")
-                else:
-                    st.error("❌ No has seleccionado ningún paciente válido.")
+                    # Guardamos en SQLite (solo si nadie ha cogido el hueco mientras tanto)
+                    if reservar_cita(paciente_id, fecha_cita, hora_cita, motivo, veterinario_responsable):
+                        st.success(f"✅ Cita programada para **{paciente_seleccionado_nombre}** el {fecha_cita} a las {hora_cita}.")
+                    else:
+                        st.error(f"❌ {veterinario_responsable} ya tiene una cita a esa hora. Elige otro hueco.")
 
     # --- VISUALIZACIÓN DE CITAS ---
     st.write("---")
     st.subheader("📋 Próximas Citas")
 
-    # Hacemos un JOIN para traer el nombre del paciente en vez de solo su ID número
-    query_view = """
-        SELECT 
-            citas.fecha, 
-            citas.hora, 
-            pacientes.nombre, 
-            pacientes.propietario, 
-            citas.veterinario, 
-            citas.motivo 
-        FROM citas
-        JOIN pacientes ON citas.paciente_id = pacientes.id
-        ORDER BY citas.fecha DESC, citas.hora ASC
-    """
-    datos_citas = read_query(query_view)
+    # Hacemos un JOIN para traer el nombre del paciente en vez de solo su ID número,
+    # ordenado por fecha DESC y hora ASC, y leído por páginas
+    pagina = paginador("pagina_citas", listar_citas)
+    datos_citas = pagina.filas
 
     if datos_citas:
         df = pd.DataFrame(datos_citas, columns=["Fecha", "Hora", "Mascota", "Dueño", "Veterinario", "Motivo"])
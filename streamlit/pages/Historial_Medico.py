@@ -5,15 +5,12 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
 import streamlit as st
-from src import Veterinaria, Utils
+from src import obtener_veterinaria, Utils
 from datetime import date
 import pandas as pd
 
-# Aqui utilizamos el patron de singleton o memoria persistente, streamlit lo que hace es que cada vez que 
-# un usuario hace clic, este se reinicia. Utilizamos la funcion st.session_state para que le diga a streamlit
-# todo lo que pongamos se quede en su memoria.
-if "mi_clinica" not in st.session_state:
-    st.session_state["mi_clinica"] = Veterinaria()
+# Misma Veterinaria para todas las sesiones; se recarga sola si la BBDD cambió por fuera
+veterinaria = obtener_veterinaria()
 
 # Seguridad: Si no está logueado, detener la ejecución
 if "login_correcto" not in st.session_state or not st.session_state["login_correcto"]:
@@ -21,7 +18,6 @@ if "login_correcto" not in st.session_state or not st.session_state["login_corre
     st.stop()
 
 st.title("🩺 Historial Médico y Tratamientos")
-veterinaria = st.session_state["mi_clinica"]
 
 # --- 1. Búsqueda de Mascotas ---
 st.subheader("Buscar Mascota")
@@ -70,7 +66,8 @@ if "mascota_actual" in st.session_state and st.session_state["mascota_actual"]:
         st.write("#### Datos del Dueño y Paciente")
         st.write(f"**Dueño:** {cliente.nombre}") 
         st.write(f"**Raza:** {mascota.raza}")
-        st.write(f"**Fecha Nacimiento:** {mascota.fecha_nacimiento.strftime('%d/%m/%Y')}") 
+        nacimiento = mascota.fecha_nacimiento.strftime('%d/%m/%Y') if mascota.fecha_nacimiento else "Desconocida"
+        st.write(f"**Fecha Nacimiento:** {nacimiento}") 
 
         st.write("#### Registros Técnicos")
         
@@ -1,7 +1,8 @@
 import streamlit as st
 import pandas as pd
 # Importamos nuestras herramientas de base de datos
-from db_utils import read_query, run_query
+from db_utils import listar_duenos, eliminar_duenos
+from paginador import paginador
 
 st.set_page_config(page_title="Ver Clientes", page_icon="📋", layout="wide")
 
@@ -30,16 +31,9 @@ def app():
 
     # Primero agrupamos por email (GROUP BY email) para que cada dueño salga solo una vez.
     # Despues contamos cuántas filas tiene ese email (COUNT(id)) para saber cuántas mascotas tiene.
-    query = """
-        SELECT 
-            propietario, 
-            telefono, 
-            email, 
-            COUNT(id) as total_mascotas 
-        FROM pacientes 
-        GROUP BY email
-    """
-    datos = read_query(query)
+    # Se lee por páginas para no cargar todos los dueños de golpe.
+    pagina = paginador("pagina_clientes", listar_duenos)
+    datos = pagina.filas
 
     if not datos:
         st.info(" Aún no hay clientes registrados en la base de datos.")
@@ -63,39 +57,29 @@ def app():
         col_input, col_button = st.columns([3, 1])
         
         with col_input:
-            # Usamos un selectbox en vez de texto libre para evitar errores de dedo al borrar
+            # Usamos un multiselect en vez de texto libre para evitar errores de dedo al borrar.
+            # Se pueden elegir varios clientes y se borran todos a la vez.
+            # Solo salen los de la página que se está viendo (no se cargan todos los dueños).
             lista_emails = [row[2] for row in datos] if datos else []
-            email_eliminar = st.selectbox("Seleccionar Cliente a Eliminar", lista_emails) if lista_emails else st.text_input("Email")
+            emails_eliminar = st.multiselect("Seleccionar Cliente(s) de esta página a Eliminar", lista_emails,
+                                             help="Solo aparecen los clientes de la página actual; "
+                                                  "pasa de página para elegir otros.")
         
         with col_button:
             st.write(" ") 
             confirm_button = st.form_submit_button("🗑️ Eliminar Definitivamente", type="primary")
         
         if confirm_button:
-            if email_eliminar:
+            if emails_eliminar:
 
                 try:
-                    # 1. Primero averiguamos los IDs de las mascotas de este dueño
-                    mascotas = read_query("SELECT id FROM pacientes WHERE email = ?", (email_eliminar,))
-                    ids_mascotas = [m[0] for m in mascotas]
-                    
-                    if ids_mascotas:
-                        # Convertimos la lista de IDs a formato string para SQL (ej: "1, 2, 5")
-                        ids_str = ', '.join(map(str, ids_mascotas))
-
-                        # 2. Borramos Citas asociadas a esas mascotas
-
-                        for mid in ids_mascotas:
-                            run_query("DELETE FROM citas WHERE paciente_id = ?", (mid,))
-                            run_query("DELETE FROM historial WHERE paciente_id = ?", (mid,))
-                    
-                    # 3. Finalmente borramos al dueño/mascotas de la tabla principal
-                    run_query("DELETE FROM pacientes WHERE email = ?", (email_eliminar,))
+                    # Borramos citas, historial y mascotas de esos dueños en una sola transacción
+                    eliminar_duenos(emails_eliminar)
                     
                     # Guardamos mensaje y recargamos
                     st.session_state["mensaje_status"] = {
                         "tipo": "success", 
-                        "texto": f"✅ Cliente {email_eliminar} y sus datos han sido eliminados."
+                        "texto": f"✅ Cliente(s) {', '.join(emails_eliminar)} y sus datos han sido eliminados."
                     }
                     st.rerun()
                     
@@ -106,7 +90,7 @@ def app():
                     }
                     st.rerun()
             else:
-                st.error("No hay clientes seleccionables.")
+                st.error("Selecciona al menos un cliente.")
 
 if __name__ == "__main__":
     app()
\ No newline at end of file
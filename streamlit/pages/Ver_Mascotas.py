@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
-from db_utils import read_query
+from db_utils import read_query, buscar_pacientes, create_tables, listar_pacientes
+from paginador import paginador
 
 st.set_page_config(page_title="Listado de Pacientes", page_icon="🐾", layout="wide")
 
@@ -11,58 +12,63 @@ if "login_correcto" not in st.session_state or not st.session_state["login_corre
     st.stop() # Esto detiene la ejecución del resto de la página
 
 def app():
+    # Aseguramos que las tablas (y el índice de búsqueda) existan
+    create_tables()
+
     st.title("🐾 Listado de Pacientes")
     st.caption("Inventario completo de mascotas registradas en la base de datos.")
 
-
-    query = """
-        SELECT nombre, especie, raza, fecha_nacimiento, propietario, telefono, email 
-        FROM pacientes
-    """
-    datos = read_query(query)
-
-    if not datos:
+    # Solo comprobamos si hay alguna fila, sin traernos la tabla entera
+    if not read_query("SELECT 1 FROM pacientes LIMIT 1"):
         st.info(" No hay mascotas registradas todavía. Ve a 'Registrar Cliente' para añadir la primera.")
         return
 
-    # Convertimos los datos crudos a un DataFrame de Pandas
-    df = pd.DataFrame(datos, columns=[
-        "Nombre Mascota", 
-        "Especie", 
-        "Raza", 
-        "Fecha Nacimiento", 
-        "Dueño", 
-        "Teléfono", 
-        "Email"
-    ])
-
     # Filtros de Búsqueda 
     st.subheader("🔍 Buscador y Filtros")
     
     col_search, col_filter = st.columns([3, 1])
     
     with col_search:
-        # Busca texto en cualquier columna
+        # Busca texto en nombre, raza, especie, dueño o email
         search_term = st.text_input("Buscar por Nombre, Raza o Dueño", placeholder="Ej: Toby, Pastor Alemán, Juan...", key="search_mascota")
-        
-        if search_term:
-            # Conviertimos toda la fila a texto y buscamos la palabra clave
-            mask = df.apply(lambda row: search_term.lower() in row.astype(str).str.lower().to_string(), axis=1)
-            df = df[mask]
     
     with col_filter:
         # Filtro por Especie (Dinámico: solo muestra las especies que existen en la DB)
-        lista_especies = ['Todas'] + sorted(df['Especie'].unique().tolist())
+        especies = [fila[0] for fila in read_query("SELECT DISTINCT especie FROM pacientes WHERE especie IS NOT NULL ORDER BY especie")]
+        lista_especies = ['Todas'] + especies
         selected_especie = st.selectbox("Filtrar por Especie", lista_especies)
-        
-        if selected_especie != 'Todas':
-            df = df[df['Especie'] == selected_especie]
+    
+    especie = None if selected_especie == 'Todas' else selected_especie
+
+    if search_term:
+        # La búsqueda la hace SQLite con el índice FTS5: solo llegan las filas que coinciden,
+        # ya ordenadas por relevancia
+        datos = buscar_pacientes(search_term, especie=especie)
+    else:
+        # Sin búsqueda mostramos el listado por páginas (una página por clave de especie,
+        # así al cambiar el filtro se vuelve a la primera)
+        pagina = paginador(
+            f"pagina_mascotas_{selected_especie}",
+            lambda cursor, hacia_atras: listar_pacientes(cursor, hacia_atras, especie=especie)
+        )
+        datos = pagina.filas
+
+    # Convertimos los datos crudos a un DataFrame de Pandas
+    df = pd.DataFrame(datos, columns=[
+        "Nombre Mascota", 
+        "Especie", 
+        "Raza", 
+        "Fecha Nacimiento", 
+        "Dueño", 
+        "Teléfono", 
+        "Email"
+    ])
 
 
     st.divider()
     
     # Métrica de resumen
-    st.metric(label="Total de Pacientes Filtrados", value=len(df))
+    st.metric(label="Pacientes en pantalla", value=len(df))
     
     # Mostramos la tabla bonita
     st.dataframe(
@@ -0,0 +1,25 @@
+import streamlit as st
+
+# Controles "Anterior / Siguiente" para las consultas paginadas de db_utils.
+# El cursor de la página actual se guarda en st.session_state con la clave que se indique,
+# así al recargar la página (cada clic en Streamlit) seguimos en la misma página.
+
+def paginador(clave, leer_pagina):
+    # leer_pagina(cursor, hacia_atras) debe devolver una db_utils.Pagina
+    estado = st.session_state.get(clave, {"cursor": None, "hacia_atras": False})
+    pagina = leer_pagina(estado["cursor"], estado["hacia_atras"])
+
+    col_anterior, col_info, col_siguiente = st.columns([1, 3, 1])
+    with col_anterior:
+        if st.button("⬅️ Anterior", key=f"{clave}_anterior", disabled=pagina.cursor_anterior is None):
+            st.session_state[clave] = {"cursor": pagina.cursor_anterior, "hacia_atras": True}
+            st.rerun()
+    with col_info:
+        if pagina.total_aproximado is not None:
+            st.caption(f"Mostrando {len(pagina.filas)} de unos {pagina.total_aproximado} registros")
+    with col_siguiente:
+        if st.button("Siguiente ➡️", key=f"{clave}_siguiente", disabled=pagina.cursor_siguiente is None):
+            st.session_state[clave] = {"cursor": pagina.cursor_siguiente, "hacia_atras": False}
+            st.rerun()
+
+    return pagina
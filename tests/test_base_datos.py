@@ -1,13 +1,18 @@
 import pytest
 import sqlite3
+import threading
 from datetime import date, timedelta
 from src.utils import Utils
 import streamlit.db_utils as db_utils
+import src.db_connection as db_connection
 from src.veterinaria import Veterinaria
 from src.clientes import Cliente
 from src.mascotas import Mascota
 from src.citas import Cita
-from src.exceptions import ClienteNoEncontradoError, CitaError
+from src.exceptions import ClienteNoEncontradoError, CitaError, CitaSolapadaError
+from src.agenda import Agenda
+from src.veterinaria import obtener_veterinaria
+from src.concurrencia import CerrojoLectoresEscritor
 
 class ConnWrapper:
     def __init__(self, real_conn): self.real_conn = real_conn
@@ -24,6 +29,14 @@ def setup_db(monkeypatch):
     yield
     real_conn.close()
 
+#Lo mismo para la BBDD del paquete src: cada test usa su propio fichero temporal
+@pytest.fixture(autouse=True)
+def setup_db_src(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_connection, "DB_NAME", str(tmp_path / "veterinaria_test.db"))
+    db_connection.setup_database()
+    yield
+    db_connection.cerrar_pools()
+
 # Registro de clientes.
 def test_registro_cliente_logica():
     vet = Veterinaria()
@@ -168,4 +181,962 @@ def test_limpieza_veterinaria_profunda():
         vet.eliminar_cliente(email)
     except: pass
 
-    assert True
\ No newline at end of file
+    assert True
+
+# Pool de conexiones: reutiliza conexiones ya configuradas
+def test_pool_reutiliza_conexiones_configuradas():
+    with db_connection.conexion() as conn:
+        primera = conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1 # NORMAL
+    with db_connection.conexion() as conn:
+        assert conn is primera
+
+def test_pool_rollback_si_falla_el_bloque():
+    with pytest.raises(RuntimeError):
+        with db_connection.conexion() as conn:
+            conn.execute("INSERT INTO clientes (id_cliente, nombre) VALUES ('x', 'Ana')")
+            raise RuntimeError("fallo")
+    with db_connection.conexion() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM clientes").fetchone()[0] == 0
+
+def test_crud_src_con_pool():
+    vet = Veterinaria()
+    vet.inicializar()
+    cliente = vet.registrar_cliente("Ana", "600", "ana@test.com")
+    mascota = vet.registrar_mascota("ana@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+    vet.crear_cita(date.today(), "10:00", "Revision", "Dr. Rufino", mascota)
+    vet.inicializar()
+    assert vet.buscar_cliente("ANA@test.com").id == cliente.id
+    assert vet.buscar_mascota_por_id(mascota.id).nombre == "Toby"
+    assert len(vet.citas) == 1
+
+# Carga de clientes con una sola consulta JOIN, leyendo por bloques pequeños
+def test_iter_clientes_agrupa_mascotas_por_cliente():
+    from src.clientes import iter_clientes, cargar_clientes_db
+    vet = Veterinaria()
+    vet.inicializar()
+    vet.registrar_cliente("Ana", "600", "ana@test.com")
+    vet.registrar_cliente("Luis", "601", "luis@test.com")
+    vet.registrar_cliente("Eva", "602", "eva@test.com")
+    for nombre in ("Toby", "Kira", "Nala"):
+        vet.registrar_mascota("ana@test.com", nombre, "Perro", "Mestizo", date(2020, 1, 1))
+    vet.registrar_mascota("eva@test.com", "Coco", "Gato", "Siamés", date(2019, 5, 3))
+
+    clientes = list(iter_clientes(tamano_lote=2))
+    assert [c.email for c in clientes] == ["ana@test.com", "luis@test.com", "eva@test.com"]
+    assert sorted(m.nombre for m in clientes[0].mascotas) == ["Kira", "Nala", "Toby"]
+    assert clientes[1].mascotas == []
+    assert clientes[2].mascotas[0].fecha_nacimiento == date(2019, 5, 3)
+    assert len(cargar_clientes_db()) == 3
+
+    # A medio recorrer no se queda con ninguna conexión del pool y ve lo que se escribe después
+    recorrido = iter_clientes(tamano_lote=2)
+    assert next(recorrido).email == "ana@test.com"
+    pool = db_connection.obtener_pool()
+    assert pool._libres.qsize() == len(pool._todas)
+    vet.registrar_cliente("Pepe", "603", "pepe@test.com")
+    assert [c.email for c in recorrido] == ["luis@test.com", "eva@test.com", "pepe@test.com"]
+
+# Los índices de Veterinaria se mantienen al registrar y al borrar
+def test_indices_veterinaria_consistentes():
+    vet = Veterinaria()
+    vet.inicializar()
+    cliente = vet.registrar_cliente("Ana", "600", "Ana@Test.com")
+    mascota = vet.registrar_mascota("ana@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+    assert vet.buscar_cliente("ANA@TEST.COM") is cliente
+    assert vet.buscar_cliente_por_id(cliente.id) is cliente
+    assert vet.buscar_mascota_por_id(mascota.id) is mascota
+    assert vet.buscar_mascota_de_cliente("ana@test.com", "TOBY") is mascota
+
+    assert vet.eliminar_cliente("ana@test.com") is True
+    assert vet.buscar_cliente("ana@test.com") is None
+    assert vet.buscar_cliente_por_id(cliente.id) is None
+    assert vet.buscar_mascota_por_id(mascota.id) is None
+
+# Migraciones: se aplican una vez y luego no se ejecuta ningún DDL
+def test_migraciones_no_repiten_ddl():
+    from src.migraciones import aplicar_migraciones, version_esquema
+    conn = sqlite3.connect(":memory:")
+    assert aplicar_migraciones(conn, db_utils.MIGRACIONES) == db_utils.MIGRACIONES[-1][0]
+
+    sentencias = []
+    conn.set_trace_callback(sentencias.append)
+    aplicar_migraciones(conn, db_utils.MIGRACIONES)
+    assert not [s for s in sentencias if "CREATE" in s.upper()]
+    assert version_esquema(conn) == db_utils.MIGRACIONES[-1][0]
+
+def test_indices_secundarios_en_uso():
+    conn = db_utils.get_connection()
+    plan = conn.execute("""
+        EXPLAIN QUERY PLAN SELECT fecha, descripcion FROM historial
+        WHERE paciente_id = ? ORDER BY fecha DESC
+    """, (1,)).fetchall()
+    assert "idx_historial_paciente" in str(plan)
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT propietario, telefono, email, COUNT(id) FROM pacientes GROUP BY email").fetchall()
+    assert "COVERING INDEX idx_pacientes_email" in str(plan)
+
+# El historial médico se guarda en bloque y sobrevive a un reinicio
+def test_historial_persistente_con_buffer():
+    vet = Veterinaria()
+    vet.inicializar()
+    vet.registrar_cliente("Ana", "600", "ana@test.com")
+    vet.registrar_mascota("ana@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+    vet.anadir_vacuna("ana@test.com", "Toby", "Rabia", date(2024, 3, 1))
+    vet.registrar_peso("ana@test.com", "Toby", 12.5, date(2024, 3, 1))
+    vet.anadir_observacion("ana@test.com", "Toby", "Sano")
+    vet.anadir_tratamiento("ana@test.com", "Toby", "Antiparasitario")
+    assert vet.historial_pendiente.pendientes() == 4 # Aún no se ha escrito nada en disco
+
+    vet.inicializar() # Simula el reinicio: vacía el buffer y vuelve a cargar
+    historial = vet.buscar_mascota_de_cliente("ana@test.com", "Toby").historial_medico
+    assert historial["vacunas"] == [{"nombre": "Rabia", "fecha": "2024-03-01"}]
+    assert historial["peso"] == [{"peso": 12.5, "fecha": "2024-03-01"}]
+    assert historial["observaciones"] == ["Sano"]
+    assert historial["tratamientos"] == ["Antiparasitario"]
+
+def test_buffer_historial_descarta_solo_filas_invalidas():
+    from src.historial import BufferHistorial
+    vet = Veterinaria()
+    vet.inicializar()
+    vet.registrar_cliente("Ana", "600", "ana@test.com")
+    mascota = vet.registrar_mascota("ana@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+    buffer = BufferHistorial(tamano_lote=3)
+    buffer.anadir("vacunas", (mascota.id, "Rabia", "2024-01-01"))
+    buffer.anadir("vacunas", ("no-existe", "Moquillo", "2024-01-01"))
+    buffer.anadir("vacunas", (mascota.id, "Leptospira", "2024-01-01")) # Llena el lote y se guarda
+    assert buffer.pendientes() == 0
+    with db_connection.conexion() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM vacunas").fetchone()[0] == 2
+
+# Buscador FTS5: prefijos, acentos y sincronización por triggers
+def test_buscar_pacientes_fts():
+    insertar = "INSERT INTO pacientes (nombre, especie, raza, propietario, email) VALUES (?, ?, ?, ?, ?)"
+    db_utils.run_query(insertar, ("Toby", "Perro", "Pastor Alemán", "Juan Pérez", "juan@gmail.com"))
+    db_utils.run_query(insertar, ("Misi", "Gato", "Siamés", "Ana Tomás", "ana@clinica.es"))
+
+    assert [f[0] for f in db_utils.buscar_pacientes("tob")] == ["Toby"]
+    assert [f[0] for f in db_utils.buscar_pacientes("pastor alem")] == ["Toby"]
+    assert [f[0] for f in db_utils.buscar_pacientes("tomas")] == ["Misi"]
+    assert [f[0] for f in db_utils.buscar_pacientes("gmail")] == ["Toby"]
+    assert db_utils.buscar_pacientes("toby", especie="Gato") == []
+    assert db_utils.buscar_pacientes("  -  ") == []
+
+    db_utils.run_query("UPDATE pacientes SET nombre = 'Rex' WHERE nombre = 'Toby'")
+    assert db_utils.buscar_pacientes("toby") == []
+    assert [f[0] for f in db_utils.buscar_pacientes("rex")] == ["Rex"]
+    db_utils.run_query("DELETE FROM pacientes WHERE nombre = 'Rex'")
+    assert db_utils.buscar_pacientes("rex") == []
+
+# Paginación por clave: recorre todas las filas sin repetir y se puede volver atrás
+def test_paginacion_keyset_citas():
+    conn = db_utils.get_connection()
+    conn.executemany("INSERT INTO pacientes (nombre, propietario, email) VALUES (?, ?, ?)",
+                     [(f"Mascota{i}", f"Dueño{i % 4}", f"d{i % 4}@test.com") for i in range(10)])
+    conn.executemany("INSERT INTO citas (paciente_id, fecha, hora, veterinario) VALUES (?, ?, ?, ?)",
+                     [(i % 10 + 1, f"2024-01-{i % 5 + 1:02d}", f"{9 + i % 3:02d}:00", "Dr. Rufino") for i in range(23)])
+    conn.commit()
+
+    pagina = db_utils.listar_citas(tamano=5)
+    assert pagina.cursor_anterior is None
+    vistas = list(pagina.filas)
+    while pagina.cursor_siguiente:
+        pagina = db_utils.listar_citas(pagina.cursor_siguiente, tamano=5)
+        vistas += pagina.filas
+    assert len(vistas) == 23
+    assert [(f[0], f[1]) for f in vistas] == sorted(((f[0], f[1]) for f in vistas), key=lambda x: (-int(x[0][-2:]), x[1]))
+
+    anterior = db_utils.listar_citas(pagina.cursor_anterior, hacia_atras=True, tamano=5)
+    assert anterior.filas == vistas[15:20]
+
+    duenos = db_utils.listar_duenos(tamano=3)
+    assert [f[2] for f in duenos.filas] == ["d0@test.com", "d1@test.com", "d2@test.com"]
+    assert [f[3] for f in duenos.filas] == [3, 3, 2]
+    assert duenos.total_aproximado is None # No hay recuento barato de dueños distintos
+    assert db_utils.listar_duenos(duenos.cursor_siguiente, tamano=3).filas[0][2] == "d3@test.com"
+
+# Importación masiva desde CSV a los dos esquemas
+def _csv_importacion(tmp_path):
+    ruta = tmp_path / "clientes.csv"
+    ruta.write_text(
+        "propietario,telefono,email,nombre_mascota,especie,raza,fecha_nacimiento\n"
+        "Ana López,600,ana@test.com,Toby,Perro,Mestizo,2020-01-01\n"
+        "Ana López,600,ANA@test.com,Kira,Gato,Común,2021-02-02\n"
+        "Luis,601,luis-sin-arroba,Rex,Perro,Boxer,2019-03-03\n"
+        "Eva,602,eva@test.com,Coco,Ave,Loro,03/03/2019\n"
+        "Juan,603,juan@test.com,,,,\n",
+        encoding="utf-8"
+    )
+    return ruta
+
+def test_importar_csv_veterinaria(tmp_path):
+    from src.importacion import importar_csv
+    resultado = importar_csv(_csv_importacion(tmp_path), "veterinaria", tamano_lote=2) # Va a db_connection.DB_NAME
+    assert (resultado.clientes, resultado.mascotas) == (2, 2)
+    assert [numero for numero, _ in resultado.errores] == [4, 5]
+
+    vet = Veterinaria()
+    vet.inicializar()
+    assert sorted(m.nombre for m in vet.buscar_cliente("ana@test.com").mascotas) == ["Kira", "Toby"]
+    assert vet.buscar_cliente("juan@test.com").mascotas == []
+
+def test_importar_csv_clinica(tmp_path, monkeypatch):
+    from src.importacion import importar_csv
+    # Sin ruta va a db_utils.DB_NAME, aunque la BBDD aún no exista (se le aplican las migraciones)
+    ruta_bd = str(tmp_path / "clinica_test.db")
+    monkeypatch.setattr(db_utils, "DB_NAME", ruta_bd)
+    db_utils.cache_consultas.guardar("pacientes antes de importar", (), frozenset({"pacientes"}))
+
+    resultado = importar_csv(_csv_importacion(tmp_path), "clinica")
+    assert (resultado.clientes, resultado.mascotas) == (1, 2)
+    assert db_utils.cache_consultas.obtener("pacientes antes de importar") is None
+    assert [numero for numero, _ in resultado.errores] == [4, 5, 6] # Juan no tiene mascota
+    conn = sqlite3.connect(ruta_bd)
+    assert conn.execute("SELECT COUNT(DISTINCT propietario) FROM pacientes").fetchone()[0] == 1
+    conn.close()
+
+# Un dueño rechazado por la BBDD no deja un id ni una cuenta que no existen para las filas siguientes
+def test_importar_csv_dueno_rechazado(tmp_path):
+    from src.importacion import importar_csv
+    from src.migraciones import aplicar_migraciones
+    ruta_csv = tmp_path / "rechazos.csv"
+    ruta_csv.write_text(
+        "propietario,telefono,email,nombre_mascota\n"
+        "Malo,600,ana@test.com,Toby\n"
+        "Ana,600,ana@test.com,Kira\n"
+        "Luis,601,luis@test.com,Mala\n", encoding="utf-8")
+    with db_connection.conexion() as conn:
+        conn.execute("CREATE TRIGGER rechazar BEFORE INSERT ON clientes WHEN NEW.nombre = 'Malo' "
+                     "BEGIN SELECT RAISE(ABORT, 'rechazado'); END")
+    resultado = importar_csv(ruta_csv, "veterinaria", db_connection.DB_NAME, tamano_lote=1)
+    assert (resultado.clientes, resultado.mascotas) == (2, 2)
+    assert [numero for numero, _ in resultado.errores] == [2, 2] # El dueño y su mascota
+    vet = Veterinaria()
+    vet.inicializar()
+    assert [m.nombre for m in vet.buscar_cliente("ana@test.com").mascotas] == ["Kira"]
+
+    ruta_bd = str(tmp_path / "clinica_test.db")
+    conn = sqlite3.connect(ruta_bd)
+    aplicar_migraciones(conn, db_utils.MIGRACIONES)
+    conn.execute("CREATE TRIGGER rechazar BEFORE INSERT ON pacientes WHEN NEW.nombre = 'Mala' "
+                 "BEGIN SELECT RAISE(ABORT, 'rechazado'); END")
+    conn.close()
+    resultado = importar_csv(ruta_csv, "clinica", ruta_bd, tamano_lote=1)
+    assert (resultado.clientes, resultado.mascotas) == (1, 2) # Luis no tiene ninguna mascota guardada
+    assert [numero for numero, _ in resultado.errores] == [4]
+
+# Borrado por conjuntos: clientes, mascotas, citas e historial en una transacción
+def test_eliminar_clientes_en_bloque():
+    vet = Veterinaria()
+    vet.inicializar()
+    for hora, nombre in zip(("10:00", "11:00", "12:00"), ("ana", "luis", "eva")):
+        vet.registrar_cliente(nombre, "600", f"{nombre}@test.com")
+        mascota = vet.registrar_mascota(f"{nombre}@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+        vet.crear_cita(date(2024, 1, 1), hora, "Revision", "Dr. Rufino", mascota)
+        vet.anadir_vacuna(f"{nombre}@test.com", "Toby", "Rabia", date(2024, 1, 1))
+
+    assert vet.eliminar_clientes(["ana@test.com", "luis@test.com", "nadie@test.com", "ANA@test.com", "luis@test.com"]) == 2
+    assert [c.email for c in vet.clientes] == ["eva@test.com"]
+    assert len(vet.citas) == 1
+    with db_connection.conexion() as conn:
+        for tabla in ("clientes", "mascotas", "citas", "vacunas"):
+            assert conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0] == 1
+
+    # Si la BBDD no borra a un cliente, sigue en memoria y no se cuenta
+    vet.registrar_cliente("Luis", "601", "luis@test.com")
+    with db_connection.conexion() as conn:
+        conn.execute("CREATE TRIGGER conserva_luis BEFORE DELETE ON clientes WHEN OLD.email = 'luis@test.com' "
+                     "BEGIN SELECT RAISE(IGNORE); END")
+    assert vet.eliminar_clientes(["eva@test.com", "luis@test.com"]) == 1
+    assert [c.email for c in vet.clientes] == ["luis@test.com"]
+
+def test_eliminar_duenos_clinica():
+    db_utils.run_query("INSERT INTO pacientes (id, nombre, email) VALUES (1, 'Toby', 'ana@test.com')")
+    db_utils.run_query("INSERT INTO pacientes (id, nombre, email) VALUES (2, 'Kira', 'ana@test.com')")
+    db_utils.run_query("INSERT INTO pacientes (id, nombre, email) VALUES (3, 'Rex', 'luis@test.com')")
+    for paciente in (1, 2, 3):
+        db_utils.run_query("INSERT INTO citas (paciente_id, fecha, hora) VALUES (?, '2024-01-01', '10:00')", (paciente,))
+        db_utils.run_query("INSERT INTO historial (paciente_id, fecha, descripcion) VALUES (?, '2024-01-01', 'x')", (paciente,))
+
+    assert db_utils.eliminar_duenos(["ana@test.com", "ana@test.com", "nadie@test.com"]) == 1 # Dueños, no pacientes
+    assert db_utils.read_query("SELECT id FROM pacientes") == [(3,)]
+    assert db_utils.read_query("SELECT paciente_id FROM citas") == [(3,)]
+    assert db_utils.read_query("SELECT paciente_id FROM historial") == [(3,)]
+
+# Agenda: un veterinario no puede tener dos citas que se solapen
+def test_agenda_detecta_solapes_y_huecos():
+    agenda = Agenda()
+    dia = date(2024, 3, 1)
+    agenda.anadir("Dr. Rufino", dia, "10:00")
+    assert not agenda.esta_libre("Dr. Rufino", dia, "10:30")
+    assert agenda.esta_libre("Dr. Rufino", dia, "11:00")
+    assert agenda.esta_libre("Dra. Ana", dia, "10:00")
+    with pytest.raises(CitaSolapadaError):
+        agenda.anadir("Dr. Rufino", dia, "9:30")
+    huecos = agenda.huecos_libres("Dr. Rufino", dia, dia + timedelta(days=1))
+    assert "10:00" not in huecos[dia] and len(huecos[dia]) == 11
+    assert len(huecos[dia + timedelta(days=1)]) == 12
+
+def test_crear_cita_rechaza_solape():
+    vet = Veterinaria()
+    vet.inicializar()
+    vet.registrar_cliente("Ana", "600", "ana@test.com")
+    toby = vet.registrar_mascota("ana@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+    kira = vet.registrar_mascota("ana@test.com", "Kira", "Gato", "Siamés", date(2021, 1, 1))
+    dia = date(2024, 3, 1)
+    assert vet.crear_cita(dia, "9:00", "Revision", "Dr. Rufino", toby).hora == "09:00"
+    with pytest.raises(CitaSolapadaError):
+        vet.crear_cita(dia, "09:00", "Vacuna", "Dr. Rufino", kira)
+    assert len(vet.citas) == 1
+    assert "09:00" not in vet.huecos_libres("Dr. Rufino", dia)[dia]
+
+    # La BBDD también lo impide aunque la agenda en memoria no lo sepa (otra sesión, por ej.)
+    from src.citas import registrar_cita_db
+    with pytest.raises(CitaSolapadaError):
+        registrar_cita_db(Cita(dia, "09:30", "Vacuna", "Dr. Rufino", kira))
+    with db_connection.conexion() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM citas").fetchone()[0] == 1
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT 1 FROM citas WHERE veterinario = ? AND fecha = ? "
+                            "AND hora > ? AND hora < ?", ("x", "y", "a", "b")).fetchall()
+    assert "idx_citas_veterinario" in str(plan)
+
+def test_reservar_cita_clinica_solo_en_huecos_libres():
+    db_utils.run_query("INSERT INTO pacientes (id, nombre) VALUES (1, 'Toby')")
+    dia = date(2024, 3, 1)
+    assert db_utils.reservar_cita(1, dia, "10:00", "Revision", "Dra. Ana") is True
+    assert db_utils.reservar_cita(1, dia, "10:30", "Revision", "Dra. Ana") is False
+    assert db_utils.reservar_cita(1, dia, "10:00", "Revision", "Dr. Rufino") is True
+    huecos = db_utils.huecos_libres("Dra. Ana", dia)
+    assert "10:00" not in huecos[dia] and "11:00" in huecos[dia]
+
+# Modelos compactos: sin __dict__, historial creado al usarlo y textos repetidos compartidos
+def test_modelos_compactos():
+    cliente = Cliente("Ana", "600", "ana@test.com")
+    toby = Mascota("Toby", "".join(["Pe", "rro"]), "Mestizo", date(2020, 1, 1), cliente.id)
+    kira = Mascota("Kira", "".join(["Per", "ro"]), "Mestizo", date(2021, 1, 1), cliente.id)
+    cita = Cita(date(2024, 1, 1), "10:00", "Revision", "Dr. Rufino", toby)
+    for objeto in (cliente, toby, cita):
+        assert not hasattr(objeto, "__dict__")
+    assert toby.especie is kira.especie
+    assert toby._historial is None
+    toby.historial_medico["peso"].append({"peso": 10, "fecha": "2024-01-01"})
+    assert toby.historial_medico["peso"][0]["peso"] == 10
+    assert cita.id_cita == f"2024-01-01_10:00_{toby.id}" and cita.id_mascota == toby.id
+    cita.fecha = date(2024, 1, 2) # El ID no cambia aunque se mueva la cita
+    assert cita.id_cita == f"2024-01-01_10:00_{toby.id}"
+    cita.id_cita = "otro-id"
+    assert cita.id_cita == "otro-id"
+    assert Cita(date(2024, 1, 1), "10:00", "Revision", "Dr. Rufino", toby, "guardado").id_cita == "guardado"
+
+# Estado compartido: solo se recarga si otro proceso escribe en la BBDD, no por nuestras escrituras
+def test_veterinaria_compartida_detecta_cambios_externos():
+    vet = Veterinaria()
+    vet.inicializar()
+    assert obtener_veterinaria() is vet
+    vet.registrar_cliente("Ana", "600", "ana@test.com")
+    vet.registrar_mascota("ana@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+    assert not vet.hay_cambios_externos()
+
+    externa = sqlite3.connect(db_connection.DB_NAME)
+    externa.execute("INSERT INTO clientes (id_cliente, nombre, email) VALUES ('x1', 'Luis', 'luis@test.com')")
+    externa.commit()
+    externa.close()
+    assert vet.hay_cambios_externos()
+    assert obtener_veterinaria().buscar_cliente("luis@test.com") is not None
+    assert vet.buscar_cliente("ana@test.com") is not None
+    assert vet.refrescar_si_cambio() is False
+
+    # Otro proceso confirma justo entre nuestra escritura y el momento en que la damos por vista
+    import src.veterinaria as modulo_veterinaria
+    guardar_real = modulo_veterinaria.guardar_cliente_db
+    def guardar_y_otro_escribe(cliente):
+        futuro = guardar_real(cliente)
+        externa = sqlite3.connect(db_connection.DB_NAME)
+        externa.execute("INSERT INTO clientes (id_cliente, nombre, email) VALUES ('x2', 'Eva', 'eva@test.com')")
+        externa.commit()
+        externa.close()
+        return futuro
+    modulo_veterinaria.guardar_cliente_db = guardar_y_otro_escribe
+    try:
+        vet.registrar_cliente("Paz", "602", "paz@test.com")
+    finally:
+        modulo_veterinaria.guardar_cliente_db = guardar_real
+    assert vet.buscar_cliente("eva@test.com") is not None and vet.buscar_cliente("paz@test.com") is not None
+    assert not vet.hay_cambios_externos()
+
+    # Si se relee una mascota, lo que su historial aún tiene en el buffer (sin escribir) no se pierde
+    toby = vet.buscar_mascota_de_cliente("ana@test.com", "Toby")
+    vet.anadir_vacuna("ana@test.com", "Toby", "Rabia", date(2024, 3, 1))
+    externa = sqlite3.connect(db_connection.DB_NAME)
+    externa.execute("UPDATE mascotas SET raza = 'Podenco' WHERE id_mascota = ?", (toby.id,))
+    externa.commit()
+    externa.close()
+    vet.registrar_cliente("Leo", "603", "leo@test.com")
+    assert toby.raza == "Podenco" and toby.historial_medico["vacunas"] == [{"nombre": "Rabia", "fecha": "2024-03-01"}]
+    assert vet.historial_pendiente.pendientes() == 1
+
+def test_cerrojo_lectores_escritor():
+    import threading
+    cerrojo = CerrojoLectoresEscritor()
+    dentro = threading.Barrier(2, timeout=2)
+    orden = []
+
+    def leer():
+        with cerrojo.lectura():
+            dentro.wait() # Solo pasa si las dos lecturas están dentro a la vez
+            with cerrojo.lectura(): # Lectura anidada del mismo hilo
+                orden.append("lectura")
+
+    hilos = [threading.Thread(target=leer) for _ in range(2)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    with cerrojo.escritura():
+        with cerrojo.escritura(), cerrojo.lectura(): # El escritor puede volver a entrar
+            orden.append("escritura")
+    assert orden == ["lectura", "lectura", "escritura"]
+    with cerrojo.lectura():
+        with pytest.raises(RuntimeError): # Pasar de lectura a escritura se bloquearía para siempre
+            with cerrojo.escritura():
+                pass
+
+# Repositorio asíncrono: mismas operaciones, ejecutadas en hilos sin bloquear el bucle
+def test_repositorio_async():
+    import asyncio
+    from src.repositorio_async import RepositorioAsync
+
+    async def flujo():
+        async with RepositorioAsync(max_conexiones=4) as repo:
+            cliente = Cliente("Ana", "600", "ana@test.com")
+            assert await repo.registrar_cliente(cliente)
+            mascota = Mascota("Toby", "Perro", "Mestizo", date(2020, 1, 1), cliente.id)
+            assert await repo.registrar_mascota(mascota)
+            assert await repo.registrar_cita(Cita(date(2024, 1, 1), "10:00", "Revision", "Dra. Ana", mascota))
+            with pytest.raises(CitaSolapadaError):
+                await repo.registrar_cita(Cita(date(2024, 1, 1), "10:30", "Vacuna", "Dra. Ana", mascota))
+
+            clientes, citas, total = await repo.a_la_vez(
+                repo.cargar_clientes(),
+                repo.cargar_citas({mascota.id: mascota}),
+                repo.leer("SELECT COUNT(*) FROM mascotas"))
+            return clientes, citas, total
+
+    clientes, citas, total = asyncio.run(flujo())
+    assert [c.email for c in clientes] == ["ana@test.com"]
+    assert [c.hora for c in citas] == ["10:00"]
+    assert total == [(1,)]
+
+# El generador de datos de los benchmarks es determinista: misma semilla, mismas BBDD
+def test_generador_benchmarks_determinista(tmp_path):
+    from benchmarks.generador import Tamanos, generar
+    tamanos = Tamanos(clientes=20, mascotas=50, citas=300, historial=200, semilla=7)
+    volcados = []
+    for carpeta in ("a", "b"):
+        ruta_veterinaria, ruta_clinica = generar(str(tmp_path / carpeta), tamanos)
+        conn = sqlite3.connect(ruta_veterinaria)
+        volcados.append(list(conn.iterdump()))
+        assert conn.execute("SELECT COUNT(*) FROM citas").fetchone()[0] == 300
+        # Ningún veterinario tiene dos citas a la misma hora
+        assert conn.execute("SELECT COUNT(*) FROM (SELECT 1 FROM citas GROUP BY veterinario, fecha, hora "
+                            "HAVING COUNT(*) > 1)").fetchone()[0] == 0
+        conn.close()
+        conn = sqlite3.connect(ruta_clinica)
+        assert conn.execute("SELECT COUNT(*) FROM historial").fetchone()[0] == 200
+        conn.close()
+    assert volcados[0] == volcados[1]
+
+# Trazas de SQL: histograma por sentencia y log de consultas lentas con su plan
+def test_trazas_sql(tmp_path):
+    from src import trazas
+    fichero_log = tmp_path / "lentas.log"
+    trazas.trazador.reiniciar()
+    trazas.activar(umbral_ms=0, fichero=str(fichero_log)) # Con umbral 0 todas cuentan como lentas
+    try:
+        conn = db_connection.abrir_conexion(str(tmp_path / "trazas.db"))
+        assert isinstance(conn, trazas.ConexionTrazada)
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, nombre TEXT)")
+        conn.executemany("INSERT INTO t (nombre) VALUES (?)", [("a",), ("b",), ("c",)])
+        conn.commit()
+        for _ in range(2):
+            assert len(conn.execute("SELECT * FROM t WHERE id > ?", (1,)).fetchall()) == 2
+        filas = list(conn.execute("SELECT nombre FROM t"))
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 3 # Sin leer hasta el final
+        conn.close()
+    finally:
+        trazas.desactivar()
+
+    assert len(filas) == 3
+    por_sql = {e["sql"]: e for e in trazas.trazador.estadisticas()}
+    seleccion = por_sql["SELECT * FROM t WHERE id > ?"]
+    assert (seleccion["llamadas"], seleccion["filas"], seleccion["parametros"]) == (2, 4, 1)
+    assert sum(seleccion["histograma"].values()) == 2
+    assert por_sql["SELECT nombre FROM t"]["filas"] == 3
+    assert (por_sql["SELECT COUNT(*) FROM t"]["llamadas"], por_sql["SELECT COUNT(*) FROM t"]["filas"]) == (1, 1)
+    assert por_sql["INSERT INTO t (nombre) VALUES (?)"]["filas"] == 3
+    assert "COMMIT" in por_sql
+    assert "test_base_datos.py:test_trazas_sql" in trazas.trazador.por_origen()
+    contenido = fichero_log.read_text(encoding="utf-8")
+    assert "SELECT * FROM t WHERE id > ?" in contenido and "SEARCH t USING INTEGER PRIMARY KEY" in contenido
+    assert not isinstance(db_connection.abrir_conexion(str(tmp_path / "trazas.db")), trazas.ConexionTrazada)
+
+# Carga perezosa: mascotas al primer uso y citas solo de los días que se piden
+def test_carga_perezosa(monkeypatch):
+    vet = Veterinaria()
+    vet.inicializar()
+    vet.registrar_cliente("Ana", "600", "ana@test.com")
+    toby = vet.registrar_mascota("ana@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+    vet.anadir_vacuna("ana@test.com", "Toby", "Rabia", date(2024, 1, 1))
+    vet.historial_pendiente.vaciar()
+    vet.crear_cita(date(2024, 3, 1), "10:00", "Revision", "Dr. Rufino", toby)
+    vet.crear_cita(date(2024, 6, 1), "10:00", "Revision", "Dr. Rufino", toby)
+
+    monkeypatch.setattr(Veterinaria, "carga_perezosa", True)
+    vet.inicializar()
+    # Cargar añade a listas e índices que otras lecturas recorren: se hace con el cerrojo de escritura
+    import src.veterinaria as modulo_veterinaria
+    cargas = []
+    for nombre in ("leer_citas_db", "clientes_de_mascotas_db"):
+        original = getattr(modulo_veterinaria, nombre)
+        monkeypatch.setattr(modulo_veterinaria, nombre, lambda *a, _f=original: cargas.append(
+            vet._cerrojo._escritor == threading.get_ident()) or _f(*a))
+    ana = vet.buscar_cliente("ana@test.com")
+    assert not ana.mascotas_cargadas() and vet.citas == []
+
+    citas = vet.citas_entre(date(2024, 2, 1), date(2024, 3, 31))
+    assert [c.fecha for c in citas] == [date(2024, 3, 1)] and len(vet.citas) == 1
+    assert ana.mascotas_cargadas() and citas[0].mascota is vet.buscar_mascota_por_id(toby.id)
+    assert citas[0].mascota.historial_medico["vacunas"][0]["nombre"] == "Rabia"
+
+    # El día de junio no estaba cargado, pero la reserva lo carga antes de comprobar el hueco
+    with pytest.raises(CitaSolapadaError):
+        vet.crear_cita(date(2024, 6, 1), "10:30", "Vacuna", "Dr. Rufino", toby)
+    assert len(vet.citas_entre(date(2024, 1, 1), date(2024, 12, 31))) == 2
+    assert cargas and all(cargas)
+
+# Fechas y horas tipadas: la migración 5 convierte el texto antiguo y aparta lo que no entiende
+def test_migracion_fechas_y_horas_tipadas(tmp_path):
+    from src.migraciones import aplicar_migraciones
+    ruta = str(tmp_path / "antigua.db")
+    conn = db_connection.abrir_conexion(ruta)
+    aplicar_migraciones(conn, db_connection.MIGRACIONES[:4]) # Esquema de antes, con texto
+    conn.execute("INSERT INTO clientes (id_cliente, nombre, email) VALUES ('c1', 'Ana', 'ana@test.com')")
+    conn.executemany("INSERT INTO mascotas (id_mascota, nombre, fecha_nacimiento, cliente_id) VALUES (?, ?, ?, 'c1')",
+                     [("m1", "Toby", "2020-01-31"), ("m2", "Kira", "31/01/2020")])
+    conn.executemany("INSERT INTO citas VALUES (?, ?, ?, 'Revision', 'Dr. Rufino', 'm1')",
+                     [("a", "2024-03-01", "9:00"), ("b", "2024-03-02", "nueve"), ("c", "ayer", "10:00")])
+    conn.commit()
+
+    aplicar_migraciones(conn, db_connection.MIGRACIONES)
+    assert conn.execute("SELECT fecha_nacimiento FROM mascotas ORDER BY id_mascota").fetchall() == [(date(2020, 1, 31),), (None,)]
+    assert conn.execute("SELECT id_cita, fecha, hora, typeof(hora) FROM citas").fetchall() == [
+        ("a", date(2024, 3, 1), "09:00", "integer")]
+    assert conn.execute("SELECT tabla, clave, columna FROM filas_malformadas ORDER BY clave").fetchall() == [
+        ("citas", "b", "hora"), ("citas", "c", "fecha"), ("mascotas", "m2", "fecha_nacimiento")]
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT id_cita FROM citas WHERE fecha BETWEEN ? AND ?", (1, 2)).fetchall()
+    assert "idx_citas_fecha" in str(plan)
+    conn.close()
+
+# ETL clinica_vet.db -> veterinaria.db: dueños deduplicados por email y reanudable por marca de agua
+def test_etl_clinica_a_veterinaria(tmp_path):
+    from src.etl import migrar_clinica, id_mascota_de
+    from src.migraciones import aplicar_migraciones
+    ruta = str(tmp_path / "clinica.db")
+    clinica = sqlite3.connect(ruta)
+    aplicar_migraciones(clinica, db_utils.MIGRACIONES)
+    clinica.executemany("INSERT INTO pacientes (nombre, especie, fecha_nacimiento, propietario, telefono, email) "
+                        "VALUES (?, 'Perro', ?, ?, '600', ?)",
+                        [("Toby", "2020-01-01", "Ana", "ana@test.com"), ("Kira", "mal", "Ana", "ANA@test.com"),
+                         ("Rex", None, "Luis", "luis@test.com")])
+    clinica.executemany("INSERT INTO citas (paciente_id, fecha, hora, motivo, veterinario) VALUES (?, ?, ?, 'x', 'Dr. Rufino')",
+                        [(1, "2024-03-01", "9:00"), (2, "2024-03-01", "10:00"), (3, "2024-03-01", "luego"), (9, "2024-03-02", "9:00")])
+    clinica.execute("INSERT INTO historial (paciente_id, fecha, descripcion, tratamiento) VALUES (1, '2024-03-01', 'Cojea', 'Reposo')")
+    clinica.commit()
+
+    resultado = migrar_clinica(ruta, tamano_bloque=2)
+    assert (resultado.clientes, resultado.mascotas, resultado.citas, resultado.historial) == (2, 3, 2, 2)
+    assert resultado.malformadas == 3 # Fecha de Kira, hora ilegible y cita de un paciente que no existe
+    with db_connection.conexion() as conn:
+        assert conn.execute("SELECT COUNT(DISTINCT cliente_id) FROM mascotas WHERE id_mascota IN (?, ?)",
+                            (id_mascota_de(1), id_mascota_de(2))).fetchone()[0] == 1
+        assert conn.execute("SELECT fecha, hora FROM citas WHERE id_cita = 'clinica-cita-1'").fetchone() == (date(2024, 3, 1), "09:00")
+
+    # Segunda pasada: solo lo nuevo
+    clinica.execute("INSERT INTO pacientes (nombre, propietario, email) VALUES ('Nala', 'Ana', 'ana@test.com')")
+    clinica.commit()
+    clinica.close()
+    resultado = migrar_clinica(ruta)
+    assert (resultado.clientes, resultado.mascotas, resultado.citas, resultado.historial) == (0, 1, 0, 0)
+    vet = Veterinaria()
+    vet.inicializar()
+    assert [m.nombre for m in vet.buscar_cliente("ana@test.com").mascotas] == ["Toby", "Kira", "Nala"]
+
+# ETL: un dueño rechazado no se queda en el mapa y lo que ya estaba no cuenta como copiado
+def test_etl_dueno_rechazado(tmp_path):
+    from src.etl import migrar_clinica
+    from src.migraciones import aplicar_migraciones
+    ruta = str(tmp_path / "clinica.db")
+    clinica = sqlite3.connect(ruta)
+    aplicar_migraciones(clinica, db_utils.MIGRACIONES)
+    clinica.executemany("INSERT INTO pacientes (nombre, especie, propietario, email) VALUES (?, 'Perro', 'Ana', 'ana@test.com')",
+                        [("Toby",), ("Kira",)])
+    clinica.execute("INSERT INTO citas (paciente_id, fecha, hora, motivo, veterinario) VALUES (2, '2024-03-01', '9:00', 'x', 'Dr. Rufino')")
+    clinica.commit()
+    clinica.close()
+    db_connection.setup_database()
+    with db_connection.conexion() as conn:
+        # Solo falla en el primer bloque (aún sin marca de agua)
+        conn.execute("""CREATE TRIGGER rechaza_ana BEFORE INSERT ON clientes
+                        WHEN (SELECT COUNT(*) FROM etl_progreso WHERE tabla = 'pacientes') = 0
+                        BEGIN SELECT RAISE(ABORT, 'rechazado'); END""")
+
+    resultado = migrar_clinica(ruta, tamano_bloque=1)
+    assert (resultado.clientes, resultado.mascotas, resultado.citas) == (1, 1, 1)
+    assert resultado.malformadas == 2 # El cliente rechazado y su mascota (Toby)
+    with db_connection.conexion() as conn:
+        conn.execute("DROP TRIGGER rechaza_ana")
+        assert conn.execute("SELECT c.email FROM mascotas m JOIN clientes c ON c.id_cliente = m.cliente_id").fetchall() == [("ana@test.com",)]
+        conn.execute("DELETE FROM etl_progreso")
+
+    # Repetir desde cero: lo que ya estaba lo salta el INSERT OR IGNORE y no se cuenta
+    resultado = migrar_clinica(ruta)
+    assert (resultado.clientes, resultado.mascotas, resultado.citas) == (0, 1, 0) # Solo Toby es nuevo
+
+# ETL con veterinaria.db ocupada por otro proceso: error tipado sin avanzar la marca, y luego sigue
+def test_etl_con_bbdd_ocupada(tmp_path, monkeypatch):
+    from src import escritor
+    from src.etl import migrar_clinica
+    from src.exceptions import BaseDatosOcupadaError
+    from src.migraciones import aplicar_migraciones
+    monkeypatch.setattr(escritor, "PRESUPUESTO_S", 0.2)
+    ruta = str(tmp_path / "clinica.db")
+    clinica = sqlite3.connect(ruta)
+    aplicar_migraciones(clinica, db_utils.MIGRACIONES)
+    clinica.execute("INSERT INTO pacientes (nombre, propietario, email) VALUES ('Toby', 'Ana', 'ana@test.com')")
+    clinica.commit()
+    clinica.close()
+
+    bloqueo = sqlite3.connect(db_connection.DB_NAME)
+    bloqueo.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(BaseDatosOcupadaError):
+            migrar_clinica(ruta)
+    finally:
+        bloqueo.rollback()
+        bloqueo.close()
+    resultado = migrar_clinica(ruta)
+    assert (resultado.clientes, resultado.mascotas) == (1, 1)
+
+# Cola de escritura: muchas altas a la vez acaban en pocos commits y el diario recupera lo pendiente
+def test_cola_escritura_agrupa_y_recupera(tmp_path):
+    import threading, json
+    from src import cola_escritura
+    cola = cola_escritura.ColaEscritura(ventana_ms=200)
+    futuros = [cola.enviar("cliente", f"id{i}", f"Cliente {i}", f"c{i}@test.com", "600") for i in range(50)]
+    futuros.append(cola.enviar("cliente", "id0", "Repetido", "otro@test.com", "600"))
+    assert all(f.result() for f in futuros[:-1])
+    with pytest.raises(sqlite3.IntegrityError):
+        futuros[-1].result() # Falla solo la suya; las demás del lote se guardan
+    assert cola.lotes == 1
+    cola.cerrar()
+    assert open(cola.diario).read() == ""
+
+    # Una operación apuntada en el diario que no llegó a hacerse se repite al arrancar
+    with open(cola.diario, "w") as f:
+        f.write(json.dumps({"n": 1, "op": "cliente", "params": ["id99", "Eva", "eva@test.com", "600"]}) + "\n")
+    cola_escritura.ColaEscritura().cerrar()
+    with db_connection.conexion() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM clientes").fetchone()[0] == 51
+
+    # Veterinaria con la cola activa: las altas de varias sesiones se confirman sin recargar
+    vet = Veterinaria()
+    cola_escritura.activar()
+    try:
+        vet.inicializar()
+        hilos = [threading.Thread(target=vet.registrar_cliente, args=(f"S{i}", "600", f"s{i}@test.com")) for i in range(10)]
+        for h in hilos: h.start()
+        for h in hilos: h.join()
+        mascota = vet.registrar_mascota("s0@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+        vet.crear_cita(date(2024, 3, 1), "10:00", "Revision", "Dr. Rufino", mascota)
+        with pytest.raises(CitaSolapadaError):
+            vet.crear_cita(date(2024, 3, 1), "10:30", "Revision", "Dr. Rufino", mascota)
+    finally:
+        cola_escritura.desactivar()
+    assert len(vet.clientes) == 61 and not vet.hay_cambios_externos()
+    assert [c.hora for c in vet.citas] == ["10:00"]
+
+# Un Future cancelado o un lote que revienta no paran el hilo escritor; una cola parada no acepta más
+def test_cola_escritura_sobrevive_a_cancelaciones_y_fallos(monkeypatch):
+    from src import cola_escritura
+    cola = cola_escritura.ColaEscritura(ventana_ms=200)
+    cancelado = cola.enviar("cliente", "id1", "Ana", "ana@test.com", "600")
+    assert cancelado.cancel() # Aún esperaba en la ventana del lote
+    assert cola.enviar("cliente", "id2", "Luis", "luis@test.com", "600").result(timeout=5)
+    assert cola.viva()
+
+    def revienta(*args, **kwargs):
+        raise RuntimeError("fallo inesperado")
+    original = cola_escritura.escritor.escribir
+    monkeypatch.setattr(cola_escritura.escritor, "escribir", revienta)
+    with pytest.raises(RuntimeError):
+        cola.enviar("cliente", "id3", "Eva", "eva@test.com", "600").result(timeout=5)
+    monkeypatch.setattr(cola_escritura.escritor, "escribir", original)
+    assert cola.viva()
+    cola.cerrar()
+    with pytest.raises(RuntimeError):
+        cola.enviar("cliente", "id4", "Paz", "paz@test.com", "600")
+    with db_connection.conexion() as conn:
+        assert conn.execute("SELECT id_cliente FROM clientes").fetchall() == [("id2",)]
+
+# Caché de lecturas de db_utils: se sirve de memoria y solo se invalida lo que depende de la tabla escrita
+def test_cache_consultas_por_tabla(monkeypatch):
+    cache = db_utils.cache_consultas
+    db_utils.run_query("INSERT INTO pacientes (nombre, propietario, email) VALUES ('Toby', 'Ana', 'ana@test.com')")
+    sql_pacientes = "SELECT id, nombre FROM pacientes"
+    sql_citas = "SELECT c.fecha, p.nombre FROM citas c JOIN pacientes p ON p.id = c.paciente_id"
+    assert db_utils.tablas_leidas(sql_citas) == {"citas", "pacientes"}
+    assert db_utils.read_query(sql_pacientes) == [(1, "Toby")]
+    assert db_utils.read_query(sql_citas) == []
+    aciertos = cache.aciertos
+    db_utils.read_query(sql_pacientes)
+    assert cache.aciertos == aciertos + 1
+
+    db_utils.reservar_cita(1, date(2024, 3, 1), "10:00", "Revision", "Dra. Ana")
+    assert db_utils.read_query(sql_citas) == [("2024-03-01", "Toby")] # Invalidada por la escritura en citas
+    aciertos = cache.aciertos
+    db_utils.read_query(sql_pacientes) # Esta no lee de citas: sigue en caché
+    assert cache.aciertos == aciertos + 1
+    db_utils.run_query("UPDATE pacientes SET nombre = 'Rex' WHERE id = 1")
+    assert db_utils.read_query(sql_pacientes) == [(1, "Rex")]
+    assert db_utils.buscar_pacientes("rex")[0][0] == "Rex" # El índice FTS depende de pacientes
+
+    # Listas con comas, subconsultas y CTE; si no se entiende la consulta, no se guarda
+    sql_comas = "SELECT p.nombre FROM citas c, pacientes p WHERE p.id = c.paciente_id"
+    assert db_utils.tablas_leidas(sql_comas) == {"citas", "pacientes"}
+    assert db_utils.tablas_leidas("WITH h AS (SELECT paciente_id FROM historial) "
+                                  "SELECT * FROM h, (SELECT id FROM pacientes) p") == {"historial", "pacientes"}
+    assert db_utils.tablas_leidas("SELECT value FROM json_each(?)") is None
+    assert db_utils.read_query(sql_comas) == [("Rex",)]
+    db_utils.run_query("UPDATE pacientes SET nombre = 'Max' WHERE id = 1")
+    assert db_utils.read_query(sql_comas) == [("Max",)]
+
+    # Tamaño acotado (LRU) y caducidad
+    pequena = db_utils.CacheConsultas(tamano=2, ttl=10)
+    for n in range(3):
+        pequena.guardar(n, [n], frozenset({"t"}))
+    assert len(pequena) == 2 and pequena.obtener(0) is None and pequena.obtener(2) == [2]
+    monkeypatch.setattr(db_utils.time, "monotonic", lambda: float("inf"))
+    assert pequena.obtener(2) is None
+
+# Almacén de citas por columnas: sigue a las citas en memoria (altas y bajas) y da la tabla de la página
+def test_almacen_citas_por_columnas():
+    vet = Veterinaria()
+    vet.inicializar()
+    vet.registrar_cliente("Ana", "600", "ana@test.com")
+    vet.registrar_cliente("Luis", "601", "luis@test.com")
+    toby = vet.registrar_mascota("ana@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+    rex = vet.registrar_mascota("luis@test.com", "Rex", "Perro", "Beagle", date(2019, 1, 1))
+    vet.crear_cita(date(2024, 3, 2), "9:00", "Vacuna", "Dr. Rufino", rex)
+    vet.crear_cita(date(2024, 3, 1), "11:00", "Revision", "Dr. Rufino", toby)
+    almacen = vet.almacen_citas
+    assert list(almacen.horas) == [540, 660] and almacen.fechas[1] == date(2024, 3, 1).toordinal()
+    assert almacen.duenos == {rex.id: "Luis", toby.id: "Ana"}
+
+    vet.inicializar() # Recargado de la BBDD, el almacén queda igual
+    assert sorted(vet.almacen_citas.mascotas) == ["Rex", "Toby"]
+    vet.eliminar_clientes(["luis@test.com"])
+    assert vet.almacen_citas.mascotas == ["Toby"] and rex.id not in vet.almacen_citas.duenos
+
+    pd = pytest.importorskip("pandas") # La tabla solo hace falta en las páginas de Streamlit
+    df = vet.citas_dataframe(date(2024, 1, 1), date(2024, 12, 31))
+    assert df.to_dict("records") == [{"Fecha": pd.Timestamp(2024, 3, 1), "Hora": "11:00", "Mascota": "Toby",
+                                      "Dueño": "Ana", "Veterinario": "Dr. Rufino", "Motivo": "Revision"}]
+
+# Refresco incremental: los triggers marcan lo cambiado y refrescar() solo lee eso (nada de recargar todo)
+def test_refresco_incremental(monkeypatch):
+    import src.veterinaria as modulo_veterinaria
+    vet = Veterinaria()
+    vet.inicializar()
+    vet.registrar_cliente("Ana", "600", "ana@test.com")
+    vet.registrar_cliente("Luis", "601", "luis@test.com")
+    toby = vet.registrar_mascota("ana@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+    rex = vet.registrar_mascota("luis@test.com", "Rex", "Perro", "Beagle", date(2019, 1, 1))
+    vet.crear_cita(date(2024, 3, 1), "9:00", "Vacuna", "Dr. Rufino", toby)
+    vet.crear_cita(date(2024, 3, 1), "10:00", "Revision", "Dr. Rufino", rex)
+    def sin_recarga(*args, **kwargs):
+        raise AssertionError("refrescar no debe recargar la BBDD entera")
+    monkeypatch.setattr(modulo_veterinaria, "cargar_clientes_db", sin_recarga)
+    monkeypatch.setattr(modulo_veterinaria, "cargar_citas_db", sin_recarga)
+
+    externa = db_connection.abrir_conexion()
+    externa.execute("INSERT INTO clientes (id_cliente, nombre, email) VALUES ('x1', 'Eva', 'eva@test.com')")
+    externa.execute("INSERT INTO mascotas (id_mascota, nombre, especie, cliente_id) VALUES ('mx', 'Kira', 'Gato', 'x1')")
+    externa.execute("INSERT INTO citas VALUES ('cx', ?, 600, 'Revision', 'Dra. Paz', 'mx', 0)", (date(2024, 3, 1).toordinal(),))
+    externa.execute("UPDATE clientes SET nombre = 'Ana María' WHERE email = 'ana@test.com'")
+    externa.execute("INSERT INTO vacunas (id_mascota, nombre, fecha) VALUES (?, 'Rabia', '2024-03-01')", (toby.id,))
+    externa.execute("DELETE FROM clientes WHERE email = 'luis@test.com'")
+    externa.commit()
+    assert externa.execute("SELECT tabla FROM borrados ORDER BY secuencia").fetchall() == [
+        ("citas",), ("mascotas",), ("clientes",)] # Los ON DELETE CASCADE también dejan lápida
+    externa.close()
+
+    assert vet.refrescar_si_cambio() is True
+    assert vet.buscar_cliente("luis@test.com") is None and vet.buscar_mascota_por_id(rex.id) is None
+    assert vet.buscar_mascota_de_cliente("eva@test.com", "Kira").id == "mx"
+    assert [(c.id_cita, c.hora) for c in vet.citas_entre(date(2024, 3, 1), date(2024, 3, 1))] == [
+        (vet.citas[0].id_cita, "09:00"), ("cx", "10:00")]
+    assert vet.buscar_cliente("ana@test.com").nombre == "Ana María" and vet.almacen_citas.duenos[toby.id] == "Ana María"
+    assert toby.historial_medico["vacunas"] == [{"nombre": "Rabia", "fecha": "2024-03-01"}]
+    assert vet.refrescar() == 0 and len(vet.almacen_citas) == 2
+
+# Arranque: clientes, historial y citas se leen en hilos distintos y se enlazan al final; los tiempos van al log
+def test_arranque_en_paralelo(monkeypatch, caplog):
+    import threading
+    import src.veterinaria as modulo_veterinaria
+    vet = Veterinaria()
+    vet.inicializar()
+    vet.registrar_cliente("Ana", "600", "ana@test.com")
+    toby = vet.registrar_mascota("ana@test.com", "Toby", "Perro", "Mestizo", date(2020, 1, 1))
+    vet.crear_cita(date(2024, 3, 1), "9:00", "Vacuna", "Dr. Rufino", toby)
+    vet.anadir_vacuna("ana@test.com", "Toby", "Rabia", date(2024, 3, 1))
+
+    # Cada lectura espera a las otras dos: si no fueran a la vez, la barrera se rompería por tiempo
+    juntas, hilos = threading.Barrier(3, timeout=5), set()
+    def a_la_vez(funcion):
+        def envoltura(*args):
+            hilos.add(threading.current_thread().name)
+            juntas.wait()
+            return funcion(*args)
+        return envoltura
+    for nombre in ("cargar_clientes_db", "leer_historial_db", "leer_citas_db"):
+        monkeypatch.setattr(modulo_veterinaria, nombre, a_la_vez(getattr(modulo_veterinaria, nombre)))
+
+    with caplog.at_level("INFO", logger="Arranque"):
+        vet.inicializar()
+    assert len(hilos) == 3 and all(h.startswith("arranque") for h in hilos)
+    toby = vet.buscar_mascota_de_cliente("ana@test.com", "Toby")
+    assert toby.historial_medico["vacunas"] == [{"nombre": "Rabia", "fecha": "2024-03-01"}]
+    assert vet.citas[0].mascota is toby and vet.huecos_libres("Dr. Rufino", date(2024, 3, 1))[date(2024, 3, 1)][0] != "09:00"
+    mensaje = caplog.records[-1].getMessage()
+    assert all(fase in mensaje for fase in ("migraciones", "clientes y mascotas", "historial", "citas", "índices", "enlazar"))
+
+# Instantánea: si la BBDD no ha cambiado se arranca desde el fichero (sin SQL); si cambia, o está dañada, de SQL
+def test_instantanea_arranque(monkeypatch):
+    import os
+    import src.veterinaria as modulo_veterinaria
+    from src.instantanea import ruta_instantanea
+    vet = Veterinaria()
+    vet.inicializar()
+    vet.registrar_cliente("Ana", "600", "ana@test.com")
+    toby = vet.registrar_mascota("ana@test.com", "Toby", None, "Mestizo", None)
+    vet.crear_cita(date(2024, 3, 1), "9:00", "Vacuna", "Dr. Rufino", toby)
+    vet.anadir_vacuna("ana@test.com", "Toby", "Rabia", date(2024, 3, 1))
+    vet.registrar_peso("ana@test.com", "Toby", 7.5, date(2024, 3, 1))
+    vet.inicializar() # Carga de SQL, que deja la instantánea
+    assert os.path.exists(ruta_instantanea())
+
+    lecturas = []
+    for nombre in ("cargar_clientes_db", "leer_historial_db", "leer_citas_db"):
+        original = getattr(modulo_veterinaria, nombre)
+        monkeypatch.setattr(modulo_veterinaria, nombre,
+                            lambda *a, _f=original, _n=nombre: lecturas.append(_n) or _f(*a))
+    vet.inicializar()
+    assert lecturas == []
+    toby = vet.buscar_mascota_de_cliente("ana@test.com", "Toby")
+    assert (toby.especie, toby.fecha_nacimiento, vet.buscar_cliente("ana@test.com").telefono) == (None, None, "600")
+    assert toby.historial_medico["peso"] == [{"peso": 7.5, "fecha": "2024-03-01"}]
+    assert [(c.id_cita, c.mascota) for c in vet.citas] == [(f"2024-03-01_09:00_{toby.id}", toby)]
+    assert not vet.agenda.esta_libre("Dr. Rufino", date(2024, 3, 1), "09:30")
+
+    externa = db_connection.abrir_conexion()
+    externa.execute("UPDATE clientes SET telefono = '700'")
+    externa.commit()
+    externa.close()
+    vet.inicializar() # La BBDD ha cambiado: de SQL
+    assert "cargar_clientes_db" in lecturas and vet.buscar_cliente("ana@test.com").telefono == "700"
+
+    with open(ruta_instantanea(), "r+b") as f:
+        f.write(b"XXXX") # Dañada: se descarta y se vuelve a cargar de SQL
+    lecturas.clear()
+    vet.inicializar()
+    assert "cargar_clientes_db" in lecturas and len(vet.citas) == 1
+
+    # Borrar o corregir el historial desde fuera también invalida la instantánea (y se ve al refrescar)
+    vet.inicializar()
+    externa = db_connection.abrir_conexion()
+    externa.execute("DELETE FROM vacunas")
+    externa.commit()
+    lecturas.clear()
+    vet.inicializar()
+    toby = vet.buscar_mascota_de_cliente("ana@test.com", "Toby")
+    assert "cargar_clientes_db" in lecturas and toby.historial_medico["vacunas"] == []
+    externa.execute("UPDATE pesos SET peso = 8")
+    externa.commit()
+    externa.close()
+    assert vet.refrescar_si_cambio() is True
+    assert toby.historial_medico["peso"] == [{"peso": 8.0, "fecha": "2024-03-01"}]
+
+# Escrituras con la BBDD bloqueada por otra conexión: se reintenta y, si no se puede, error tipado
+def test_escritura_bloqueada_lanza_error_tipado(monkeypatch):
+    from src import escritor
+    from src.exceptions import BaseDatosOcupadaError
+    monkeypatch.setattr(escritor, "PRESUPUESTO_S", 0.2)
+    vet = Veterinaria()
+    vet.inicializar()
+    bloqueo = sqlite3.connect(db_connection.DB_NAME)
+    bloqueo.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(BaseDatosOcupadaError) as error:
+            vet.registrar_cliente("Ana", "600", "ana@test.com")
+        assert error.value.intentos > 1
+        assert vet.buscar_cliente("ana@test.com") is None # Se deshace también en memoria
+    finally:
+        bloqueo.rollback()
+        bloqueo.close()
+    assert vet.registrar_cliente("Ana", "600", "ana@test.com")
+
+def _escribir_en_proceso(ruta_vet, ruta_clinica, proceso, n, salida):
+    # Cada proceso da de alta n clientes en veterinaria.db y reserva n citas en clinica_vet.db
+    from src.clientes import guardar_cliente_db
+    db_connection.DB_NAME = ruta_vet
+    db_utils.DB_NAME = ruta_clinica
+    salida.wait()
+    for i in range(n):
+        guardar_cliente_db(Cliente(f"P{proceso}-{i}", "600", f"p{proceso}-{i}@test.com")).result()
+        assert db_utils.reservar_cita(1, date(2024, 1, 1) + timedelta(days=i), "10:00", "Revision", f"Dr. {proceso}")
+
+# Varios procesos escribiendo a la vez (y la BBDD bloqueada un rato al empezar): no se pierde nada
+def test_escrituras_concurrentes_multiproceso(tmp_path):
+    import time
+    import multiprocessing
+    from src.migraciones import aplicar_migraciones
+    ruta_vet, ruta_clinica = db_connection.DB_NAME, str(tmp_path / "clinica_test.db")
+    conn = sqlite3.connect(ruta_clinica)
+    aplicar_migraciones(conn, db_utils.MIGRACIONES)
+    conn.execute("INSERT INTO pacientes (id, nombre) VALUES (1, 'Toby')")
+    conn.commit()
+    conn.close()
+
+    procesos, n = 4, 25
+    contexto = multiprocessing.get_context("spawn") # Sin heredar hilos ni conexiones del proceso de pytest
+    salida = contexto.Event()
+    hijos = [contexto.Process(target=_escribir_en_proceso, args=(ruta_vet, ruta_clinica, p, n, salida))
+             for p in range(procesos)]
+    for h in hijos: h.start()
+    bloqueos = [sqlite3.connect(ruta) for ruta in (ruta_vet, ruta_clinica)]
+    for b in bloqueos: b.execute("BEGIN IMMEDIATE")
+    salida.set()
+    time.sleep(0.5) # Todos chocan con el bloqueo y tienen que esperar su turno
+    for b in bloqueos:
+        b.rollback()
+        b.close()
+    for h in hijos: h.join(60)
+    assert [h.exitcode for h in hijos] == [0] * procesos
+
+    with db_connection.conexion() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM clientes").fetchone()[0] == procesos * n
+    conn = sqlite3.connect(ruta_clinica)
+    assert conn.execute("SELECT COUNT(*) FROM citas").fetchone()[0] == procesos * n
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.close()